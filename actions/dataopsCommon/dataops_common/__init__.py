@@ -0,0 +1,2 @@
+from .manifest import MANIFEST_VERSION, WorkspaceManifest
+from .profiling import Profiler
@@ -0,0 +1,68 @@
+"""Workspace manifest written by findSqlFolderAction and read by the actions that run after it.
+
+The manifest is JSON lines. The first line is a header:
+
+    {"manifest_version": 2, "root": "/abs/workspace", "ops_types": [...], "base_ref": ..., "git_ref": ...}
+
+and every other line is one data-ops folder:
+
+    {"name": "claims", "relative_path": "db/claims", "type": "stored_proc", "config": {...},
+     "sql_files": [{"path": "tables/load.sql"}, ...]}
+
+config is the folder's data-ops-config without its type, and sql_files lists every SQL file below
+the folder relative to it, without hashes. Readers hash the files they open themselves.
+"""
+import json
+import mmap
+import os
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+MANIFEST_VERSION = 2
+MANIFEST_FILE_SUFFIXES = (".sql",)
+# Order folders are deployed in, the folder-list outputs of findSqlFolderAction follow it too
+DEPLOY_ORDER = ("stored_proc", "tdv_ddl", "tdv_dml")
+
+
+def write_manifest_line(stream: TextIO, entry: dict):
+    """Write the header or one folder record as a manifest line."""
+    stream.write(json.dumps(entry, sort_keys=True, default=str) + "\n")
+
+
+class WorkspaceManifest:
+    """Reads a workspace manifest without loading all of it.
+
+    Only the header is parsed up front; iter_folders maps the file and decodes one folder record
+    per line, so a large manifest is never held in memory as a whole. Folder paths are relative to
+    the workspace: root defaults to GITHUB_WORKSPACE, then to the root the manifest was written for.
+    """
+
+    def __init__(self, path: str, root: Optional[str] = None):
+        self.path = path
+        with open(path, "rb") as manifest_file:
+            self.header = json.loads(manifest_file.readline() or b"{}")
+        if self.header.get("manifest_version") != MANIFEST_VERSION:
+            raise ValueError(f"{path} is not a version {MANIFEST_VERSION} workspace manifest")
+        self.root = root or os.environ.get("GITHUB_WORKSPACE") or self.header.get("root") or os.getcwd()
+
+    def iter_folders(self) -> Iterator[dict]:
+        with open(self.path, "rb") as manifest_file:
+            if os.fstat(manifest_file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(manifest_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                mapped.readline()
+                for line in iter(mapped.readline, b""):
+                    if line.strip():
+                        yield json.loads(line)
+
+    def folder_path(self, record: dict) -> str:
+        return os.path.join(self.root, record["relative_path"])
+
+    def folder_paths(self, ops_types: Optional[Iterable[str]] = None) -> List[str]:
+        """Folder paths in manifest order, or grouped by ops_types in that order, other types left out."""
+        if ops_types is None:
+            return [self.folder_path(record) for record in self.iter_folders()]
+        by_type = {ops_type: [] for ops_type in ops_types}
+        for record in self.iter_folders():
+            if record.get("type") in by_type:
+                by_type[record["type"]].append(self.folder_path(record))
+        return [folder for folders in by_type.values() for folder in folders]
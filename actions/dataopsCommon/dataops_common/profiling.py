@@ -0,0 +1,129 @@
+"""Profiling shared by the data-ops command line tools.
+
+Each tool keeps one module level Profiler, instruments its phases with PROFILER.phase(name) and
+wraps its main in PROFILER.profiling(path, module_name, import_dir) behind a --profile option.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+
+# Functions and imports listed in a profile, and one line of python -X importtime output
+PROFILE_TOP_FUNCTIONS = 30
+PROFILE_TOP_IMPORTS = 20
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+_NULL_PHASE = nullcontext()
+
+
+def _import_time_breakdown(module_name: str, import_dir: Optional[str] = None) -> dict:
+    """Import module_name in a fresh interpreter with -X importtime and return its slowest imports.
+
+    The running process paid for its imports before profiling started, so they are measured again.
+    The interpreter runs in import_dir, the directory of the profiled module.
+    """
+    try:
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                                   cwd=import_dir or os.getcwd(), capture_output=True, text=True, timeout=120)
+    except (OSError, subprocess.SubprocessError) as e:
+        return {"module": module_name, "error": str(e)}
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            imports.append({"module": match.group(4), "depth": len(match.group(3)) // 2,
+                            "self_seconds": int(match.group(1)) / 1e6, "cumulative_seconds": int(match.group(2)) / 1e6})
+    total = next((entry["cumulative_seconds"] for entry in imports if entry["module"] == module_name), None)
+    breakdown = {"module": module_name, "total_seconds": total,
+                 "slowest": sorted(imports, key=lambda entry: entry["self_seconds"], reverse=True)[:PROFILE_TOP_IMPORTS]}
+    if completed.returncode != 0:
+        breakdown["error"] = completed.stderr.strip().splitlines()[-1:]
+    return breakdown
+
+
+class Profiler:
+    """Opt-in profile of one CLI run: phase timers, cProfile, tracemalloc peak and import times.
+
+    Outside profiling() phase() hands back one shared null context, so instrumented code pays a
+    method call and nothing else. The profile is written as JSON to the given path, and the raw
+    cProfile stats next to it as <path>.pstats for pstats or snakeviz. Phases may nest, their
+    seconds are inclusive. cProfile only sees the thread that entered profiling().
+    """
+
+    def __init__(self):
+        self.path = None
+        self.phases = {}
+
+    def phase(self, name: str):
+        return self._timed(name) if self.path else _NULL_PHASE
+
+    @contextmanager
+    def _timed(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def add_phase(self, name: str, seconds: float):
+        if self.path:
+            total, calls = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + seconds, calls + 1)
+
+    @contextmanager
+    def profiling(self, path: Optional[str], module_name: str, import_dir: Optional[str] = None):
+        """Profile the body when path is set and write the result there, even when the body fails.
+
+        module_name is imported again from import_dir to measure its import times.
+        """
+        if not path:
+            yield self
+            return
+        self.path, self.phases = path, {}
+        profile = cProfile.Profile()
+        # A caller already tracing memory, like the benchmarks, keeps its trace running
+        owns_trace = not tracemalloc.is_tracing()
+        if owns_trace:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield self
+        finally:
+            profile.disable()
+            wall_seconds = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            if owns_trace:
+                tracemalloc.stop()
+            self.path = None
+            self._write(path, module_name, import_dir, profile, wall_seconds, peak)
+
+    def _write(self, path: str, module_name: str, import_dir: Optional[str], profile: cProfile.Profile,
+               wall_seconds: float, peak: int):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        profile.dump_stats(path + ".pstats")
+        functions = sorted(pstats.Stats(profile).stats.items(), key=lambda item: item[1][3], reverse=True)
+        result = {
+            "module": module_name,
+            "argv": sys.argv[1:],
+            "wall_seconds": round(wall_seconds, 6),
+            "peak_traced_memory_bytes": peak,
+            "phases": {name: {"seconds": round(seconds, 6), "calls": calls}
+                       for name, (seconds, calls) in self.phases.items()},
+            "functions": [{"function": f"{filename}:{line}({name})", "calls": calls, "primitive_calls": primitive_calls,
+                           "own_seconds": round(own_seconds, 6), "cumulative_seconds": round(cumulative_seconds, 6)}
+                          for (filename, line, name), (primitive_calls, calls, own_seconds, cumulative_seconds, _)
+                          in functions[:PROFILE_TOP_FUNCTIONS]],
+            "imports": _import_time_breakdown(module_name, import_dir),
+        }
+        with open(path, "w") as profile_file:
+            json.dump(result, profile_file, indent=2)
@@ -0,0 +1,38 @@
+import io
+import json
+
+import pytest
+
+from dataops_common.manifest import MANIFEST_VERSION, WorkspaceManifest, write_manifest_line
+
+
+def _write_manifest(path, records, **header):
+    stream = io.StringIO()
+    write_manifest_line(stream, {"manifest_version": MANIFEST_VERSION, **header})
+    for record in records:
+        write_manifest_line(stream, record)
+    path.write_text(stream.getvalue())
+
+
+def test_reader_yields_folders_relative_to_root(tmp_path, monkeypatch):
+    monkeypatch.delenv("GITHUB_WORKSPACE", raising=False)
+    manifest_path = tmp_path / "manifest.jsonl"
+    records = [{"name": "claims", "relative_path": "db/claims", "sql_files": [{"path": "load.sql"}]},
+               {"name": "members", "relative_path": "db/members", "sql_files": []}]
+    _write_manifest(manifest_path, records, root="/written/root")
+
+    manifest = WorkspaceManifest(str(manifest_path))
+
+    assert list(manifest.iter_folders()) == records
+    assert manifest.folder_paths() == ["/written/root/db/claims", "/written/root/db/members"]
+    assert WorkspaceManifest(str(manifest_path), "/other").folder_paths()[0] == "/other/db/claims"
+    monkeypatch.setenv("GITHUB_WORKSPACE", "/workspace")
+    assert WorkspaceManifest(str(manifest_path)).folder_paths()[1] == "/workspace/db/members"
+
+
+def test_reader_rejects_other_versions(tmp_path):
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest_path.write_text(json.dumps({"manifest_version": 1}) + "\n")
+
+    with pytest.raises(ValueError, match=f"version {MANIFEST_VERSION}"):
+        WorkspaceManifest(str(manifest_path))
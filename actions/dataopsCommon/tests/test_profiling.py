@@ -0,0 +1,43 @@
+import json
+
+from dataops_common.profiling import Profiler
+
+
+def test_phases_are_free_outside_profiling():
+    profiler = Profiler()
+
+    assert profiler.phase("scan") is profiler.phase("other")
+    profiler.add_phase("scan", 1.0)
+    assert profiler.phases == {}
+
+
+def test_profiling_writes_phases_functions_and_imports(tmp_path):
+    (tmp_path / "profiled_module.py").write_text("import json\n")
+    profile_path = tmp_path / "profile" / "run.json"
+    profiler = Profiler()
+
+    with profiler.profiling(str(profile_path), "profiled_module", str(tmp_path)):
+        with profiler.phase("scan"):
+            sorted(range(1000))
+        profiler.add_phase("logon", 0.5)
+
+    profile = json.loads(profile_path.read_text())
+    assert profile["module"] == "profiled_module"
+    assert profile["phases"]["scan"]["calls"] == 1
+    assert profile["phases"]["logon"] == {"seconds": 0.5, "calls": 1}
+    assert profile["functions"]
+    assert profile["imports"]["total_seconds"] > 0
+    assert (tmp_path / "profile" / "run.json.pstats").exists()
+    assert profiler.path is None
+
+
+def test_profiling_is_a_no_op_without_a_path(tmp_path):
+    profiler = Profiler()
+
+    with profiler.profiling(None, "profiled_module") as active:
+        with profiler.phase("scan"):
+            pass
+
+    assert active is profiler
+    assert profiler.phases == {}
+    assert list(tmp_path.iterdir()) == []
@@ -1 +1 @@
-from .toml_utilities import TomlUtilities, config_list_to_str_for_console_output
+from .toml_utilities import DiscoveryIndex, TomlUtilities, config_list_to_str_for_console_output
@@ -0,0 +1,251 @@
+"""Discovery benchmarks on synthetic monorepos.
+
+Run from the toml_utilities directory:
+
+    python -m benchmarks.bench_discovery --sizes 100 1000 10000 50000 --output bench_results.json
+    python -m benchmarks.bench_discovery --sizes 1000 --compare bench_results.json
+
+Each size builds a throwaway workspace with data-ops projects, plain Poetry projects and junk
+subtrees, then times parse_data_ops_configurations, generate_yaml_config and the CLI end to end.
+Results are written as JSON so runs of different versions can be compared.
+"""
+import argparse
+import builtins
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from toml_utilities import TomlUtilities
+
+SCRIPT_PATH = Path(__file__).parent.parent / "toml_utilities.py"
+DEFAULT_TYPE_MIX = {"tdv_ddl": 0.4, "tdv_dml": 0.3, "stored_proc": 0.3}
+RESULTS_VERSION = 1
+
+
+def generate_workspace(root: str, directories: int, depth: int = 4, config_density: float = 0.1,
+                       poetry_density: float = 0.2, type_mix: Optional[Dict[str, float]] = None,
+                       junk_directories: int = 0, seed: int = 0) -> Dict[str, int]:
+    """Build a synthetic workspace under root and return what was created.
+
+    Directories are spread evenly over ``depth`` levels. Each one gets a data-ops pyproject.toml
+    with probability ``config_density``, otherwise a plain Poetry pyproject.toml with probability
+    ``poetry_density``. Junk subtrees mimic .git, the unpacked liquibase/lib, lib and node_modules.
+    """
+    rng = random.Random(seed)
+    type_mix = type_mix or DEFAULT_TYPE_MIX
+    types, weights = list(type_mix), list(type_mix.values())
+    fan_out = max(2, round(directories ** (1 / max(depth, 1))))
+    created = {"directories": 0, "data_ops_configs": 0, "poetry_projects": 0, "junk_directories": 0}
+    for number in range(directories):
+        parts, remainder = [], number
+        for _ in range(depth):
+            parts.append(f"dir_{remainder % fan_out}")
+            remainder //= fan_out
+        directory = os.path.join(root, *reversed(parts), f"project_{number}")
+        os.makedirs(directory, exist_ok=True)
+        created["directories"] += 1
+        draw = rng.random()
+        if draw < config_density:
+            ops_type = rng.choices(types, weights)[0]
+            _write(os.path.join(directory, "pyproject.toml"),
+                   f'[tool.poetry]\nname = "project-{number}"\nversion = "0.1.0"\n\n'
+                   f'[data-ops-config]\ntype = "{ops_type}"\ns3-prefix = "prefix_{number}"\n'
+                   f'path-to-sql = "tables"\npath-to-changelog = "changelog"\n')
+            os.makedirs(os.path.join(directory, "tables"), exist_ok=True)
+            _write(os.path.join(directory, "tables", "object.sql"), "SELECT 1;\n")
+            created["data_ops_configs"] += 1
+        elif draw < config_density + poetry_density:
+            _write(os.path.join(directory, "pyproject.toml"),
+                   f'[tool.poetry]\nname = "project-{number}"\nversion = "0.1.0"\n\n'
+                   f'[tool.poetry.dependencies]\npython = "^3.9"\n')
+            created["poetry_projects"] += 1
+    junk_roots = [".git/objects", "liquibase/lib", "lib", "node_modules"]
+    for number in range(junk_directories):
+        directory = os.path.join(root, junk_roots[number % len(junk_roots)], f"{number:02x}", f"junk_{number}")
+        os.makedirs(directory, exist_ok=True)
+        _write(os.path.join(directory, "pyproject.toml"), '[tool.poetry]\nname = "junk"\n')
+        created["junk_directories"] += 1
+    return created
+
+
+def _write(path: str, content: str):
+    with open(path, "w") as file:
+        file.write(content)
+
+
+def _read_proc_io() -> Dict[str, int]:
+    try:
+        with open("/proc/self/io") as io_file:
+            return {key: int(value) for key, value in (line.split(": ") for line in io_file)}
+    except OSError:
+        return {}
+
+
+@contextmanager
+def count_filesystem_calls() -> Iterator[Dict[str, int]]:
+    """Count os.scandir, os.stat and open calls made while the block runs.
+
+    The read/write syscall counters of /proc/self/io are added where the platform provides them.
+    """
+    counts = {"scandir": 0, "stat": 0, "open": 0}
+    originals = {"scandir": os.scandir, "stat": os.stat, "open": builtins.open}
+
+    def counting(name):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return originals[name](*args, **kwargs)
+        return wrapper
+
+    io_before = _read_proc_io()
+    os.scandir, os.stat, builtins.open = counting("scandir"), counting("stat"), counting("open")
+    try:
+        yield counts
+    finally:
+        os.scandir, os.stat, builtins.open = originals["scandir"], originals["stat"], originals["open"]
+        io_after = _read_proc_io()
+        for key in ("syscr", "syscw"):
+            if key in io_before and key in io_after:
+                counts[key] = io_after[key] - io_before[key]
+
+
+def time_in_process(function, repeat: int) -> Dict[str, object]:
+    wall_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        wall_times.append(time.perf_counter() - started)
+    with count_filesystem_calls() as calls:
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"wall_seconds_min": min(wall_times), "wall_seconds_median": statistics.median(wall_times),
+            "calls": calls, "peak_traced_bytes": peak}
+
+
+def time_cli(args: List[str], repeat: int) -> Dict[str, object]:
+    """Run the CLI as a child process, recording wall time and its own peak RSS via wait4."""
+    wall_times, max_rss_kb = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(SCRIPT_PATH), *args],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            max_rss_kb = max(max_rss_kb, usage.ru_maxrss)
+        else:
+            process.wait()
+        wall_times.append(time.perf_counter() - started)
+        if process.returncode != 0:
+            raise RuntimeError(f"CLI run {args} exited with {process.returncode}")
+    result = {"wall_seconds_min": min(wall_times), "wall_seconds_median": statistics.median(wall_times),
+              "peak_rss_kb": max_rss_kb}
+    syscalls = _count_cli_syscalls(args)
+    if syscalls is not None:
+        result["syscalls"] = syscalls
+    return result
+
+
+def _count_cli_syscalls(args: List[str]) -> Optional[int]:
+    if shutil.which("strace") is None:
+        return None
+    with tempfile.NamedTemporaryFile(suffix=".strace") as summary:
+        completed = subprocess.run(["strace", "-f", "-c", "-o", summary.name, sys.executable, str(SCRIPT_PATH), *args],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            return None
+        total = [line.split() for line in Path(summary.name).read_text().splitlines() if line.rstrip().endswith("total")]
+    return int(total[-1][2]) if total and len(total[-1]) > 2 else None
+
+
+def run_benchmarks(sizes: List[int], repeat: int = 3, depth: int = 4, config_density: float = 0.1,
+                   poetry_density: float = 0.2, junk_ratio: float = 0.5,
+                   type_mix: Optional[Dict[str, float]] = None, skip_cli: bool = False) -> Dict[str, object]:
+    results = {
+        "version": RESULTS_VERSION,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "toml_parser": TomlUtilities(".", "all").toml_parser,
+        "scenarios": [],
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="toml_utilities_bench_") as workspace:
+            created = generate_workspace(workspace, size, depth=depth, config_density=config_density,
+                                         poetry_density=poetry_density, type_mix=type_mix,
+                                         junk_directories=int(size * junk_ratio))
+            scenario = {"size": size, "workspace": created, "measurements": {}}
+            scenario["measurements"]["parse_data_ops_configurations"] = time_in_process(
+                lambda: TomlUtilities(workspace, "tdv_ddl").parse_data_ops_configurations(), repeat)
+            scenario["measurements"]["generate_yaml_config"] = time_in_process(
+                lambda: TomlUtilities(workspace, "all").generate_yaml_config(), repeat)
+            if not skip_cli:
+                scenario["measurements"]["cli_directory_types"] = time_cli(
+                    ["directory_types", workspace, "--ops_type", "tdv_ddl"], repeat)
+            results["scenarios"].append(scenario)
+    return results
+
+
+def compare_results(baseline: Dict[str, object], current: Dict[str, object], max_regression: float) -> List[str]:
+    """Return a message for every measurement whose median wall time grew past max_regression."""
+    regressions = []
+    baseline_by_size = {scenario["size"]: scenario for scenario in baseline.get("scenarios", [])}
+    for scenario in current["scenarios"]:
+        previous = baseline_by_size.get(scenario["size"])
+        if previous is None:
+            continue
+        for name, measurement in scenario["measurements"].items():
+            before = previous["measurements"].get(name, {}).get("wall_seconds_median")
+            if before:
+                ratio = measurement["wall_seconds_median"] / before
+                if ratio > max_regression:
+                    regressions.append(f"{name} at {scenario['size']} directories is {ratio:.2f}x slower")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--config_density", type=float, default=0.1)
+    parser.add_argument("--poetry_density", type=float, default=0.2)
+    parser.add_argument("--junk_ratio", type=float, default=0.5, help="junk directories per generated directory")
+    parser.add_argument("--type_mix", type=json.loads, help='JSON weights, e.g. {"tdv_ddl": 1, "stored_proc": 1}')
+    parser.add_argument("--skip_cli", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to check for regressions")
+    parser.add_argument("--max_regression", type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, repeat=args.repeat, depth=args.depth, config_density=args.config_density,
+                             poetry_density=args.poetry_density, junk_ratio=args.junk_ratio,
+                             type_mix=args.type_mix, skip_cli=args.skip_cli)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    for scenario in results["scenarios"]:
+        for name, measurement in scenario["measurements"].items():
+            print(f"{scenario['size']:>7} {name:<32} {measurement['wall_seconds_median']:.4f}s")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import json
+
+from benchmarks.bench_discovery import compare_results, generate_workspace, run_benchmarks
+from toml_utilities import TomlUtilities
+
+
+def test_generate_workspace_builds_configs_and_junk(tmp_path):
+    created = generate_workspace(str(tmp_path), 50, depth=2, config_density=0.5, junk_directories=8)
+
+    discovered = TomlUtilities(str(tmp_path), "all").parse_data_ops_configurations()
+    assert created["directories"] == 50
+    assert created["junk_directories"] == 8
+    assert len(discovered) == created["data_ops_configs"]
+    assert (tmp_path / ".git" / "objects").is_dir()
+
+
+def test_run_benchmarks_records_machine_readable_results():
+    results = run_benchmarks([20], repeat=1)
+
+    measurements = results["scenarios"][0]["measurements"]
+    assert set(measurements) == {"parse_data_ops_configurations", "generate_yaml_config", "cli_directory_types"}
+    assert measurements["parse_data_ops_configurations"]["calls"]["scandir"] > 0
+    assert json.loads(json.dumps(results)) == results
+
+
+def test_compare_results_flags_slower_measurements():
+    baseline = {"scenarios": [{"size": 10, "measurements": {"cli": {"wall_seconds_median": 1.0}}}]}
+    current = {"scenarios": [{"size": 10, "measurements": {"cli": {"wall_seconds_median": 1.5}}}]}
+
+    assert compare_results(baseline, current, 1.2) == ["cli at 10 directories is 1.50x slower"]
+    assert compare_results(baseline, current, 2.0) == []
@@ -172,15 +172,14 @@ class TestTomlUtilities(TestCase):
         self.assertTrue([i for i in expected_result if i not in result] == [])
 
 
-def test_parse_individual_data_ops_config_with_invalid_toml(tmp_path):
-    from toml_utilities import _parse_individual_data_ops_config
-
+def test_parse_data_ops_configurations_with_invalid_toml(tmp_path, capsys):
     test_dir = tmp_path / "invalid"
     test_dir.mkdir()
-    (test_dir / "pyproject.toml").write_text("This is not valid TOML")
+    (test_dir / "pyproject.toml").write_text('[data-ops-config]\ntype = "tdv_ddl"\nThis is not valid TOML\n')
 
-    result = _parse_individual_data_ops_config(str(test_dir))
-    assert result == {}
+    result = TomlUtilities(str(tmp_path), "all").parse_data_ops_configurations()
+    assert result == []
+    assert f"Error parsing TOML file in {test_dir}" in capsys.readouterr().out
 
 
 def test_generate_yaml_config_with_missing_type(tmp_path):
@@ -199,7 +198,8 @@ def test_generate_yaml_config_with_missing_type(tmp_path):
 
 
 import pytest
-from toml_utilities import TomlUtilities
+import yaml
+from toml_utilities import TomlUtilities, DEFAULT_EXCLUDE_GLOBS, TOML_PARSERS
 
 
 def test_generate_yaml_config_with_missing_type(tmp_path):
@@ -249,4 +249,495 @@ def test_cli_directory_types(tmp_path):
 
     # Check output
     assert result.returncode == 0
-    assert "toml_util_test_proj" in result.stdout
\ No newline at end of file
+    assert "toml_util_test_proj" in result.stdout
+
+def _write_data_ops_project(directory, ops_type):
+    directory.mkdir(parents=True)
+    (directory / "pyproject.toml").write_text(f"""
+        [data-ops-config]
+        type = "{ops_type}"
+        path-to-sql = "sql"
+    """)
+
+
+def test_discover_directories_by_type_groups_requested_types(tmp_path):
+    _write_data_ops_project(tmp_path / "ddl_proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "nested" / "sp_proj", "stored_proc")
+    _write_data_ops_project(tmp_path / "dml_proj", "tdv_dml")
+
+    utils = TomlUtilities(str(tmp_path), ops_type=None)
+    result = utils.discover_directories_by_type(["tdv_ddl", "stored_proc", "dml"])
+
+    assert result == {
+        "tdv_ddl": [str(tmp_path / "ddl_proj")],
+        "stored_proc": [str(tmp_path / "nested" / "sp_proj")],
+        "dml": [],
+    }
+
+
+def test_generate_discovery_json_reports_relative_and_absolute_paths(tmp_path):
+    import json
+
+    _write_data_ops_project(tmp_path / "nested" / "sp_proj", "stored_proc")
+
+    utils = TomlUtilities(str(tmp_path), ops_type=None)
+    result = json.loads(utils.generate_discovery_json(["all"]))
+
+    assert result["root"] == str(tmp_path)
+    assert result["directories"] == {
+        "stored_proc": [{
+            "name": "sp_proj",
+            "relative_path": os.path.join("nested", "sp_proj"),
+            "absolute_path": str(tmp_path / "nested" / "sp_proj"),
+        }]
+    }
+
+
+def test_discovery_index_reparses_only_changed_files(tmp_path, monkeypatch):
+    import toml_utilities as tu
+
+    workspace = tmp_path / "workspace"
+    _write_data_ops_project(workspace / "ddl_proj", "tdv_ddl")
+    _write_data_ops_project(workspace / "sp_proj", "stored_proc")
+    index_path = str(tmp_path / "discovery_index.json")
+    TomlUtilities(str(workspace), "all", index_path=index_path).parse_data_ops_configurations()
+
+    parsed = []
+    for name, parse in list(tu.TOML_PARSERS.items()):
+        monkeypatch.setitem(tu.TOML_PARSERS, name, lambda content, parse=parse: parsed.append(content) or parse(content))
+    (workspace / "sp_proj" / "pyproject.toml").write_text('[data-ops-config]\ntype = "tdv_dml"\n')
+
+    utils = TomlUtilities(str(workspace), "tdv_dml", index_path=index_path)
+    assert utils.parse_data_ops_configurations() == [str(workspace / "sp_proj")]
+    assert len(parsed) == 1
+
+
+def test_discovery_index_picks_up_new_directories_and_rebuilds(tmp_path):
+    workspace = tmp_path / "workspace"
+    _write_data_ops_project(workspace / "ddl_proj", "tdv_ddl")
+    index_path = str(tmp_path / "discovery_index.json")
+    TomlUtilities(str(workspace), "all", index_path=index_path).parse_data_ops_configurations()
+
+    _write_data_ops_project(workspace / "nested" / "new_proj", "tdv_ddl")
+    utils = TomlUtilities(str(workspace), "tdv_ddl", index_path=index_path)
+    assert sorted(utils.parse_data_ops_configurations()) == [
+        str(workspace / "ddl_proj"), str(workspace / "nested" / "new_proj")]
+
+    utils.rebuild_index()
+    assert utils.index.files == {}
+    assert len(utils.parse_data_ops_configurations()) == 2
+
+
+def test_discovery_index_ignores_index_of_another_root(tmp_path):
+    from toml_utilities import DiscoveryIndex
+
+    index_path = str(tmp_path / "discovery_index.json")
+    _write_data_ops_project(tmp_path / "one" / "proj", "tdv_ddl")
+    TomlUtilities(str(tmp_path / "one"), "all", index_path=index_path).parse_data_ops_configurations()
+
+    assert DiscoveryIndex(index_path, str(tmp_path / "two")).files == {}
+
+
+def _git(workspace, *args):
+    subprocess.run(["git", "-C", str(workspace), *args], check=True, capture_output=True,
+                   env={**os.environ, "GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+                        "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com"})
+
+
+def test_parse_changed_data_ops_configurations_returns_only_touched_directories(tmp_path):
+    _write_data_ops_project(tmp_path / "ddl_proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "other_ddl_proj", "tdv_ddl")
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-q", "-m", "base")
+    _git(tmp_path, "tag", "base")
+    (tmp_path / "ddl_proj" / "sql").mkdir()
+    (tmp_path / "ddl_proj" / "sql" / "table.sql").write_text("SELECT 1;")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-q", "-m", "change")
+
+    utils = TomlUtilities(str(tmp_path), "tdv_ddl")
+    assert utils.parse_changed_data_ops_configurations("base") == [str(tmp_path / "ddl_proj")]
+
+
+def test_parse_changed_data_ops_configurations_falls_back_to_everything_without_git(tmp_path):
+    _write_data_ops_project(tmp_path / "ddl_proj", "tdv_ddl")
+
+    utils = TomlUtilities(str(tmp_path), "tdv_ddl")
+    assert utils.parse_changed_data_ops_configurations("origin/main") == [str(tmp_path / "ddl_proj")]
+
+
+def test_walk_prunes_excluded_directories_and_respects_max_depth(tmp_path):
+    _write_data_ops_project(tmp_path / "proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / ".git" / "proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "lib" / "proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "node_modules" / "pkg", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "deep" / "er" / "proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "custom" / "proj", "tdv_ddl")
+
+    result = TomlUtilities(str(tmp_path), "tdv_ddl", exclude_globs=DEFAULT_EXCLUDE_GLOBS + ("cust*",),
+                           max_depth=2).parse_data_ops_configurations()
+
+    assert result == [str(tmp_path / "proj")]
+
+
+def test_walk_keeps_nested_lib_directories_below_the_root(tmp_path):
+    _write_data_ops_project(tmp_path / "team" / "lib", "tdv_ddl")
+
+    result = TomlUtilities(str(tmp_path), "tdv_ddl").parse_data_ops_configurations()
+
+    assert result == [str(tmp_path / "team" / "lib")]
+
+
+def test_walk_stops_at_data_ops_root_when_requested(tmp_path):
+    _write_data_ops_project(tmp_path / "proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "proj" / "nested", "tdv_ddl")
+
+    assert len(TomlUtilities(str(tmp_path), "tdv_ddl").parse_data_ops_configurations()) == 2
+    result = TomlUtilities(str(tmp_path), "tdv_ddl", stop_at_data_ops_root=True).parse_data_ops_configurations()
+    assert result == [str(tmp_path / "proj")]
+
+
+@pytest.mark.parametrize("toml_parser", sorted(TOML_PARSERS))
+def test_generate_yaml_config_parses_each_file_once_with_every_backend(tmp_path, monkeypatch, toml_parser):
+    _write_data_ops_project(tmp_path / "proj", "tdv_ddl")
+    parsed = []
+    parse = TOML_PARSERS[toml_parser]
+    monkeypatch.setitem(TOML_PARSERS, toml_parser, lambda content: parsed.append(content) or parse(content))
+
+    result = TomlUtilities(str(tmp_path), "tdv_ddl", toml_parser=toml_parser).generate_yaml_config()
+
+    assert yaml.safe_load(result) == {"tdv_ddl": [{"name": "proj", "path-to-sql": "sql"}]}
+    assert len(parsed) == 1
+
+
+@pytest.mark.parametrize("parse_executor", ["thread", "process"])
+def test_parse_pool_reports_errors_per_directory(tmp_path, capsys, parse_executor):
+    for number in range(4):
+        _write_data_ops_project(tmp_path / f"proj_{number}", "tdv_ddl")
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "pyproject.toml").write_text('[data-ops-config]\ntype = "tdv_ddl\n')
+
+    utils = TomlUtilities(str(tmp_path), "tdv_ddl", parse_workers=2, parse_executor=parse_executor)
+    result = utils.parse_data_ops_configurations()
+
+    assert sorted(result) == [str(tmp_path / f"proj_{number}") for number in range(4)]
+    assert f"Error parsing TOML file in {tmp_path / 'broken'}" in capsys.readouterr().out
+
+
+def test_process_pool_returns_toml_inline_tables(tmp_path):
+    for number in range(3):
+        (tmp_path / f"proj_{number}").mkdir()
+        (tmp_path / f"proj_{number}" / "pyproject.toml").write_text(
+            '[data-ops-config]\ntype = "tdv_ddl"\nvars = { schema = "STG", tags = [{ name = "daily" }] }\n')
+
+    utils = TomlUtilities(str(tmp_path), "tdv_ddl", toml_parser="toml", parse_workers=2, parse_executor="process")
+    records = sorted(utils.iter_config_records())
+
+    assert [config["vars"] for _, _, config in records] == [{"schema": "STG", "tags": [{"name": "daily"}]}] * 3
+    assert type(records[0][2]["vars"]) is dict
+
+
+def test_parse_pool_reports_worker_failures_per_directory(tmp_path, capsys, monkeypatch):
+    import toml_utilities
+
+    for number in range(3):
+        _write_data_ops_project(tmp_path / f"proj_{number}", "tdv_ddl")
+    parse = toml_utilities._parse_data_ops_content
+
+    def failing_parse(content, toml_parser):
+        if b"proj_1" in content:
+            raise RuntimeError("worker died")
+        return parse(content, toml_parser)
+
+    def failing_chunk(contents, toml_parser):
+        raise RuntimeError("chunk lost")
+
+    (tmp_path / "proj_1" / "pyproject.toml").write_text('# proj_1\n[data-ops-config]\ntype = "tdv_ddl"\n')
+    monkeypatch.setattr(toml_utilities, "_parse_data_ops_content", failing_parse)
+    monkeypatch.setattr(toml_utilities, "_parse_data_ops_chunk", failing_chunk)
+
+    result = TomlUtilities(str(tmp_path), "tdv_ddl", parse_workers=2).parse_data_ops_configurations()
+
+    assert sorted(result) == [str(tmp_path / "proj_0"), str(tmp_path / "proj_2")]
+    assert f"Error parsing TOML file in {tmp_path / 'proj_1'}: parse worker failed" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("content, ops_type, expected", [
+    (b'[tool.poetry]\nname = "x"\n', "tdv_ddl", "no_config"),
+    (b'[tool.poetry]\nname = "\\u0078"\n', "tdv_ddl", "candidate"),
+    (b'[data-ops-config]\ntype = "tdv_ddl"\n', "tdv_ddl", "candidate"),
+    (b'[data-ops-config]\ntype = "tdv_dml" # comment\r\n[other]\ntype = "tdv_ddl"\n', "tdv_ddl", "other_type"),
+    (b'[data-ops-config]\ntype = "tdv_dml"\n', None, "candidate"),
+    (b"[data-ops-config]\ntype = 'tdv_dml'\n", "tdv_ddl", "candidate"),
+    (b'data-ops-config = { type = "tdv_dml" }\n', "tdv_ddl", "candidate"),
+    (b'[data-ops-config]\ntype = "tdv_dml"\n[data-ops-config.extra]\n', "tdv_ddl", "candidate"),
+])
+def test_prefilter_data_ops_content(content, ops_type, expected):
+    from toml_utilities import _prefilter_data_ops_content
+
+    assert _prefilter_data_ops_content(content, ops_type) == expected
+
+
+def test_prefilter_matches_full_parse_results_including_large_mapped_files(tmp_path, monkeypatch):
+    import toml_utilities as tu
+
+    monkeypatch.setattr(tu, "MMAP_THRESHOLD", 64)
+    _write_data_ops_project(tmp_path / "ddl_proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "dml_proj", "tdv_dml")
+    (tmp_path / "poetry_proj").mkdir()
+    (tmp_path / "poetry_proj" / "pyproject.toml").write_text('[tool.poetry]\nname = "x"\n' + "#" * 256 + "\n")
+    (tmp_path / "inline_proj").mkdir()
+    (tmp_path / "inline_proj" / "pyproject.toml").write_text('data-ops-config = { type = "tdv_ddl" }\n')
+
+    for ops_type in ("tdv_ddl", "tdv_dml", "all"):
+        prefiltered = TomlUtilities(str(tmp_path), ops_type).parse_data_ops_configurations()
+        parsed = TomlUtilities(str(tmp_path), ops_type, prefilter=False).parse_data_ops_configurations()
+        assert sorted(prefiltered) == sorted(parsed)
+
+
+def test_streamed_yaml_matches_dumping_the_whole_mapping(tmp_path):
+    for number, ops_type in enumerate(["tdv_ddl", "stored_proc", "tdv_ddl", "type: quoted"]):
+        directory = tmp_path / f"proj_{number}"
+        directory.mkdir()
+        (directory / "pyproject.toml").write_text(
+            f'[data-ops-config]\ntype = "{ops_type}"\npath-to-sql = "sql"\ntags = ["a", "b: c"]\n'
+            f'[data-ops-config.extra]\nretries = {number}\n')
+
+    utils = TomlUtilities(str(tmp_path), "all")
+    expected = {}
+    for ops_type, _, config in utils.iter_config_records():
+        expected.setdefault(ops_type, []).append(config)
+
+    assert utils.generate_yaml_config() == yaml.dump(expected, default_flow_style=False)
+
+
+@pytest.mark.parametrize("toml_parser", sorted(TOML_PARSERS))
+def test_yaml_config_dumps_inline_tables_from_every_backend(tmp_path, toml_parser):
+    (tmp_path / "proj").mkdir()
+    (tmp_path / "proj" / "pyproject.toml").write_text(
+        '[data-ops-config]\ntype = "on"\nextra = { a = 1, nested = { b = [1, 2] } }\n')
+
+    result = TomlUtilities(str(tmp_path), "all", toml_parser=toml_parser).generate_yaml_config()
+
+    assert result == yaml.dump({"on": [{"extra": {"a": 1, "nested": {"b": [1, 2]}}, "name": "proj"}]},
+                               default_flow_style=False)
+
+
+def test_write_config_stream_sorted_ndjson_is_stable(tmp_path):
+    import io
+    import json
+
+    for name in ["zeta", "alpha", "mid"]:
+        _write_data_ops_project(tmp_path / name, "tdv_ddl")
+    _write_data_ops_project(tmp_path / "beta", "stored_proc")
+
+    output = io.StringIO()
+    TomlUtilities(str(tmp_path), "all").write_config_stream(output, "ndjson", sort=True)
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert [(record["type"], record["name"]) for record in records] == [
+        ("stored_proc", "beta"), ("tdv_ddl", "alpha"), ("tdv_ddl", "mid"), ("tdv_ddl", "zeta")]
+    assert records[0] == {"type": "stored_proc", "name": "beta", "path": str(tmp_path / "beta"),
+                          "path-to-sql": "sql"}
+
+
+def test_cli_terraform_yaml_config_writes_output_file(tmp_path):
+    _write_data_ops_project(tmp_path / "workspace" / "proj", "tdv_ddl")
+    output_path = tmp_path / "config.yaml"
+    script_path = Path(__file__).parent.parent / "toml_utilities.py"
+
+    result = subprocess.run(
+        ["python", str(script_path), "terraform_yaml_config", str(tmp_path / "workspace"),
+         "--ops_type", "all", "--sort", "--output", str(output_path)],
+        capture_output=True, text=True)
+
+    assert result.returncode == 0
+    assert yaml.safe_load(output_path.read_text()) == {"tdv_ddl": [{"name": "proj", "path-to-sql": "sql"}]}
+
+
+def test_in_memory_source_walks_like_the_filesystem():
+    from toml_utilities import InMemorySource
+
+    source = InMemorySource({
+        "proj/pyproject.toml": b'[data-ops-config]\ntype = "tdv_ddl"\npath-to-sql = "sql"\n',
+        "proj/sql/table.sql": b"SELECT 1;",
+        "team/other/pyproject.toml": b'[data-ops-config]\ntype = "tdv_dml"\n',
+        "lib/vendored/pyproject.toml": b'[data-ops-config]\ntype = "tdv_ddl"\n',
+        "pyproject.toml": b'[data-ops-config]\ntype = "tdv_ddl"\n',
+    })
+
+    utils = TomlUtilities("/workspace", "tdv_ddl", source=source)
+
+    assert utils.parse_data_ops_configurations() == [os.path.join("/workspace", "proj")]
+    assert yaml.safe_load(utils.generate_yaml_config()) == {"tdv_ddl": [{"name": "proj", "path-to-sql": "sql"}]}
+
+
+def test_tree_source_lists_only_files_below_a_folder():
+    from toml_utilities import InMemorySource
+
+    source = InMemorySource({path: b"" for path in [
+        "proj/a.sql", "proj/skip/b.sql", "proj/sql/c.sql", "proj-2/d.sql", "proj.d/e.sql", "proj0/f.sql", "g.sql"]})
+
+    def is_pruned(relative_dir, name):
+        return name == "skip"
+
+    assert [path for path, _ in source.iter_files("proj", is_pruned)] == ["proj/a.sql", "proj/sql/c.sql"]
+    assert len(list(source.iter_files("", is_pruned))) == 6
+
+
+def test_git_object_source_reads_a_ref_without_its_working_tree(tmp_path):
+    from toml_utilities import GitObjectSource
+
+    _write_data_ops_project(tmp_path / "ddl_proj", "tdv_ddl")
+    _write_data_ops_project(tmp_path / "nested" / "sp_proj", "stored_proc")
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-q", "-m", "base")
+    _git(tmp_path, "rm", "-q", "-r", "ddl_proj", "nested")
+
+    source = GitObjectSource(str(tmp_path), "HEAD")
+    try:
+        result = TomlUtilities(str(tmp_path), "all", source=source).discover_directories_by_type(["all"])
+    finally:
+        source.close()
+
+    assert result == {"tdv_ddl": [str(tmp_path / "ddl_proj")],
+                      "stored_proc": [str(tmp_path / "nested" / "sp_proj")]}
+
+
+def test_git_object_source_reports_an_unknown_ref(tmp_path):
+    from toml_utilities import GitObjectSource
+
+    _git(tmp_path, "init", "-q")
+
+    with pytest.raises(RuntimeError, match="Unable to list"):
+        TomlUtilities(str(tmp_path), "all", source=GitObjectSource(str(tmp_path), "missing")).parse_data_ops_configurations()
+
+
+def _write_manifest_workspace(root):
+    _write_data_ops_project(root / "sp_proj", "stored_proc")
+    (root / "sp_proj" / "tables").mkdir()
+    (root / "sp_proj" / "tables" / "load.sql").write_text("REPLACE PROCEDURE P () BEGIN END;")
+    (root / "sp_proj" / "tables" / "notes.txt").write_text("not sql")
+    (root / "sp_proj" / "__pycache__").mkdir()
+    (root / "sp_proj" / "__pycache__" / "cached.sql").write_text("SELECT 1;")
+    _write_data_ops_project(root / "sp_proj" / "nested_ddl", "tdv_ddl")
+    (root / "sp_proj" / "nested_ddl" / "table.sql").write_text("CREATE TABLE T (C INTEGER);")
+
+
+def test_workspace_manifest_lists_sql_files(tmp_path):
+    from dataops_common.manifest import WorkspaceManifest
+
+    _write_manifest_workspace(tmp_path)
+    manifest_path = tmp_path / "manifest.jsonl"
+    with open(manifest_path, "w") as manifest_file:
+        assert TomlUtilities(str(tmp_path), "all").write_workspace_manifest(manifest_file, ["all"]) == 2
+
+    manifest = WorkspaceManifest(str(manifest_path))
+    folders = {folder["relative_path"]: folder for folder in manifest.iter_folders()}
+
+    assert manifest.header["root"] == str(tmp_path)
+    assert folders["sp_proj"]["type"] == "stored_proc"
+    assert folders["sp_proj"]["config"] == {"path-to-sql": "sql"}
+    assert folders["sp_proj"]["sql_files"] == [{"path": "tables/load.sql"}]
+    assert [sql_file["path"] for sql_file in folders["sp_proj/nested_ddl"]["sql_files"]] == ["table.sql"]
+
+
+def test_workspace_manifest_from_git_objects_matches_the_working_tree(tmp_path):
+    from toml_utilities import GitObjectSource
+
+    _write_manifest_workspace(tmp_path)
+    expected = list(TomlUtilities(str(tmp_path), "all").iter_manifest_folders(["stored_proc"]))
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-q", "-m", "base")
+    _git(tmp_path, "rm", "-q", "-r", "sp_proj")
+
+    source = GitObjectSource(str(tmp_path), "HEAD")
+    try:
+        result = list(TomlUtilities(str(tmp_path), "all", source=source).iter_manifest_folders(["stored_proc"]))
+    finally:
+        source.close()
+
+    assert result == expected and len(result) == 1
+
+
+def test_workspace_manifest_rejects_other_versions(tmp_path):
+    from dataops_common.manifest import WorkspaceManifest
+
+    (tmp_path / "manifest.jsonl").write_text('{"manifest_version": 1}\n')
+
+    with pytest.raises(ValueError, match="version 2"):
+        WorkspaceManifest(str(tmp_path / "manifest.jsonl"))
+
+
+def test_workspace_manifest_header_only_lists_no_folders(tmp_path, monkeypatch):
+    import sys
+    import toml_utilities
+    from dataops_common.manifest import WorkspaceManifest
+
+    _write_manifest_workspace(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["obtain_build_config", "workspace_manifest", str(tmp_path), "--header_only",
+                                      "--output", str(tmp_path / "manifest.jsonl")])
+
+    toml_utilities.main()
+
+    manifest = WorkspaceManifest(str(tmp_path / "manifest.jsonl"))
+    assert manifest.header["ops_types"] == [] and list(manifest.iter_folders()) == []
+
+
+def test_profile_records_phases_functions_and_imports(tmp_path, monkeypatch):
+    import json
+    import sys
+    import toml_utilities
+
+    _write_manifest_workspace(tmp_path)
+    profile_path = tmp_path / "profile" / "discovery.json"
+    monkeypatch.setenv("OBTAIN_BUILD_CONFIG_PROFILE", str(profile_path))
+    monkeypatch.setattr(sys, "argv", ["obtain_build_config", "workspace_manifest", str(tmp_path),
+                                      "--output", str(tmp_path / "manifest.jsonl")])
+
+    toml_utilities.main()
+
+    profile = json.loads(profile_path.read_text())
+    assert {"setup", "directory_walk", "pyproject_read", "toml_parse", "file_listing"} <= set(profile["phases"])
+    assert profile["phases"]["file_listing"]["calls"] == 2
+    assert profile["peak_traced_memory_bytes"] > 0
+    assert any("iter_manifest_folders" in entry["function"] for entry in profile["functions"])
+    assert profile["imports"]["total_seconds"] > 0
+    assert (tmp_path / "profile" / "discovery.json.pstats").exists()
+    assert toml_utilities.PROFILER.phase("setup") is toml_utilities.PROFILER.phase("toml_parse")
+
+
+def test_git_object_source_lists_a_blobless_clone_without_fetching_blobs(tmp_path):
+    from toml_utilities import GitObjectSource
+
+    origin = tmp_path / "origin"
+    _write_manifest_workspace(origin)
+    _git(origin, "init", "-q")
+    _git(origin, "add", ".")
+    _git(origin, "commit", "-q", "-m", "base")
+    _git(origin, "config", "uploadpack.allowFilter", "true")
+    clone = tmp_path / "clone"
+    subprocess.run(["git", "clone", "-q", "--filter=blob:none", "--no-checkout", f"file://{origin}", str(clone)],
+                   check=True, capture_output=True)
+
+    def missing_blobs():
+        listing = subprocess.run(["git", "-C", str(clone), "rev-list", "--objects", "--missing=print", "HEAD"],
+                                 check=True, capture_output=True, text=True).stdout
+        return sum(line.startswith("?") for line in listing.splitlines())
+
+    blobs = missing_blobs()
+    source = GitObjectSource(str(clone), "HEAD")
+    try:
+        source._ensure_tree()
+        assert blobs == len(source._files) and missing_blobs() == blobs
+        assert TomlUtilities(str(clone), "stored_proc", source=source).parse_data_ops_configurations() == [
+            str(clone / "sp_proj")]
+        manifest = list(TomlUtilities(str(clone), "all", source=source).iter_manifest_folders(["all"]))
+    finally:
+        source.close()
+    # Only the two pyproject.toml blobs were fetched, the manifest lists the SQL files without reading them
+    assert missing_blobs() == blobs - 2
+    assert [folder["sql_files"] for folder in manifest] == [[{"path": "tables/load.sql"}], [{"path": "table.sql"}]]
@@ -1,76 +1,835 @@
 import argparse
+import bisect
+import fnmatch
+import hashlib
+import io
+import json
+import mmap
 import os
+import re
+import subprocess
+import sys
+import time
 from collections import defaultdict
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
 import toml
 import yaml
-from yaml.representer import Representer
+from dataops_common.manifest import MANIFEST_FILE_SUFFIXES, MANIFEST_VERSION, write_manifest_line
+from dataops_common.profiling import Profiler
+from yaml.representer import SafeRepresenter
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+try:
+    import tomli
+except ImportError:
+    tomli = None
+
+
+OPS_TYPE_CHOICES = ["tdv_ddl", "tdv_dml", "dml_with_dag", "ddl", "dml", "all", "stored_proc"]
 
 
 def config_list_to_str_for_console_output(data_ops_config_list: List[str]) -> str:
     return ":".join(data_ops_config_list)
 
 
-def _parse_individual_data_ops_config(directory: str) -> dict:
+TOML_PARSERS = {"toml": lambda content: toml.loads(content.decode("utf-8"))}
+if tomli is not None:
+    TOML_PARSERS["tomli"] = lambda content: tomli.loads(content.decode("utf-8"))
+if tomllib is not None:
+    TOML_PARSERS["tomllib"] = lambda content: tomllib.loads(content.decode("utf-8"))
+
+
+def _resolve_toml_parser(toml_parser: str) -> str:
+    """Map "auto" to the fastest installed backend: stdlib tomllib, then tomli, then toml."""
+    if toml_parser == "auto":
+        return next(name for name in ("tomllib", "tomli", "toml") if name in TOML_PARSERS)
+    if toml_parser not in TOML_PARSERS:
+        raise ValueError(f"TOML parser {toml_parser} is not installed, available: {sorted(TOML_PARSERS)}")
+    return toml_parser
+
+
+def _plain(value):
+    """Copy parser dict and list subclasses, e.g. toml's DynamicInlineTableDict, into plain ones that pickle."""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _parse_data_ops_content(content: bytes, toml_parser: str) -> Tuple[Optional[dict], Optional[str]]:
+    """Return the data-ops-config table of a pyproject.toml, or the parse error as text.
+
+    Kept at module level and free of exceptions so it can run in a process pool.
+    """
     try:
-        with open(os.path.join(directory, "pyproject.toml"), "r") as toml_file:
-            toml_data = toml.load(toml_file)
-            return toml_data["data-ops-config"]
+        return _plain(TOML_PARSERS[toml_parser](content).get("data-ops-config")), None
     except Exception as e:
-        print(f"Error parsing TOML file in {directory}: {e}")
-        return {}
-
-
-def _toml_file_has_matching_type(directory: str, ops_type: str) -> bool:
-    with open(os.path.join(directory, "pyproject.toml"), "r") as toml_file:
-        toml_data = toml.load(toml_file)
-        if "data-ops-config" in toml_data.keys():
-            if ops_type:
-                return toml_data["data-ops-config"].get("type") == ops_type
-            else:
-                return True
+        return None, str(e)
+
+
+def _parse_data_ops_chunk(contents: List[bytes], toml_parser: str) -> List[Tuple[Optional[dict], Optional[str]]]:
+    return [_parse_data_ops_content(content, toml_parser) for content in contents]
+
+
+_DATA_OPS_KEY = b"data-ops-config"
+_DATA_OPS_HEADER = re.compile(rb"^[ \t]*\[[ \t]*data-ops-config[ \t]*\][ \t]*(?:#[^\n]*)?\r?$", re.M)
+_TABLE_HEADER = re.compile(rb"^[ \t]*\[", re.M)
+_TYPE_LINE = re.compile(rb'^[ \t]*type[ \t]*=[ \t]*"([^"\\\n]*)"[ \t]*(?:#[^\n]*)?\r?$', re.M)
+_ANY_TYPE_LINE = re.compile(rb"^[ \t]*[\"']?type\b", re.M)
+MMAP_THRESHOLD = 1 << 20
+PARSE_CHUNK_SIZE = 64
+
+
+class _ConfigDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    """The libyaml emitter when PyYAML was built with it, the pure-Python one otherwise."""
+
+
+# Parsers return dict and list subclasses, e.g. toml's DynamicInlineTableDict for inline tables
+_ConfigDumper.add_multi_representer(dict, SafeRepresenter.represent_dict)
+_ConfigDumper.add_multi_representer(list, SafeRepresenter.represent_list)
+
+PREFILTER_NO_CONFIG = "no_config"
+PREFILTER_OTHER_TYPE = "other_type"
+PREFILTER_CANDIDATE = "candidate"
+
+
+def _prefilter_data_ops_content(content, ops_type: Optional[str]) -> str:
+    """Judge a raw pyproject.toml (bytes or mmap) without parsing it.
+
+    A file that never spells out the data-ops-config key, not even through a unicode escape,
+    cannot have the table. A file with exactly one plain [data-ops-config] header whose section
+    holds a single plain ``type = "..."`` line has that type. Any other shape is a candidate
+    for a full parse, so the prefilter never changes which directories are found.
+    """
+    key_at = content.find(_DATA_OPS_KEY)
+    if key_at == -1:
+        if content.find(b"\\u") == -1 and content.find(b"\\U") == -1:
+            return PREFILTER_NO_CONFIG
+        return PREFILTER_CANDIDATE
+    if not ops_type or content.find(_DATA_OPS_KEY, key_at + 1) != -1:
+        return PREFILTER_CANDIDATE
+    header = _DATA_OPS_HEADER.search(content)
+    if header is None:
+        return PREFILTER_CANDIDATE
+    next_table = _TABLE_HEADER.search(content, header.end())
+    section = content[header.end():next_table.start() if next_table else len(content)]
+    type_lines = _TYPE_LINE.findall(section)
+    if len(type_lines) != 1 or len(_ANY_TYPE_LINE.findall(section)) != 1:
+        return PREFILTER_CANDIDATE
+    return PREFILTER_CANDIDATE if type_lines[0] == ops_type.encode("utf-8") else PREFILTER_OTHER_TYPE
+
+
+def _read_prefiltered(path: str, size: int, ops_type: Optional[str]) -> Tuple[str, Optional[bytes]]:
+    """Read a pyproject.toml for parsing, mapping large files so rejected ones are never copied."""
+    with open(path, "rb") as toml_file:
+        if size < MMAP_THRESHOLD:
+            content = toml_file.read()
+            return _prefilter_data_ops_content(content, ops_type), content
+        with mmap.mmap(toml_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            verdict = _prefilter_data_ops_content(mapped, ops_type)
+            return verdict, mapped[:] if verdict == PREFILTER_CANDIDATE else None
+
+
+def _data_ops_config_has_matching_type(config: Optional[dict], ops_type: str) -> bool:
+    if config is None:
         return False
+    if ops_type:
+        return config.get("type") == ops_type
+    return True
+
+
+def _changed_files_since(root_dir: str, base_ref: str) -> Optional[List[str]]:
+    """Return the paths, relative to root_dir, changed between base_ref's merge base and HEAD.
+
+    None means the diff could not be computed (no git, unknown ref, shallow clone without the base).
+    """
+    try:
+        diff = subprocess.run(
+            ["git", "-C", root_dir, "diff", "--name-only", "--relative", "--no-renames", "-z", f"{base_ref}...HEAD"],
+            capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", None)
+        print(f"Unable to diff {root_dir} against {base_ref}: {stderr.decode().strip() if stderr else e}", file=sys.stderr)
+        return None
+    return [path for path in diff.stdout.decode("utf-8").split("\0") if path]
+
+
+DEFAULT_EXCLUDE_GLOBS = (".git", ".venv", "venv", "node_modules", "__pycache__", ".tmp-dynamic-uses",
+                         "/liquibase", "/lib")
+
+
+def _compile_exclude_globs(exclude_globs: Iterable[str]) -> Callable[[str, str], bool]:
+    """Build a predicate telling whether a directory is pruned from the walk.
+
+    Globs without a slash match a directory name at any depth, globs with a slash match the path
+    relative to the walk root and a leading slash anchors a glob to the root itself, e.g. "/lib".
+    """
+    name_globs = [glob for glob in exclude_globs if "/" not in glob]
+    path_globs = [glob.lstrip("/") for glob in exclude_globs if "/" in glob]
+    name_pattern = re.compile("|".join(fnmatch.translate(glob) for glob in name_globs)) if name_globs else None
+    path_pattern = re.compile("|".join(fnmatch.translate(glob) for glob in path_globs)) if path_globs else None
+
+    def is_excluded(relative_dir: str, name: str) -> bool:
+        return bool((name_pattern and name_pattern.match(name))
+                    or (path_pattern and path_pattern.match(relative_dir.replace(os.sep, "/"))))
+
+    return is_excluded
+
+
+def _scan_directory(path: str) -> Tuple[List[Tuple[str, Optional[os.DirEntry]]], Optional[os.DirEntry]]:
+    subdirs, pyproject = [], None
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.name, entry))
+            elif entry.name == "pyproject.toml" and entry.is_file():
+                pyproject = entry
+    return subdirs, pyproject
+
+
+class LocalSource:
+    """Reads the walked tree from disk; handles are the os.DirEntry objects returned by scandir."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def list_directory(self, relative_dir: str, handle: object
+                       ) -> Tuple[List[Tuple[str, object]], Optional[object]]:
+        return _scan_directory(os.path.join(self.root_dir, relative_dir))
+
+    def read_pyproject(self, relative_dir: str, pyproject: os.DirEntry, ops_type: Optional[str],
+                       prefilter: bool) -> Tuple[str, Optional[bytes]]:
+        path = os.path.join(self.root_dir, relative_dir, "pyproject.toml")
+        if prefilter:
+            return _read_prefiltered(path, pyproject.stat().st_size, ops_type)
+        with open(path, "rb") as toml_file:
+            return PREFILTER_CANDIDATE, toml_file.read()
+
+    def iter_files(self, relative_dir: str, is_pruned: Callable[[str, str], bool]) -> Iterator[Tuple[str, object]]:
+        """Yield ``(path relative to the root, handle)`` for every file below relative_dir."""
+        pending = [relative_dir]
+        while pending:
+            current = pending.pop()
+            for name, entry in sorted(_list_entries(os.path.join(self.root_dir, current)), reverse=True):
+                relative_path = os.path.join(current, name)
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_pruned(relative_path, name):
+                        pending.append(relative_path)
+                elif entry.is_file():
+                    yield relative_path, entry
+
+    def close(self):
+        pass
+
+
+def _list_entries(path: str) -> List[Tuple[str, os.DirEntry]]:
+    with os.scandir(path) as entries:
+        return [(entry.name, entry) for entry in entries]
+
+
+class _TreeSource:
+    """Base for sources whose whole file list is known up front, e.g. a git tree or a dict of files.
+
+    Subclasses register every file with _add_file from _load_tree and implement _read.
+    """
+
+    def __init__(self):
+        self._directories = None
+        self._files = {}
+        self._sorted_paths = []
+
+    def _load_tree(self):
+        raise NotImplementedError
+
+    def _ensure_tree(self):
+        if self._directories is None:
+            self._directories = {"": ({}, [None])}
+            self._load_tree()
+            self._sorted_paths = sorted(self._files)
+
+    def _read(self, handle: object) -> bytes:
+        raise NotImplementedError
+
+    def _add_directory(self, relative_dir: str) -> Tuple[Dict[str, None], List[object]]:
+        if relative_dir not in self._directories:
+            parent, _, name = relative_dir.rpartition("/")
+            self._add_directory(parent)[0][name] = None
+            self._directories[relative_dir] = ({}, [None])
+        return self._directories[relative_dir]
+
+    def _add_file(self, relative_path: str, handle: object):
+        parent, _, name = relative_path.rpartition("/")
+        directory = self._add_directory(parent)
+        self._files[relative_path] = handle
+        if name == "pyproject.toml":
+            directory[1][0] = handle
+
+    def list_directory(self, relative_dir: str, handle: object
+                       ) -> Tuple[List[Tuple[str, object]], Optional[object]]:
+        self._ensure_tree()
+        subdirs, pyproject = self._directories.get(relative_dir.replace(os.sep, "/"), ({}, [None]))
+        return [(name, None) for name in subdirs], pyproject[0]
+
+    def read_pyproject(self, relative_dir: str, pyproject: object, ops_type: Optional[str],
+                       prefilter: bool) -> Tuple[str, Optional[bytes]]:
+        content = self._read(pyproject)
+        return _prefilter_data_ops_content(content, ops_type) if prefilter else PREFILTER_CANDIDATE, content
+
+    def iter_files(self, relative_dir: str, is_pruned: Callable[[str, str], bool]) -> Iterator[Tuple[str, object]]:
+        self._ensure_tree()
+        prefix = relative_dir.replace(os.sep, "/").strip("/")
+        start, end = 0, len(self._sorted_paths)
+        if prefix:
+            # The paths under prefix/ sort between prefix/ and prefix0, "0" being the character after "/"
+            start = bisect.bisect_left(self._sorted_paths, prefix + "/")
+            end = bisect.bisect_left(self._sorted_paths, prefix + "0", start)
+        for relative_path in self._sorted_paths[start:end]:
+            parts = relative_path[len(prefix):].strip("/").split("/")[:-1]
+            if not any(is_pruned("/".join(filter(None, [prefix, *parts[:depth + 1]])), parts[depth])
+                       for depth in range(len(parts))):
+                yield relative_path, self._files[relative_path]
+
+    def close(self):
+        pass
+
+
+class InMemorySource(_TreeSource):
+    """Serves a tree from a ``{relative path: content}`` dict, mainly for tests."""
+
+    def __init__(self, files: Dict[str, bytes]):
+        super().__init__()
+        self.files = files
+
+    def _load_tree(self):
+        for relative_path in self.files:
+            self._add_file(relative_path, relative_path)
+
+    def _read(self, handle: str) -> bytes:
+        return self.files[handle]
+
+
+class GitObjectSource(_TreeSource):
+    """Reads the tree and pyproject.toml blobs of a ref straight from a git object database.
+
+    The tree comes from one ``git ls-tree -r`` and blobs are streamed through a single long-lived
+    ``git cat-file --batch`` process, so no working tree is needed. The listing never asks for blob
+    sizes, so a ``--filter=blob:none`` clone only fetches the blobs that are read. Paths are relative
+    to repo_dir, which may be a subdirectory of the repository.
+    """
+
+    def __init__(self, repo_dir: str, ref: str):
+        super().__init__()
+        self.repo_dir = repo_dir
+        self.ref = ref
+        self._cat_file = None
+
+    def _load_tree(self):
+        listing = subprocess.run(["git", "-C", self.repo_dir, "ls-tree", "-r", "-z", self.ref],
+                                 capture_output=True)
+        if listing.returncode != 0:
+            raise RuntimeError(f"Unable to list {self.ref} in {self.repo_dir}: {listing.stderr.decode().strip()}")
+        for record in listing.stdout.split(b"\0"):
+            if not record:
+                continue
+            meta, path = record.split(b"\t", 1)
+            mode, object_type, oid = meta.split()
+            # Only regular blobs: symlinks (120000) and submodule commits carry no config
+            if object_type == b"blob" and mode != b"120000":
+                self._add_file(path.decode("utf-8"), oid.decode("ascii"))
+
+    def _read(self, oid: str) -> bytes:
+        if self._cat_file is None:
+            self._cat_file = subprocess.Popen(["git", "-C", self.repo_dir, "cat-file", "--batch"],
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._cat_file.stdin.write(oid.encode("ascii") + b"\n")
+        self._cat_file.stdin.flush()
+        header = self._cat_file.stdout.readline().split()
+        if len(header) != 3:
+            raise OSError(f"git object {oid} is missing from {self.repo_dir}")
+        content = self._cat_file.stdout.read(int(header[2]))
+        self._cat_file.stdout.read(1)
+        return content
+
+    def close(self):
+        if self._cat_file is not None:
+            self._cat_file.stdin.close()
+            self._cat_file.wait()
+            self._cat_file = None
+
+
+class DiscoveryIndex:
+    """On-disk record of the directory listings and data-ops configs seen by the previous scan.
+
+    Directories are trusted while their mtime is unchanged, pyproject.toml files while their
+    mtime and size are unchanged, and a changed file whose content hash still matches keeps its
+    cached config, so a repeat scan only lists changed directories and parses changed files.
+    Entries written within ``RACY_WINDOW_NS`` of the previous scan are always re-checked because
+    a change in the same timestamp tick would not move their mtime.
+    """
+
+    VERSION = 1
+    RACY_WINDOW_NS = 2_000_000_000
+
+    def __init__(self, path: str, root_dir: str):
+        self.path = path
+        self.root_dir = os.path.abspath(root_dir)
+        self.directories = {}
+        self.files = {}
+        self.scanned_at_ns = 0
+        self._scan_started_at_ns = 0
+        self._seen_directories = {}
+        self._seen_files = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION or data.get("root") != self.root_dir:
+            return
+        self.directories = data.get("directories", {})
+        self.files = data.get("files", {})
+        self.scanned_at_ns = data.get("scanned_at_ns", 0)
+
+    def save(self):
+        data = {"version": self.VERSION, "root": self.root_dir, "scanned_at_ns": self.scanned_at_ns,
+                "directories": self.directories, "files": self.files}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(data, index_file, separators=(",", ":"))
+        os.replace(temp_path, self.path)
+
+    def invalidate(self):
+        self.directories = {}
+        self.files = {}
+        self.scanned_at_ns = 0
+
+    def _is_trusted(self, entry: Optional[dict], mtime_ns: int) -> bool:
+        return (entry is not None and entry["mtime_ns"] == mtime_ns
+                and mtime_ns + self.RACY_WINDOW_NS < self.scanned_at_ns)
+
+    def begin_scan(self):
+        self._scan_started_at_ns = time.time_ns()
+        self._seen_directories, self._seen_files = {}, {}
+
+    def finish_scan(self):
+        self.directories, self.files = self._seen_directories, self._seen_files
+        self.scanned_at_ns = self._scan_started_at_ns
+        self.save()
+
+    def list_directory(self, relative_dir: str, dir_entry: Optional[os.DirEntry]
+                       ) -> Tuple[List[Tuple[str, Optional[os.DirEntry]]], Optional[os.stat_result]]:
+        path = os.path.join(self.root_dir, relative_dir)
+        mtime_ns = (dir_entry.stat(follow_symlinks=False) if dir_entry else os.stat(path)).st_mtime_ns
+        cached = self.directories.get(relative_dir)
+        if self._is_trusted(cached, mtime_ns):
+            self._seen_directories[relative_dir] = cached
+            pyproject_stat = None
+            if cached["has_pyproject"]:
+                pyproject_stat = os.stat(os.path.join(path, "pyproject.toml"))
+            return [(name, None) for name in cached["subdirs"]], pyproject_stat
+        subdirs, pyproject = _scan_directory(path)
+        self._seen_directories[relative_dir] = {
+            "mtime_ns": mtime_ns, "subdirs": [name for name, _ in subdirs], "has_pyproject": pyproject is not None}
+        return subdirs, pyproject.stat() if pyproject else None
+
+    def lookup_config(self, relative_dir: str, stat: os.stat_result
+                      ) -> Tuple[bool, Optional[dict], Optional[bytes]]:
+        """Return ``(hit, config, content)``; on a miss the caller parses content and calls record_config."""
+        relative_path = os.path.join(relative_dir, "pyproject.toml")
+        cached = self.files.get(relative_path)
+        if self._is_trusted(cached, stat.st_mtime_ns) and cached["size"] == stat.st_size:
+            self._seen_files[relative_path] = cached
+            return True, cached["config"], None
+        with open(os.path.join(self.root_dir, relative_path), "rb") as toml_file:
+            content = toml_file.read()
+        if cached is not None and cached["sha256"] == hashlib.sha256(content).hexdigest():
+            self._seen_files[relative_path] = {**cached, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+            return True, cached["config"], None
+        return False, None, content
+
+    def record_config(self, relative_dir: str, stat: os.stat_result, content: bytes, config: Optional[dict]):
+        try:
+            json.dumps(config)
+        except (TypeError, ValueError):
+            # Tables holding TOML dates do not survive a JSON round trip, so they are always re-parsed
+            return
+        self._seen_files[os.path.join(relative_dir, "pyproject.toml")] = {
+            "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+            "sha256": hashlib.sha256(content).hexdigest(), "config": config}
+
+
+# Profile shared by the instrumented code, main() turns it on with --profile
+PROFILER = Profiler()
 
 
 class TomlUtilities:
-    def __init__(self, root_dir: str, ops_type: str):
+    def __init__(self, root_dir: str, ops_type: str, index_path: Optional[str] = None,
+                 exclude_globs: Iterable[str] = DEFAULT_EXCLUDE_GLOBS, max_depth: Optional[int] = None,
+                 stop_at_data_ops_root: bool = False, toml_parser: str = "auto", parse_workers: int = 1,
+                 parse_executor: str = "thread", prefilter: bool = True, source: Optional[object] = None):
         self.root_dir = root_dir
         self.ops_type = ops_type
         if self.ops_type == "all":
             self.ops_type = None
+        if index_path and source is not None:
+            raise ValueError("The discovery index only tracks files on disk and cannot be combined with a source")
+        self.index = DiscoveryIndex(index_path, root_dir) if index_path else None
+        self.source = source if source is not None else LocalSource(root_dir)
+        self.is_excluded = _compile_exclude_globs(exclude_globs)
+        self.max_depth = max_depth
+        self.stop_at_data_ops_root = stop_at_data_ops_root
+        self.toml_parser = _resolve_toml_parser(toml_parser)
+        self.parse_workers = parse_workers
+        self.parse_executor = parse_executor
+        self.prefilter = prefilter
+
+    def _parse_contents(self, contents: List[bytes]) -> List[Tuple[Optional[dict], Optional[str]]]:
+        if self.parse_workers <= 1 or len(contents) < 2:
+            return [_parse_data_ops_content(content, self.toml_parser) for content in contents]
+        executor_class = ProcessPoolExecutor if self.parse_executor == "process" else ThreadPoolExecutor
+        chunks = [contents[start:start + PARSE_CHUNK_SIZE] for start in range(0, len(contents), PARSE_CHUNK_SIZE)]
+        parsed = []
+        with executor_class(max_workers=self.parse_workers) as executor:
+            futures = [executor.submit(_parse_data_ops_chunk, chunk, self.toml_parser) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                try:
+                    parsed.extend(future.result())
+                    continue
+                except Exception:
+                    pass
+                # A failed chunk is parsed again one file at a time, so the failure lands on its own directory
+                for content in chunk:
+                    try:
+                        parsed.append(executor.submit(_parse_data_ops_content, content, self.toml_parser).result())
+                    except Exception as e:
+                        parsed.append((None, f"parse worker failed: {e!r}"))
+        return parsed
+
+    def _load_configs(self, candidates: List[Tuple[str, object]]) -> List[Optional[dict]]:
+        """Read and parse the pyproject.toml of every candidate directory exactly once.
+
+        Index hits skip the parse entirely and the byte prefilter rejects files without the
+        table, or with another type, before the parser sees them. Parse errors are reported per
+        directory and the directory is treated as having no data-ops-config.
+        """
+        configs, to_parse = [], []
+        ops_type = self.ops_type if self.prefilter else None
+        for position, (relative_dir, pyproject) in enumerate(candidates):
+            configs.append(None)
+            try:
+                if self.index is not None:
+                    with PROFILER.phase("index_lookup"):
+                        hit, configs[position], content = self.index.lookup_config(relative_dir, pyproject)
+                    if hit:
+                        continue
+                    verdict = _prefilter_data_ops_content(content, ops_type) if self.prefilter else PREFILTER_CANDIDATE
+                else:
+                    with PROFILER.phase("pyproject_read"):
+                        verdict, content = self.source.read_pyproject(relative_dir, pyproject, ops_type,
+                                                                      self.prefilter)
+            except OSError as e:
+                print(f"Error parsing TOML file in {os.path.join(self.root_dir, relative_dir)}: {e}")
+                continue
+            if verdict == PREFILTER_CANDIDATE:
+                to_parse.append((position, content))
+            elif verdict == PREFILTER_NO_CONFIG and self.index is not None:
+                # A rejected type is not recorded, the next scan may ask for a different one
+                self.index.record_config(relative_dir, pyproject, content, None)
+        with PROFILER.phase("toml_parse"):
+            parsed = self._parse_contents([content for _, content in to_parse])
+        for (position, content), (config, error) in zip(to_parse, parsed):
+            relative_dir, pyproject = candidates[position]
+            if error is not None:
+                print(f"Error parsing TOML file in {os.path.join(self.root_dir, relative_dir)}: {error}")
+                continue
+            configs[position] = config
+            if self.index is not None:
+                self.index.record_config(relative_dir, pyproject, content, config)
+        return configs
+
+    def _walk_data_ops_configs(self, list_directory) -> Iterator[Tuple[str, Optional[dict]]]:
+        """Depth-first walk of the root yielding every pyproject.toml directory with its data-ops-config.
+
+        Excluded directories and anything deeper than max_depth are never listed, and with
+        stop_at_data_ops_root the walk does not descend below a directory that has a data-ops-config.
+        Otherwise the files are collected first and parsed together so the parse can use a pool.
+        """
+        candidates = []
+        pending = [("", 0, None)]
+        while pending:
+            relative_dir, depth, dir_entry = pending.pop()
+            try:
+                with PROFILER.phase("directory_walk"):
+                    subdirs, pyproject = list_directory(relative_dir, dir_entry)
+            except OSError:
+                continue
+            if pyproject is not None and relative_dir:
+                if not self.stop_at_data_ops_root:
+                    candidates.append((relative_dir, pyproject))
+                else:
+                    config = self._load_configs([(relative_dir, pyproject)])[0]
+                    yield os.path.join(self.root_dir, relative_dir), config
+                    if config is not None:
+                        continue
+            if self.max_depth is not None and depth >= self.max_depth:
+                continue
+            for name, entry in reversed(subdirs):
+                child_dir = os.path.join(relative_dir, name)
+                if not self.is_excluded(child_dir, name):
+                    pending.append((child_dir, depth + 1, entry))
+        for (relative_dir, _), config in zip(candidates, self._load_configs(candidates)):
+            yield os.path.join(self.root_dir, relative_dir), config
+
+    def _iter_data_ops_configs(self) -> Iterator[Tuple[str, Optional[dict]]]:
+        if self.index is not None:
+            self.index.begin_scan()
+            yield from self._walk_data_ops_configs(self.index.list_directory)
+            self.index.finish_scan()
+            return
+        yield from self._walk_data_ops_configs(self.source.list_directory)
+
+    def rebuild_index(self):
+        """Drop every cached entry so the next scan lists and parses the whole tree again."""
+        if self.index is not None:
+            self.index.invalidate()
 
     def parse_data_ops_configurations(self) -> List[str]:
-        return [root for root, dirs, files in os.walk(self.root_dir)
-                if "pyproject.toml" in files and root != self.root_dir
-                and _toml_file_has_matching_type(root, self.ops_type)]
+        return [directory for directory, config in self._iter_data_ops_configs()
+                if _data_ops_config_has_matching_type(config, self.ops_type)]
+
+    def iter_config_records(self) -> Iterator[Tuple[str, str, dict]]:
+        """Yield ``(type, directory, config)`` for every matching directory as the walk produces it.
+
+        The config carries the directory name under "name" in place of its type.
+        """
+        for directory, config in self._iter_data_ops_configs():
+            if _data_ops_config_has_matching_type(config, self.ops_type):
+                parsed_config = dict(config)
+                ops_type = parsed_config.pop("type")
+                parsed_config["name"] = directory.split("/")[-1]
+                yield ops_type, directory, parsed_config
+
+    def filter_changed_directories(self, directories: List[str], base_ref: str) -> List[str]:
+        """Keep the directories holding at least one file changed since base_ref.
+
+        Every directory is kept when the diff cannot be computed.
+        """
+        with PROFILER.phase("git_diff"):
+            changed_files = _changed_files_since(self.root_dir, base_ref)
+        if changed_files is None:
+            print("Falling back to every discovered directory", file=sys.stderr)
+            return directories
+        root_dir = os.path.abspath(self.root_dir)
+        by_relative_path = {os.path.relpath(os.path.abspath(directory), root_dir): directory
+                            for directory in directories}
+        changed = set()
+        for path in changed_files:
+            parent = os.path.dirname(os.path.normpath(path))
+            while parent:
+                if parent in by_relative_path:
+                    changed.add(by_relative_path[parent])
+                parent = os.path.dirname(parent)
+        return [directory for directory in directories if directory in changed]
+
+    def parse_changed_data_ops_configurations(self, base_ref: str) -> List[str]:
+        return self.filter_changed_directories(self.parse_data_ops_configurations(), base_ref)
+
+    def discover_directories_by_type(self, ops_types: List[str]) -> Dict[str, List[str]]:
+        """Walk the tree once and group the data-ops directories of every requested type.
+
+        Each pyproject.toml is parsed a single time. Passing "all" (or nothing) returns every
+        configured type; directories whose config has no type cannot be grouped and are skipped.
+        """
+        wanted = None if not ops_types or "all" in ops_types else set(ops_types)
+        grouped = {ops_type: [] for ops_type in wanted or []}
+        for directory, config in self._iter_data_ops_configs():
+            if config is None or config.get("type") is None:
+                continue
+            if wanted is None or config["type"] in wanted:
+                grouped.setdefault(config["type"], []).append(directory)
+        return grouped
+
+    def generate_discovery_json(self, ops_types: List[str], base_ref: Optional[str] = None) -> str:
+        root_dir = os.path.abspath(self.root_dir)
+        grouped = self.discover_directories_by_type(ops_types)
+        if base_ref:
+            changed = set(self.filter_changed_directories(
+                [directory for directories in grouped.values() for directory in directories], base_ref))
+            grouped = {ops_type: [directory for directory in directories if directory in changed]
+                       for ops_type, directories in grouped.items()}
+        discovered = {
+            ops_type: [{"name": os.path.basename(directory),
+                        "relative_path": os.path.relpath(os.path.abspath(directory), root_dir),
+                        "absolute_path": os.path.abspath(directory)}
+                       for directory in directories]
+            for ops_type, directories in grouped.items()
+        }
+        return json.dumps({"root": root_dir, "directories": discovered}, indent=2, sort_keys=True)
+
+    def iter_manifest_folders(self, ops_types: List[str], base_ref: Optional[str] = None) -> Iterator[dict]:
+        """Yield the manifest record of every data-ops directory of the requested types.
+
+        A record holds the directory, its type, the rest of its data-ops-config and the path of
+        every SQL file below it. Files of nested data-ops directories belong to those. Files are
+        listed, never read: in a partial clone their blobs stay unfetched, and consumers hash the
+        files they actually open.
+        """
+        root_dir = os.path.abspath(self.root_dir)
+        wanted = None if not ops_types or "all" in ops_types else set(ops_types)
+        records = [(directory, config) for directory, config in self._iter_data_ops_configs()
+                   if config is not None and config.get("type") is not None
+                   and (wanted is None or config["type"] in wanted)]
+        if base_ref:
+            changed = set(self.filter_changed_directories([directory for directory, _ in records], base_ref))
+            records = [(directory, config) for directory, config in records if directory in changed]
+        data_ops_dirs = {os.path.relpath(os.path.abspath(directory), root_dir) for directory, _ in records}
+
+        def is_pruned(relative_dir: str, name: str) -> bool:
+            return self.is_excluded(relative_dir, name) or os.path.normpath(relative_dir) in data_ops_dirs
+
+        for directory, config in records:
+            relative_dir = os.path.relpath(os.path.abspath(directory), root_dir)
+            sql_files = []
+            with PROFILER.phase("file_listing"):
+                for relative_path, _ in self.source.iter_files(relative_dir, is_pruned):
+                    if relative_path.lower().endswith(MANIFEST_FILE_SUFFIXES):
+                        sql_files.append({"path": os.path.relpath(relative_path, relative_dir).replace(os.sep, "/")})
+            folder_config = dict(config)
+            ops_type = folder_config.pop("type")
+            yield {"name": os.path.basename(os.path.abspath(directory)),
+                   "relative_path": relative_dir.replace(os.sep, "/"), "type": ops_type, "config": folder_config,
+                   "sql_files": sorted(sql_files, key=lambda sql_file: sql_file["path"])}
+
+    def write_workspace_manifest(self, stream: TextIO, ops_types: List[str], base_ref: Optional[str] = None,
+                                 header_only: bool = False) -> int:
+        """Write the workspace manifest as JSON lines, a header and then one record per directory.
+
+        Records are written as the walk finds them, and readers can stream them back one line at a
+        time. With header_only nothing is walked and the manifest lists no directories. Returns the
+        number of directories written.
+        """
+        header = {"manifest_version": MANIFEST_VERSION, "root": os.path.abspath(self.root_dir),
+                  "ops_types": [] if header_only else sorted(ops_types or ["all"]), "base_ref": base_ref,
+                  "git_ref": getattr(self.source, "ref", None)}
+        write_manifest_line(stream, header)
+        if header_only:
+            return 0
+        count = 0
+        for record in self.iter_manifest_folders(ops_types, base_ref):
+            write_manifest_line(stream, record)
+            count += 1
+        return count
+
+    def write_config_stream(self, stream: TextIO, output_format: str = "yaml", sort: bool = False):
+        """Serialize the matching configs to stream record by record.
+
+        "ndjson" writes one JSON object per line as soon as a record is discovered. "yaml" writes
+        the same document generate_yaml_config returns; records are grouped by type, so only the
+        record dicts are held until their type is emitted. sort orders records by directory for
+        output that can be diffed and cached.
+        """
+        records = self.iter_config_records()
+        if sort:
+            records = iter(sorted(records, key=lambda record: (record[0], record[1])))
+        if output_format == "ndjson":
+            for ops_type, directory, config in records:
+                stream.write(json.dumps({"type": ops_type, "path": directory, **config},
+                                        sort_keys=True, default=str) + "\n")
+            return
+        grouped = defaultdict(list)
+        for ops_type, _, config in records:
+            grouped[ops_type].append(config)
+        if not grouped:
+            stream.write(yaml.dump({}, Dumper=_ConfigDumper, default_flow_style=False))
+        for ops_type in sorted(grouped):
+            # The type is dumped with its first record, the others continue the same block sequence
+            configs = grouped.pop(ops_type)
+            stream.write(yaml.dump({ops_type: configs[:1]}, Dumper=_ConfigDumper, default_flow_style=False))
+            for config in configs[1:]:
+                stream.write(yaml.dump([config], Dumper=_ConfigDumper, default_flow_style=False))
 
     def generate_yaml_config(self) -> str:
-        yaml.add_representer(defaultdict, Representer.represent_dict)
-        data_ops_configurations = self.parse_data_ops_configurations()
-        parsed_configs = {}
-        for directory in data_ops_configurations:
-            parsed_config = _parse_individual_data_ops_config(directory)
-            ops_type = parsed_config.pop("type")
-            parsed_config["name"] = directory.split("/")[-1]
-            if ops_type not in parsed_configs:
-                parsed_configs[ops_type] = []
-            parsed_configs[ops_type].append(parsed_config)
-        return yaml.dump(parsed_configs, default_flow_style=False)
+        output = io.StringIO()
+        self.write_config_stream(output)
+        return output.getvalue()
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("operation", choices=["directory_types", "terraform_yaml_config"])
+    parser.add_argument("operation", choices=["directory_types", "terraform_yaml_config", "discover_directories",
+                                              "workspace_manifest"])
     parser.add_argument("directory")
-    parser.add_argument("--ops_type", choices=["tdv_ddl", "tdv_dml", "dml_with_dag", "ddl", "dml", "all", "stored_proc"])
+    parser.add_argument("--ops_type", choices=OPS_TYPE_CHOICES)
+    parser.add_argument("--ops_types", nargs="+", choices=OPS_TYPE_CHOICES,
+                        help="types grouped by discover_directories, defaults to --ops_type or all")
+    parser.add_argument("--base_ref", help="only return directories with files changed since this git ref")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="extra directory glob pruned from the walk, may be repeated")
+    parser.add_argument("--max_depth", type=int, help="deepest directory level below the root that is searched")
+    parser.add_argument("--stop_at_data_ops_root", action="store_true",
+                        help="do not search below a directory that already has a data-ops-config")
+    parser.add_argument("--toml_parser", default="auto", choices=["auto", "tomllib", "tomli", "toml"],
+                        help="TOML backend, auto picks tomllib, then tomli, then toml")
+    parser.add_argument("--parse_workers", type=int, default=1, help="size of the pool parsing pyproject.toml files")
+    parser.add_argument("--parse_executor", default="thread", choices=["thread", "process"])
+    parser.add_argument("--no_prefilter", action="store_true",
+                        help="fully parse every pyproject.toml instead of rejecting obvious non-matches first")
+    parser.add_argument("--format", default="yaml", choices=["yaml", "ndjson"], help="terraform_yaml_config output format")
+    parser.add_argument("--sort", action="store_true", help="order terraform_yaml_config records by directory")
+    parser.add_argument("--output", help="write terraform_yaml_config or workspace_manifest to this file instead of stdout")
+    parser.add_argument("--header_only", action="store_true",
+                        help="write a workspace_manifest that lists no directories, without walking the workspace")
+    parser.add_argument("--git_ref", help="read the tree at this ref from the git objects in directory, no checkout needed")
+    parser.add_argument("--index", help="path of a discovery index reused between runs on the same workspace")
+    parser.add_argument("--rebuild_index", action="store_true", help="discard the discovery index before scanning")
+    parser.add_argument("--profile", default=os.environ.get("OBTAIN_BUILD_CONFIG_PROFILE"),
+                        help="write phase timings, cProfile, peak memory and import times of this run to this JSON file")
     args = parser.parse_args()
+    if args.git_ref and args.index:
+        parser.error("--index cannot be combined with --git_ref")
+
+    with PROFILER.profiling(args.profile, "toml_utilities", os.path.dirname(os.path.abspath(__file__))):
+        _run_operation(args)
+
 
-    toml_utils = TomlUtilities(args.directory, args.ops_type)
-    if args.operation == "directory_types":
+def _run_operation(args: argparse.Namespace):
+    with PROFILER.phase("setup"):
+        source = GitObjectSource(args.directory, args.git_ref) if args.git_ref else None
+        toml_utils = TomlUtilities(args.directory, args.ops_type, index_path=args.index,
+                                   exclude_globs=DEFAULT_EXCLUDE_GLOBS + tuple(args.exclude), max_depth=args.max_depth,
+                                   stop_at_data_ops_root=args.stop_at_data_ops_root, toml_parser=args.toml_parser,
+                                   parse_workers=args.parse_workers, parse_executor=args.parse_executor,
+                                   prefilter=not args.no_prefilter, source=source)
+    if args.rebuild_index:
+        toml_utils.rebuild_index()
+    if args.operation == "directory_types" and args.base_ref:
+        print(config_list_to_str_for_console_output(toml_utils.parse_changed_data_ops_configurations(args.base_ref)))
+    elif args.operation == "directory_types":
         print(config_list_to_str_for_console_output(toml_utils.parse_data_ops_configurations()))
-    if args.operation == "terraform_yaml_config":
-        print(toml_utils.generate_yaml_config())
+    if args.operation == "terraform_yaml_config" and args.output:
+        with open(args.output, "w") as output_file:
+            toml_utils.write_config_stream(output_file, args.format, args.sort)
+    elif args.operation == "terraform_yaml_config":
+        toml_utils.write_config_stream(sys.stdout, args.format, args.sort)
+    if args.operation == "discover_directories":
+        print(toml_utils.generate_discovery_json(args.ops_types or [args.ops_type or "all"], args.base_ref))
+    if args.operation == "workspace_manifest" and args.output:
+        with open(args.output, "w") as output_file:
+            toml_utils.write_workspace_manifest(output_file, args.ops_types or [args.ops_type or "all"], args.base_ref,
+                                                args.header_only)
+    elif args.operation == "workspace_manifest":
+        toml_utils.write_workspace_manifest(sys.stdout, args.ops_types or [args.ops_type or "all"], args.base_ref,
+                                            args.header_only)
+    toml_utils.source.close()
 
 
 if __name__ == "__main__":
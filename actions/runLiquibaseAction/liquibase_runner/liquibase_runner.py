@@ -0,0 +1,513 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import teradatasql
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from dataops_common.manifest import DEPLOY_ORDER, WorkspaceManifest
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FAILURE_MODES = ("fail-fast", "continue")
+CHANGELOG_PROPERTIES = ("changeLogFile", "changelogFile", "changelog-file", "liquibase.command.changelogFile")
+SCHEMA_PROPERTIES = ("liquibaseSchemaName", "liquibase-schema-name", "defaultSchemaName", "default-schema-name")
+TERADATA_URL_PATTERN = re.compile(r"^jdbc:teradata://([^/]+)/?(.*)$", re.I)
+SCHEMA_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_$#]+$")
+FORMATTED_SQL_CHANGESET = re.compile(r"^--\s*changeset\s+([^:\s]+):(\S+)(.*)$", re.I | re.M)
+STATE_VERSION = 1
+
+
+@dataclass
+class StepResult:
+    name: str
+    returncode: int
+    duration: float
+    output: str
+
+
+@dataclass
+class FolderRun:
+    folder: str
+    succeeded: bool = False
+    skipped: bool = False
+    reason: Optional[str] = None
+    steps: List[StepResult] = field(default_factory=list)
+    duration: float = 0.0
+    up_to_date: bool = False
+
+    @property
+    def status(self):
+        if self.up_to_date:
+            return "up to date"
+        return "passed" if self.succeeded else "SKIPPED" if self.skipped else "FAILED"
+
+
+@dataclass
+class Changeset:
+    id: str
+    author: str
+    filename: str
+    checksum: str
+    run_always: bool = False
+
+    # # DATABASECHANGELOG.FILENAME holds the path as liquibase resolved it, so only the file name is compared
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return self.id, self.author, os.path.basename(self.filename.replace("\\", "/"))
+
+    @property
+    def state_key(self) -> str:
+        return "::".join(self.key)
+
+
+@dataclass
+class FolderChangelog:
+    folder: str
+    changesets: List[Changeset] = field(default_factory=list)
+    schema: Optional[str] = None
+    host: Optional[str] = None
+    logmech: Optional[str] = None
+    error: Optional[str] = None
+
+
+# # Returns the (name, argv) liquibase steps of one folder, tag runs first when an update is tagged
+def build_steps(folder, tdv_env, command, tag=None, liquibase="./liquibase/liquibase") -> List[Tuple[str, List[str]]]:
+    properties_file = os.path.join(folder, "config", tdv_env, "liquibase.properties")
+    common = [f"--defaultsFile={properties_file}", "--logLevel=FINE"]
+    tag_args = [f"--tag={tag}"] if tag else []
+    steps = []
+    if tag and command == "update":
+        steps.append(("tag", [liquibase, "tag", *tag_args, *common]))
+    steps.append((command, [liquibase, command, *tag_args, *common]))
+    return steps
+
+
+# # Parses FOLDER:DEPENDENCY[,DEPENDENCY...] constraints, a folder only starts once its dependencies passed
+def parse_dependencies(specs) -> Dict[str, Set[str]]:
+    dependencies = {}
+    for spec in specs or []:
+        folder, separator, upstream = spec.partition(":")
+        if not separator or not folder.strip():
+            raise ValueError(f"Invalid --depends_on {spec!r}, expected FOLDER:DEPENDENCY[,DEPENDENCY...]")
+        dependencies.setdefault(folder.strip(), set()).update(name.strip() for name in upstream.split(",") if name.strip())
+    return dependencies
+
+
+# # Raises ValueError when the ordering constraints between the folders of this run form a cycle
+def _check_acyclic(folders, dependencies):
+    state = {}
+    for root in folders:
+        if state.get(root) == "done":
+            continue
+        state[root] = "visiting"
+        stack = [(root, iter(sorted(dependencies.get(root, ()))))]
+        while stack:
+            folder, upstream = stack[-1]
+            for dependency in upstream:
+                if state.get(dependency) == "visiting":
+                    raise ValueError(f"Folder ordering constraints form a cycle through {dependency}")
+                if state.get(dependency) is None:
+                    state[dependency] = "visiting"
+                    stack.append((dependency, iter(sorted(dependencies.get(dependency, ())))))
+                    break
+            else:
+                state[folder] = "done"
+                stack.pop()
+
+
+# # Returns the folders of a workspace manifest written by toml_utilities, resolved against the workspace root
+# # Stored procedures come first, then DDL, then DML, the order FOLDER_LIST carries
+def read_manifest_folders(path, root=None) -> List[str]:
+    return WorkspaceManifest(path, root).folder_paths(DEPLOY_ORDER)
+
+
+def read_properties(path) -> Dict[str, str]:
+    properties = {}
+    with open(path) as properties_file:
+        for line in properties_file:
+            line = line.strip()
+            if not line or line[0] in "#!":
+                continue
+            key, _, value = line.partition("=") if "=" in line else line.partition(":")
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def _changeset_checksum(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _local_name(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def _is_true(value):
+    return str(value).strip().lower() == "true"
+
+
+# # Returns the changesets of a changelog and of everything it includes, in liquibase's order
+def parse_changelog(path, _seen=None) -> List[Changeset]:
+    seen = set() if _seen is None else _seen
+    real_path = os.path.realpath(path)
+    if real_path in seen:
+        return []
+    seen.add(real_path)
+    if path.lower().endswith(".sql"):
+        return _parse_formatted_sql(path)
+    if not path.lower().endswith(".xml"):
+        raise ValueError(f"Unsupported changelog format {path}")
+
+    changesets = []
+    directory = os.path.dirname(path)
+    for element in ET.parse(path).getroot():
+        name = _local_name(element)
+        relative = _is_true(element.get("relativeToChangelogFile"))
+        if name == "changeSet":
+            sql_files = []
+            for child in element.iter():
+                if _local_name(child) == "sqlFile" and child.get("path"):
+                    sql_path = os.path.join(directory, child.get("path")) if _is_true(
+                        child.get("relativeToChangelogFile")) else child.get("path")
+                    with open(sql_path, "rb") as sql_file:
+                        sql_files.append(sql_file.read())
+            changesets.append(Changeset(element.get("id", ""), element.get("author", ""), path,
+                                        _changeset_checksum(ET.tostring(element), *sql_files),
+                                        _is_true(element.get("runAlways"))))
+        elif name == "include" and element.get("file"):
+            included = os.path.join(directory, element.get("file")) if relative else element.get("file")
+            changesets.extend(parse_changelog(included, seen))
+        elif name == "includeAll" and element.get("path"):
+            included_dir = os.path.join(directory, element.get("path")) if relative else element.get("path")
+            for file_name in sorted(os.listdir(included_dir)):
+                if file_name.lower().endswith((".xml", ".sql")):
+                    changesets.extend(parse_changelog(os.path.join(included_dir, file_name), seen))
+    return changesets
+
+
+def _parse_formatted_sql(path) -> List[Changeset]:
+    with open(path) as sql_file:
+        content = sql_file.read()
+    if not content.lstrip().lower().startswith("--liquibase formatted sql"):
+        raise ValueError(f"{path} is not a formatted SQL changelog")
+    matches = list(FORMATTED_SQL_CHANGESET.finditer(content))
+    return [Changeset(match.group(2), match.group(1), path,
+                      _changeset_checksum(content[match.start():matches[number + 1].start() if number + 1 < len(matches) else len(content)]),
+                      "runalways:true" in match.group(3).replace(" ", "").lower())
+            for number, match in enumerate(matches)]
+
+
+# # Reads the changelog, DATABASECHANGELOG schema and host of a folder from its liquibase.properties
+def load_folder_changelog(folder, tdv_env) -> FolderChangelog:
+    loaded = FolderChangelog(folder)
+    properties_file = os.path.join(folder, "config", tdv_env, "liquibase.properties")
+    try:
+        properties = read_properties(properties_file)
+        changelog = next((properties[key] for key in CHANGELOG_PROPERTIES if properties.get(key)), None)
+        if changelog is None:
+            raise ValueError(f"{properties_file} names no changelog file")
+        search_dirs = [search_dir.strip() for search_dir in properties.get("searchPath", "").split(",") if search_dir.strip()]
+        candidates = [os.path.join(base, changelog) for base in [*search_dirs, "", folder, os.path.dirname(properties_file)]]
+        changelog_path = next((candidate for candidate in candidates if os.path.isfile(candidate)), None)
+        if changelog_path is None:
+            raise ValueError(f"changelog {changelog} not found")
+        loaded.changesets = parse_changelog(changelog_path)
+
+        url = TERADATA_URL_PATTERN.match(properties.get("url", ""))
+        if url is None:
+            raise ValueError(f"{properties_file} has no jdbc:teradata url")
+        url_parameters = {key.strip().upper(): value.strip() for key, _, value in
+                          (parameter.partition("=") for parameter in url.group(2).split(",") if "=" in parameter)}
+        loaded.host, loaded.logmech = url.group(1), url_parameters.get("LOGMECH")
+        loaded.schema = next((properties[key] for key in SCHEMA_PROPERTIES if properties.get(key)), None) or url_parameters.get("DATABASE")
+        if not loaded.schema or not SCHEMA_NAME_PATTERN.match(loaded.schema):
+            raise ValueError(f"no usable DATABASECHANGELOG schema in {properties_file}")
+    except (OSError, ValueError, ET.ParseError) as e:
+        loaded.error = str(e)
+    return loaded
+
+
+# # Reads the applied changesets of every schema with one UNION ALL request, falling back to one request per schema
+def fetch_applied_changesets(td_conn, schemas) -> Dict[str, Optional[Set[Tuple[str, str, str]]]]:
+    def select(schema):
+        return f"SELECT '{schema}' AS CHANGELOG_SCHEMA, ID, AUTHOR, FILENAME FROM {schema}.DATABASECHANGELOG"
+
+    def rows_by_schema(query):
+        with td_conn.cursor() as cursor:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+        applied = {}
+        for schema, changeset_id, author, filename in rows:
+            applied.setdefault(schema, set()).add(
+                (str(changeset_id).strip(), str(author).strip(), os.path.basename(str(filename).strip().replace("\\", "/"))))
+        return applied
+
+    schemas = sorted(set(schemas))
+    try:
+        applied = rows_by_schema(" UNION ALL ".join(select(schema) for schema in schemas))
+        return {schema: applied.get(schema, set()) for schema in schemas}
+    except Exception as e:
+        logger.info(f"Batched DATABASECHANGELOG read failed, reading schema by schema: {e}")
+    applied = {}
+    for schema in schemas:
+        try:
+            applied[schema] = rows_by_schema(select(schema)).get(schema, set())
+        except Exception as e:
+            logger.info(f"Cannot read {schema}.DATABASECHANGELOG: {e}")
+            applied[schema] = None
+    return applied
+
+
+class ChangesetState:
+    """Checksums of the changesets each folder had when liquibase last applied it, kept in a JSON file between runs."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.folders: Dict[str, Dict[str, str]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as state_file:
+                    state = json.load(state_file)
+                if state.get("version") == STATE_VERSION:
+                    self.folders = state["folders"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.info(f"Ignoring unreadable changeset state {path}: {e}")
+
+    def record(self, folder, changesets):
+        self.folders[folder] = {changeset.state_key: changeset.checksum for changeset in changesets}
+
+    def save(self):
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w") as state_file:
+                json.dump({"version": STATE_VERSION, "folders": self.folders}, state_file, indent=1, sort_keys=True)
+
+
+# # Returns why a folder has to run, or None when every changeset is applied and unchanged since the last run
+def pending_reason(changelog, applied, state) -> Optional[str]:
+    if changelog.error:
+        return changelog.error
+    if applied is None:
+        return f"{changelog.schema}.DATABASECHANGELOG could not be read"
+    recorded = state.folders.get(changelog.folder, {})
+    for changeset in changelog.changesets:
+        label = f"changeset {changeset.author}:{changeset.id}"
+        if changeset.run_always:
+            return f"{label} runs always"
+        if changeset.key not in applied:
+            return f"{label} is not applied"
+        if recorded.get(changeset.state_key) != changeset.checksum:
+            return f"{label} changed since the last recorded run"
+    return None
+
+
+def precheck_folders(changelogs, state, user, password) -> Dict[str, Optional[str]]:
+    """Returns the pending reason of every folder, None for folders with nothing to apply.
+
+    Folders are grouped by Teradata host, each host gets one logon and one DATABASECHANGELOG request.
+    """
+    by_host: Dict[Tuple[str, Optional[str]], List[FolderChangelog]] = {}
+    for changelog in changelogs:
+        if changelog.error is None:
+            by_host.setdefault((changelog.host, changelog.logmech), []).append(changelog)
+    applied: Dict[str, Optional[Set]] = {}
+    for (host, logmech), host_changelogs in by_host.items():
+        connect_kwargs = {"host": host, "user": user, "password": password}
+        if logmech:
+            connect_kwargs["logmech"] = logmech
+        schemas = [changelog.schema for changelog in host_changelogs]
+        try:
+            with teradatasql.connect(**connect_kwargs) as td_conn:
+                host_applied = fetch_applied_changesets(td_conn, schemas)
+        except Exception as e:
+            logger.info(f"Precheck cannot log on to {host}: {e}")
+            host_applied = {schema: None for schema in schemas}
+        for changelog in host_changelogs:
+            applied[changelog.folder] = host_applied[changelog.schema]
+    return {changelog.folder: pending_reason(changelog, applied.get(changelog.folder), state) for changelog in changelogs}
+
+
+def run_folder(folder, steps, env=None) -> FolderRun:
+    """Runs the liquibase steps of one folder one after another, stopping at the first failing step."""
+    run = FolderRun(folder)
+    started = time.perf_counter()
+    for name, argv in steps:
+        step_started = time.perf_counter()
+        completed = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+        run.steps.append(StepResult(name, completed.returncode, time.perf_counter() - step_started, completed.stdout))
+        if completed.returncode != 0:
+            run.reason = f"liquibase {name} exited with {completed.returncode}"
+            break
+    else:
+        run.succeeded = True
+    run.duration = time.perf_counter() - started
+    return run
+
+
+# # Prints the captured output of a folder as one log group, so parallel folders do not interleave
+def _print_folder_output(run):
+    print(f"::group::{run.folder} {run.status} in {run.duration:.1f}s")
+    for step in run.steps:
+        print(f"---- liquibase {step.name} (exit {step.returncode}, {step.duration:.1f}s)")
+        print(step.output, end="" if step.output.endswith("\n") else "\n")
+    print("::endgroup::")
+    sys.stdout.flush()
+
+
+def run_folders(folders, steps_for, parallelism=1, dependencies=None, failure_mode="fail-fast",
+                env=None) -> List[FolderRun]:
+    """Runs every folder on up to parallelism liquibase processes and returns one FolderRun per folder, in input order.
+
+    A folder starts once all of its dependencies within this run passed; if one of them did not, the folder is
+    skipped. In fail-fast mode no new folder starts after the first failure, folders already running finish.
+    """
+    if failure_mode not in FAILURE_MODES:
+        raise ValueError(f"Unknown failure mode {failure_mode}, expected one of {FAILURE_MODES}")
+    dependencies = {folder: set(dependencies.get(folder, ())) & set(folders) for folder in folders} if dependencies else {
+        folder: set() for folder in folders}
+    _check_acyclic(folders, dependencies)
+
+    runs: Dict[str, FolderRun] = {}
+    pending = list(folders)
+    stop = False
+    with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+        running = {}
+        while pending or running:
+            for folder in list(pending):
+                if stop:
+                    runs[folder] = FolderRun(folder, skipped=True, reason="skipped after an earlier folder failed")
+                    pending.remove(folder)
+                    continue
+                blocked = [dependency for dependency in sorted(dependencies[folder])
+                           if dependency in runs and not runs[dependency].succeeded]
+                if blocked:
+                    runs[folder] = FolderRun(folder, skipped=True, reason=f"dependency {blocked[0]} did not pass")
+                    pending.remove(folder)
+                elif all(dependency in runs for dependency in dependencies[folder]) and len(running) < max(1, parallelism):
+                    logger.info(f"Starting liquibase for {folder}")
+                    running[executor.submit(run_folder, folder, steps_for(folder), env)] = folder
+                    pending.remove(folder)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                run = future.result()
+                runs[running.pop(future)] = run
+                _print_folder_output(run)
+                if not run.succeeded and failure_mode == "fail-fast":
+                    stop = True
+    for folder in folders:
+        if runs[folder].skipped:
+            logger.info(f"{folder}: {runs[folder].reason}")
+    return [runs[folder] for folder in folders]
+
+
+def summary_markdown(runs, command):
+    lines = [f"### Liquibase {command}", "", "| Folder | Result | Duration (s) | Steps |", "|---|---|---:|---|"]
+    for run in runs:
+        steps = ", ".join(f"{step.name} {step.duration:.1f}s" for step in run.steps) or run.reason or ""
+        lines.append(f"| `{run.folder}` | {run.status} | {run.duration:.1f} | {steps} |")
+    return "\n".join(lines) + "\n"
+
+
+def summary_json(runs):
+    return [{"folder": run.folder, "status": run.status, "reason": run.reason, "duration_seconds": round(run.duration, 3),
+             "steps": [{"name": step.name, "returncode": step.returncode, "duration_seconds": round(step.duration, 3)}
+                       for step in run.steps]}
+            for run in runs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run liquibase for every folder on a bounded pool of processes")
+    parser.add_argument("folders", nargs="*", help="folders to run, defaults to the space separated FOLDER_LIST")
+    parser.add_argument("--tdv_env", default=os.environ.get("TDV_ENV"))
+    parser.add_argument("--command", default=os.environ.get("LIQUIBASE_COMMAND") or "update")
+    parser.add_argument("--tag", default=os.environ.get("LIQUIBASE_TAG") or None)
+    parser.add_argument("--liquibase", default=os.environ.get("LIQUIBASE_PATH") or "./liquibase/liquibase")
+    parser.add_argument("--parallelism", type=int, default=int(os.environ.get("LIQUIBASE_PARALLELISM") or 1))
+    parser.add_argument("--failure_mode", choices=FAILURE_MODES,
+                        default=os.environ.get("LIQUIBASE_FAILURE_MODE") or "fail-fast")
+    parser.add_argument("--depends_on", action="append", default=(os.environ.get("LIQUIBASE_DEPENDS_ON") or "").split(),
+                        help="FOLDER:DEPENDENCY[,DEPENDENCY...], can be repeated")
+    parser.add_argument("--report", default=os.environ.get("LIQUIBASE_REPORT_PATH"), help="JSON summary output path")
+    parser.add_argument("--precheck", action="store_true", default=_is_true(os.environ.get("LIQUIBASE_PRECHECK")),
+                        help="skip folders whose changesets are all applied and unchanged")
+    parser.add_argument("--state", default=os.environ.get("LIQUIBASE_STATE_PATH"),
+                        help="JSON file keeping the changeset checksums of the last applied run")
+    parser.add_argument("--manifest", default=os.environ.get("LIQUIBASE_MANIFEST_PATH"),
+                        help="workspace manifest whose folders replace FOLDER_LIST")
+    args = parser.parse_args()
+
+    folders = args.folders
+    if not folders and args.manifest:
+        try:
+            folders = read_manifest_folders(args.manifest)
+            logger.info(f"Read {len(folders)} folders from the workspace manifest {args.manifest}")
+        except (OSError, ValueError) as e:
+            logger.info(f"Ignoring workspace manifest {args.manifest}: {e}")
+    folders = folders or (os.environ.get("FOLDER_LIST") or "").split()
+    folders = list(dict.fromkeys(folder for folder in folders if folder.strip()))
+    if not folders or not args.tdv_env:
+        logger.info("No folders or TDV_ENV given, nothing to run")
+        return
+
+    # Credentials reach liquibase through its own environment variables instead of the command line
+    env = dict(os.environ)
+    env["LIQUIBASE_COMMAND_USERNAME"] = os.environ.get("TDV_USERNAME", "")
+    env["LIQUIBASE_COMMAND_PASSWORD"] = os.environ.get("TDV_PASSWORD", "")
+
+    changelogs, reasons = {}, {}
+    state = ChangesetState(args.state)
+    if args.precheck and args.command == "update":
+        started = time.perf_counter()
+        changelogs = {folder: load_folder_changelog(folder, args.tdv_env) for folder in folders}
+        if args.tag:
+            logger.info("Every folder has to be tagged, the precheck skips no folder")
+        else:
+            reasons = precheck_folders(changelogs.values(), state, env["LIQUIBASE_COMMAND_USERNAME"],
+                                       env["LIQUIBASE_COMMAND_PASSWORD"])
+            for folder in folders:
+                logger.info(f"{folder}: {reasons[folder] or 'no pending changesets'}")
+        logger.info(f"Changeset precheck took {time.perf_counter() - started:.1f}s")
+    elif args.precheck:
+        logger.info(f"The changeset precheck only applies to update, running liquibase {args.command} for every folder")
+
+    pending = [folder for folder in folders if reasons.get(folder, "") is not None]
+    logger.info(f"Running liquibase {args.command} for {len(pending)} of {len(folders)} folders, {args.parallelism} at a time, {args.failure_mode}")
+    ran = {run.folder: run for run in run_folders(
+        pending, lambda folder: build_steps(folder, args.tdv_env, args.command, args.tag, args.liquibase),
+        args.parallelism, parse_dependencies(args.depends_on), args.failure_mode, env)}
+    runs = [ran.get(folder) or FolderRun(folder, succeeded=True, up_to_date=True, reason="no pending changesets")
+            for folder in folders]
+    if changelogs:
+        for run in runs:
+            if run.succeeded and changelogs[run.folder].error is None:
+                state.record(run.folder, changelogs[run.folder].changesets)
+        state.save()
+
+    print(summary_markdown(runs, args.command))
+    if os.environ.get("GITHUB_STEP_SUMMARY"):
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as summary_file:
+            summary_file.write(summary_markdown(runs, args.command))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(summary_json(runs), report_file, indent=2)
+    if not all(run.succeeded for run in runs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
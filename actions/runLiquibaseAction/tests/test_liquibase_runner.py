@@ -0,0 +1,283 @@
+import json
+import re
+import os
+import sys
+import threading
+import time
+import pytest
+from unittest.mock import patch
+
+# Point Python to the actual implementation module (not this test file)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'liquibase_runner')))
+import liquibase_runner as lr
+
+
+def _fake_steps(outcomes):
+    """Steps running the current python, outcomes maps a folder to (seconds, exit code)."""
+    def steps_for(folder):
+        seconds, code = outcomes.get(folder, (0, 0))
+        script = f"import time; print('liquibase {folder}'); time.sleep({seconds}); raise SystemExit({code})"
+        return [("update", [sys.executable, "-c", script])]
+    return steps_for
+
+
+def test_build_steps_tags_before_update():
+    steps = lr.build_steps("db/claims", "dev", "update", tag="v1")
+
+    assert [name for name, _ in steps] == ["tag", "update"]
+    assert steps[0][1] == ["./liquibase/liquibase", "tag", "--tag=v1",
+                           f"--defaultsFile={os.path.join('db/claims', 'config', 'dev', 'liquibase.properties')}",
+                           "--logLevel=FINE"]
+    assert steps[1][1][:3] == ["./liquibase/liquibase", "update", "--tag=v1"]
+    assert [name for name, _ in lr.build_steps("db/claims", "dev", "status")] == ["status"]
+    assert not any("--password" in arg for _, argv in steps for arg in argv)
+
+
+def test_parse_dependencies():
+    assert lr.parse_dependencies(["b:a", "c:a,b", "c:d"]) == {"b": {"a"}, "c": {"a", "b", "d"}}
+    with pytest.raises(ValueError, match="Invalid --depends_on"):
+        lr.parse_dependencies(["no_separator"])
+
+
+def test_run_folders_captures_output_and_durations(capsys):
+    runs = lr.run_folders(["a", "b"], _fake_steps({"b": (0, 3)}), parallelism=2, failure_mode="continue")
+
+    assert [run.status for run in runs] == ["passed", "FAILED"]
+    assert runs[1].reason == "liquibase update exited with 3"
+    assert runs[0].steps[0].output.strip() == "liquibase a"
+    out = capsys.readouterr().out
+    assert "::group::a passed" in out and "::group::b FAILED" in out
+
+
+def test_run_folders_runs_in_parallel_up_to_the_bound():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def fake_run_folder(folder, steps, env=None):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return lr.FolderRun(folder, succeeded=True)
+
+    with patch.object(lr, "run_folder", fake_run_folder):
+        runs = lr.run_folders([f"f{number}" for number in range(6)], lambda folder: [], parallelism=3)
+
+    assert all(run.succeeded for run in runs)
+    assert peak[0] == 3
+
+
+def test_run_folders_respects_dependencies_and_skips_dependents_of_failures():
+    started = []
+
+    def fake_run_folder(folder, steps, env=None):
+        started.append(folder)
+        return lr.FolderRun(folder, succeeded=folder != "base")
+
+    with patch.object(lr, "run_folder", fake_run_folder):
+        runs = lr.run_folders(["child", "base", "other", "grandchild"], lambda folder: [], parallelism=4,
+                              dependencies={"child": {"base"}, "grandchild": {"child"}}, failure_mode="continue")
+
+    assert sorted(started) == ["base", "other"]
+    assert [run.status for run in runs] == ["SKIPPED", "FAILED", "passed", "SKIPPED"]
+    assert runs[0].reason == "dependency base did not pass"
+
+
+def test_run_folders_fail_fast_stops_starting_folders():
+    with patch.object(lr, "run_folder", lambda folder, steps, env=None: lr.FolderRun(folder, succeeded=folder != "a")):
+        runs = lr.run_folders(["a", "b", "c"], lambda folder: [], parallelism=1)
+
+    assert [run.status for run in runs] == ["FAILED", "SKIPPED", "SKIPPED"]
+
+
+def test_run_folders_rejects_cycles():
+    with pytest.raises(ValueError, match="cycle"):
+        lr.run_folders(["a", "b"], lambda folder: [], dependencies={"a": {"b"}, "b": {"a"}})
+
+
+def test_main_writes_summary_and_report(tmp_path, monkeypatch):
+    summary, report = tmp_path / "summary.md", tmp_path / "report.json"
+    for name, value in {"FOLDER_LIST": "a b", "TDV_ENV": "dev", "TDV_USERNAME": "u", "TDV_PASSWORD": "secret",
+                        "GITHUB_STEP_SUMMARY": str(summary), "LIQUIBASE_REPORT_PATH": str(report)}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(sys, "argv", ["liquibase_runner", "--parallelism", "2", "--tag", "v1"])
+    calls = []
+
+    def fake_run(argv, env=None, **kwargs):
+        calls.append((argv, env))
+        failed = argv[1] == "update" and argv[3].startswith(f"--defaultsFile={os.path.join('b', '')}")
+        return lr.subprocess.CompletedProcess(argv, 1 if failed else 0, "")
+
+    with patch.object(lr.subprocess, "run", fake_run):
+        with pytest.raises(SystemExit):
+            lr.main()
+
+    assert all(env["LIQUIBASE_COMMAND_PASSWORD"] == "secret" and "secret" not in argv for argv, env in calls)
+    assert "| `b` | FAILED |" in summary.read_text()
+    assert [entry["status"] for entry in json.loads(report.read_text())] == ["passed", "FAILED"]
+
+
+CHANGELOG = """<?xml version="1.0" encoding="UTF-8"?>
+<databaseChangeLog xmlns="http://www.liquibase.org/xml/ns/dbchangelog">
+    <changeSet id="1" author="ana">
+        <sql>CREATE TABLE T1 (C INTEGER);</sql>
+    </changeSet>
+    <changeSet id="2" author="ana" runAlways="{run_always}">
+        <sqlFile path="procs/load.sql" relativeToChangelogFile="true"/>
+    </changeSet>
+    <include file="more.sql" relativeToChangelogFile="true"/>
+</databaseChangeLog>
+"""
+
+
+def _write_folder(root, name, run_always="false", schema="STG_DB"):
+    folder = root / name
+    (folder / "changelog" / "procs").mkdir(parents=True)
+    (folder / "config" / "dev").mkdir(parents=True)
+    (folder / "changelog" / "dev.changelog.xml").write_text(CHANGELOG.format(run_always=run_always))
+    (folder / "changelog" / "procs" / "load.sql").write_text("REPLACE PROCEDURE P () BEGIN END;")
+    (folder / "changelog" / "more.sql").write_text(
+        "--liquibase formatted sql\n--changeset bo:3\nCREATE VIEW V1 AS SELECT 1 AS C;\n"
+        "--changeset bo:4 runOnChange:true\nCREATE VIEW V2 AS SELECT 2 AS C;\n")
+    (folder / "config" / "dev" / "liquibase.properties").write_text(
+        f"# {name}\nchangeLogFile=changelog/dev.changelog.xml\n"
+        f"url=jdbc:teradata://tdhost/DATABASE={schema},LOGMECH=LDAP\n")
+    return str(folder)
+
+
+class FakeChangelogConnection:
+    """Answers DATABASECHANGELOG selects from applied, a dict of schema to (id, author, filename) rows."""
+
+    def __init__(self, applied, batched=True):
+        self.applied = applied
+        self.batched = batched
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                pass
+
+            def execute(self, query):
+                connection.queries.append(query)
+                if "UNION ALL" in query and not connection.batched:
+                    raise RuntimeError("[Error 3807] Object 'MISSING.DATABASECHANGELOG' does not exist.")
+                self.rows = []
+                for schema in re.findall(r"FROM (\w+)\.DATABASECHANGELOG", query):
+                    if schema not in connection.applied:
+                        raise RuntimeError(f"[Error 3807] Object '{schema}.DATABASECHANGELOG' does not exist.")
+                    self.rows.extend((schema, *row) for row in connection.applied[schema])
+
+            def fetchall(self):
+                return self.rows
+
+        return Cursor()
+
+
+def _applied_rows(folder):
+    return [("1", "ana", f"{folder}/changelog/dev.changelog.xml"), ("2", "ana", "changelog/dev.changelog.xml"),
+            ("3", "bo", "changelog/more.sql"), ("4", "bo", "more.sql")]
+
+
+def test_load_folder_changelog_follows_includes(tmp_path):
+    changelog = lr.load_folder_changelog(_write_folder(tmp_path, "claims"), "dev")
+
+    assert changelog.error is None
+    assert [changeset.key for changeset in changelog.changesets] == [
+        ("1", "ana", "dev.changelog.xml"), ("2", "ana", "dev.changelog.xml"), ("3", "bo", "more.sql"), ("4", "bo", "more.sql")]
+    assert (changelog.schema, changelog.host, changelog.logmech) == ("STG_DB", "tdhost", "LDAP")
+    assert lr.load_folder_changelog(str(tmp_path / "missing"), "dev").error
+
+
+def test_changeset_checksum_covers_referenced_sql_files(tmp_path):
+    folder = _write_folder(tmp_path, "claims")
+    before = lr.load_folder_changelog(folder, "dev").changesets
+    (tmp_path / "claims" / "changelog" / "procs" / "load.sql").write_text("REPLACE PROCEDURE P () BEGIN SELECT 1; END;")
+    after = lr.load_folder_changelog(folder, "dev").changesets
+
+    assert [a.checksum == b.checksum for a, b in zip(before, after)] == [True, False, True, True]
+
+
+def test_fetch_applied_changesets_batches_and_falls_back():
+    td_conn = FakeChangelogConnection({"A": [("1", "ana", "x.xml")], "B": []})
+    assert lr.fetch_applied_changesets(td_conn, ["B", "A"]) == {"A": {("1", "ana", "x.xml")}, "B": set()}
+    assert len(td_conn.queries) == 1
+
+    td_conn = FakeChangelogConnection({"A": [("1", "ana", "dir/x.xml")]}, batched=False)
+    assert lr.fetch_applied_changesets(td_conn, ["A", "MISSING"]) == {"A": {("1", "ana", "x.xml")}, "MISSING": None}
+
+
+def test_pending_reason(tmp_path):
+    changelog = lr.load_folder_changelog(_write_folder(tmp_path, "claims"), "dev")
+    applied = {changeset.key for changeset in changelog.changesets}
+    state = lr.ChangesetState()
+
+    assert lr.pending_reason(changelog, applied, state) == "changeset ana:1 changed since the last recorded run"
+    state.record(changelog.folder, changelog.changesets)
+    assert lr.pending_reason(changelog, applied, state) is None
+    assert lr.pending_reason(changelog, applied - {("3", "bo", "more.sql")}, state) == "changeset bo:3 is not applied"
+    assert lr.pending_reason(changelog, None, state) == "STG_DB.DATABASECHANGELOG could not be read"
+
+
+def test_main_precheck_skips_up_to_date_folders(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folders = [_write_folder(tmp_path, "claims"), _write_folder(tmp_path, "members", run_always="true", schema="MBR_DB")]
+    state_path, report = tmp_path / "state" / "changesets.json", tmp_path / "report.json"
+    for name, value in {"FOLDER_LIST": " ".join(folders), "TDV_ENV": "dev", "TDV_USERNAME": "u", "TDV_PASSWORD": "p",
+                        "LIQUIBASE_PRECHECK": "true", "LIQUIBASE_STATE_PATH": str(state_path),
+                        "LIQUIBASE_REPORT_PATH": str(report), "GITHUB_STEP_SUMMARY": ""}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(sys, "argv", ["liquibase_runner"])
+    applied = {"STG_DB": _applied_rows("claims"), "MBR_DB": _applied_rows("members")}
+    connections, commands = [], []
+
+    def connect(**kwargs):
+        connections.append(kwargs)
+        return FakeChangelogConnection(applied)
+
+    def fake_run(argv, env=None, **kwargs):
+        commands.append(argv[2])
+        return lr.subprocess.CompletedProcess(argv, 0, "")
+
+    with patch.object(lr, "teradatasql", lr.argparse.Namespace(connect=connect)), \
+            patch.object(lr.subprocess, "run", fake_run):
+        lr.main()
+        assert len(commands) == 2
+        lr.main()
+
+    assert connections == [{"host": "tdhost", "user": "u", "password": "p", "logmech": "LDAP"}] * 2
+    assert len(commands) == 3 and "members" in commands[2]
+    assert [entry["status"] for entry in json.loads(report.read_text())] == ["up to date", "passed"]
+    assert set(json.loads(state_path.read_text())["folders"]) == set(folders)
+
+
+def test_read_manifest_folders(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITHUB_WORKSPACE", "/workspace")
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"manifest_version": 2, "root": "/elsewhere"}\n'
+                        '{"relative_path": "db/claims_dml", "type": "tdv_dml", "sql_files": []}\n'
+                        '{"relative_path": "db/claims", "type": "tdv_ddl", "sql_files": []}\n'
+                        '{"relative_path": "db/other", "type": "ddl", "sql_files": []}\n'
+                        '{"relative_path": "db/procs", "type": "stored_proc", "sql_files": []}\n'
+                        '{"relative_path": "db/members", "type": "tdv_ddl", "sql_files": []}\n')
+
+    # Deployed in the folder-list order: stored procedures, then DDL, then DML
+    assert lr.read_manifest_folders(str(manifest)) == [os.path.join("/workspace", "db/procs"),
+                                                       os.path.join("/workspace", "db/claims"),
+                                                       os.path.join("/workspace", "db/members"),
+                                                       os.path.join("/workspace", "db/claims_dml")]
+    manifest.write_text('{"manifest_version": 1}\n')
+    with pytest.raises(ValueError, match="version 2"):
+        lr.read_manifest_folders(str(manifest))
@@ -0,0 +1,195 @@
+"""End-to-end PVS benchmarks against the in-memory Teradata stand-in.
+
+Run from the runPVSTestAction directory:
+
+    python -m benchmarks.bench_pvs --sizes 100 500 --output bench_results.json
+    python -m benchmarks.bench_pvs --sizes 100 --compare bench_results.json
+
+Each size builds a throwaway tree of folders with tables/*.sql files defining that many stored procedures,
+some reading tables loaded by others, then runs pvs_testing.main once per scenario (sequential, pooled,
+and a changed-only rerun on a warm state store). Procedure latencies and the round trip per request are
+simulated, so pooling and caching can be compared on a laptop with no network. CALL batching is left
+out: like Teradata, the fake host refuses a CALL in a multi-statement request.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+from unittest.mock import patch
+
+from benchmarks.fake_teradatasql import FakeTeradata
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pvs_testing')))
+import pvs_testing  # noqa: E402
+
+RESULTS_VERSION = 1
+SCENARIOS = {
+    "sequential": {"PVS_CONCURRENCY": "1", "PVS_BATCH_SIZE": "1"},
+    "pooled": {"PVS_CONCURRENCY": "8", "PVS_BATCH_SIZE": "1"},
+    "changed_only_rerun": {"PVS_CONCURRENCY": "8", "PVS_BATCH_SIZE": "1", "PVS_RUN_MODE": "changed"},
+}
+
+
+def generate_pvs_workspace(root: str, procedures: int, folders: int = 10, procedures_per_file: int = 2,
+                           dependency_ratio: float = 0.2, seed: int = 0) -> Dict[str, object]:
+    """Write SQL files defining that many stored procedures over folders and return what was created.
+
+    Every procedure loads its own table. With probability dependency_ratio it also reads the table of an
+    earlier procedure, which puts it in a later dependency wave.
+    """
+    rng = random.Random(seed)
+    names, files, dependencies = [], 0, 0
+    for start in range(0, procedures, procedures_per_file):
+        folder = os.path.join(root, f"folder_{(start // procedures_per_file) % folders}", "tables")
+        os.makedirs(folder, exist_ok=True)
+        statements = []
+        for number in range(start, min(start + procedures_per_file, procedures)):
+            name = f"PVS_BENCH.LOAD_{number:05d}"
+            source = f"RAW${{dbEnv}}.SOURCE_{number:05d}"
+            if number and rng.random() < dependency_ratio:
+                source = f"PVS_BENCH${{dbEnv}}.TABLE_{rng.randrange(number):05d}"
+                dependencies += 1
+            statements.append(
+                f"-- Loads TABLE_{number:05d}\n"
+                f"REPLACE PROCEDURE PVS_BENCH${{dbEnv}}.LOAD_{number:05d} (OUT PROC_MSG VARCHAR(100))\n"
+                f"BEGIN\n"
+                f"    INSERT INTO PVS_BENCH${{dbEnv}}.TABLE_{number:05d} SELECT * FROM {source};\n"
+                f"    SET PROC_MSG = 'loaded';\n"
+                f"END;\n")
+            names.append(name)
+        with open(os.path.join(folder, f"procs_{start:05d}.sql"), "w") as sql_file:
+            sql_file.write("\n".join(statements))
+        files += 1
+    return {"procedures": names, "sql_files": files, "dependencies": dependencies,
+            "folders": sorted({os.path.join(root, f"folder_{number}") for number in range(min(folders, files))})}
+
+
+def build_fake_host(workspace: Dict[str, object], round_trip: float, latency: float, latency_spread: float,
+                    failure_rate: float = 0.0, seed: int = 0) -> FakeTeradata:
+    rng = random.Random(seed)
+    fake = FakeTeradata(round_trip=round_trip)
+    for name in workspace["procedures"]:
+        error = "[Error 3807] Object does not exist." if rng.random() < failure_rate else None
+        fake.script(name, latency=max(0.0, rng.gauss(latency, latency * latency_spread)), error=error,
+                    rows=[("loaded",)])
+    return fake
+
+
+def run_pvs(fake: FakeTeradata, folders: List[str], env: Dict[str, str]) -> Dict[str, object]:
+    """Run pvs_testing.main once against fake and return wall time, requests and the run report."""
+    with tempfile.TemporaryDirectory(prefix="pvs_bench_report_") as report_dir:
+        report_path = os.path.join(report_dir, "pvs_report.json")
+        run_env = {"FOLDER_LIST": json.dumps(folders), "TDV_USERNAME": "bench", "TDV_PASSWORD": "bench",
+                   "ChangeTicket_Num": "0", "CTASK_NUM": "0", "PVS_REPORT_PATH": report_path,
+                   "GITHUB_STEP_SUMMARY": "", **env}
+        requests_before, logons_before = len(fake.requests), fake.logons
+        pvs_logger = logging.getLogger(pvs_testing.__name__)
+        level = pvs_logger.level
+        pvs_logger.setLevel(logging.WARNING)
+        started = time.perf_counter()
+        try:
+            with patch.dict(os.environ, run_env), fake.patched(pvs_testing):
+                pvs_testing.main()
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code
+        finally:
+            pvs_logger.setLevel(level)
+        wall_seconds = time.perf_counter() - started
+        with open(report_path) as report_file:
+            report = json.load(report_file)
+    return {
+        "wall_seconds": wall_seconds,
+        "exit_code": exit_code,
+        "requests": len(fake.requests) - requests_before,
+        "logons": fake.logons - logons_before,
+        "procedures_run": len(report["procedures"]),
+        "phases": report["phases"],
+    }
+
+
+def run_benchmarks(sizes: List[int], round_trip: float = 0.005, latency: float = 0.01, latency_spread: float = 0.5,
+                   dependency_ratio: float = 0.2, failure_rate: float = 0.0,
+                   scenarios: Optional[List[str]] = None) -> Dict[str, object]:
+    results = {
+        "version": RESULTS_VERSION,
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "round_trip": round_trip,
+        "latency": latency,
+        "scenarios": [],
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="pvs_bench_") as root:
+            workspace = generate_pvs_workspace(root, size, dependency_ratio=dependency_ratio)
+            fake = build_fake_host(workspace, round_trip, latency, latency_spread, failure_rate)
+            scenario = {"size": size, "sql_files": workspace["sql_files"],
+                        "dependencies": workspace["dependencies"], "measurements": {}}
+            for name in scenarios or list(SCENARIOS):
+                env = dict(SCENARIOS[name])
+                env["PVS_STATE_PATH"] = os.path.join(root, f"state_{name}.sqlite")
+                if env.get("PVS_RUN_MODE") == "changed":
+                    run_pvs(fake, workspace["folders"], {**env, "PVS_RUN_MODE": "full"})
+                scenario["measurements"][name] = run_pvs(fake, workspace["folders"], env)
+            results["scenarios"].append(scenario)
+    return results
+
+
+def compare_results(baseline: Dict[str, object], current: Dict[str, object], max_regression: float) -> List[str]:
+    """Return a message for every measurement whose wall time grew past max_regression."""
+    regressions = []
+    baseline_by_size = {scenario["size"]: scenario for scenario in baseline.get("scenarios", [])}
+    for scenario in current["scenarios"]:
+        previous = baseline_by_size.get(scenario["size"])
+        if previous is None:
+            continue
+        for name, measurement in scenario["measurements"].items():
+            before = previous["measurements"].get(name, {}).get("wall_seconds")
+            if before:
+                ratio = measurement["wall_seconds"] / before
+                if ratio > max_regression:
+                    regressions.append(f"{name} at {scenario['size']} procedures is {ratio:.2f}x slower")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 500])
+    parser.add_argument("--round_trip", type=float, default=0.005, help="simulated seconds per request")
+    parser.add_argument("--latency", type=float, default=0.01, help="mean simulated seconds per procedure")
+    parser.add_argument("--latency_spread", type=float, default=0.5, help="standard deviation relative to the mean")
+    parser.add_argument("--dependency_ratio", type=float, default=0.2)
+    parser.add_argument("--failure_rate", type=float, default=0.0)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to check for regressions")
+    parser.add_argument("--max_regression", type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, round_trip=args.round_trip, latency=args.latency,
+                             latency_spread=args.latency_spread, dependency_ratio=args.dependency_ratio,
+                             failure_rate=args.failure_rate, scenarios=args.scenarios)
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    for scenario in results["scenarios"]:
+        for name, measurement in scenario["measurements"].items():
+            print(f"{scenario['size']:>7} {name:<20} {measurement['wall_seconds']:.4f}s "
+                  f"{measurement['requests']:>6} requests {measurement['procedures_run']:>6} procedures")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
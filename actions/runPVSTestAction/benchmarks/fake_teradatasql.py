@@ -0,0 +1,217 @@
+"""In-memory stand-in for the Teradata host used by pvs_testing.
+
+FakeTeradata hands out connections that understand the requests pvs_testing sends: START_PVS_TEST,
+END_PVS_TEST, the PVS_TEST_INFO_V status query, CALLs of scripted stored procedures, multi-statement
+requests and cancel(). Latencies, failures and result payloads are scripted per procedure, so tests and
+benchmarks can drive pvs_testing.main end to end without a network:
+
+    fake = FakeTeradata(round_trip=0.01)
+    fake.script("STG.LOAD_CLAIMS", latency=0.2, rows=[("done",)])
+    fake.script("STG.BROKEN", error="[Error 3807] Object 'STG.T' does not exist.")
+    with fake.patched(pvs_testing):
+        pvs_testing.main()
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+CALL_PATTERN = re.compile(r"(?is)^\s*CALL\s+([\w.$]+)\s*\((.*)\)\s*$")
+WORK_ITEM_PATTERN = re.compile(r"'([^']*)'\s*,\s*'([^']*)'")
+STATUS_QUERY_PATTERN = re.compile(r"(?is)\bPVS_TEST\.PVS_TEST_INFO_V\b.*USER_NAME\s*=\s*'([^']*)'.*WORK_ITEM\s*=\s*'([^']*)'")
+
+
+@dataclass
+class ScriptedProcedure:
+    latency: float = 0.0
+    error: Optional[str] = None
+    columns: List[str] = field(default_factory=lambda: ["PROC_MSG"])
+    rows: List[Tuple] = field(default_factory=list)
+
+
+@dataclass
+class WorkItem:
+    user: str
+    work_item: str
+    started_at: float
+    calls: List[str] = field(default_factory=list)
+    ended_at: Optional[float] = None
+    end_returned_at: Optional[float] = None
+    status_reads: int = 0
+    status_read_at: List[float] = field(default_factory=list)
+
+
+class FakeTeradata:
+    """Host shared by every connection it opens, it records logons, requests and work items."""
+
+    def __init__(self, round_trip=0.0, logon_latency=0.0, default_latency=0.0, verdict="PVS TEST PASSED",
+                 multi_statement=False, strict=False, validation_polls=0, end_latency=0.0):
+        self.round_trip = round_trip
+        self.logon_latency = logon_latency
+        self.default_latency = default_latency
+        self.verdict = verdict
+        self.multi_statement = multi_statement
+        self.strict = strict
+        self.validation_polls = validation_polls
+        self.end_latency = end_latency
+        self.procedures: Dict[str, ScriptedProcedure] = {}
+        self.work_items: Dict[Tuple[str, str], WorkItem] = {}
+        self.requests: List[List[str]] = []
+        self.calls: List[str] = []
+        self.logons = 0
+        self.cancels = 0
+        self._lock = threading.Lock()
+
+    def script(self, procedure, latency=None, error=None, columns=None, rows=None):
+        """Scripts a stored procedure by name, database qualified and without arguments."""
+        self.procedures[procedure.upper()] = ScriptedProcedure(
+            self.default_latency if latency is None else latency, error, columns or ["PROC_MSG"], rows or [])
+
+    def connect(self, **connect_kwargs):
+        time.sleep(self.logon_latency)
+        with self._lock:
+            self.logons += 1
+        return FakeConnection(self, connect_kwargs)
+
+    @contextmanager
+    def patched(self, module):
+        """Makes module.teradatasql.connect open connections to this host."""
+        with patch.object(module, "teradatasql", SimpleNamespace(connect=self.connect)):
+            yield self
+
+    def _execute(self, connection, request):
+        statements = [statement for statement in request.split(";") if statement.strip()]
+        with self._lock:
+            self.requests.append(statements)
+        if len(statements) > 1 and not self.multi_statement:
+            raise FakeTeradataError("[Error 5494] CALL must be the only statement in a request")
+        connection.wait(self.round_trip)
+        return [self._statement(connection, statement) for statement in statements]
+
+    def _statement(self, connection, statement):
+        status_query = STATUS_QUERY_PATTERN.search(statement)
+        if status_query is not None:
+            return self._status(status_query.group(1), status_query.group(2))
+        match = CALL_PATTERN.match(statement)
+        if match is None:
+            return [], []
+        name, arguments = match.group(1).upper(), match.group(2)
+        if name == "PVS_TEST.START_PVS_TEST":
+            key = self._work_item_key(arguments)
+            with self._lock:
+                self.work_items[key] = WorkItem(key[0], key[1], time.monotonic())
+            return ["PROC_MSG"], [(f"PVS test {key[1]} started",)]
+        if name == "PVS_TEST.END_PVS_TEST":
+            key = self._work_item_key(arguments)
+            with self._lock:
+                if key not in self.work_items:
+                    raise FakeTeradataError(f"[Error 7627] PVS test {key[1]} was never started")
+                self.work_items[key].ended_at = time.monotonic()
+            # The validation starts once END arrives, END itself returns end_latency seconds later
+            connection.wait(self.end_latency)
+            with self._lock:
+                self.work_items[key].end_returned_at = time.monotonic()
+            return ["RESPONSE"], [(self.verdict,)]
+
+        scripted = self.procedures.get(name)
+        if scripted is None and self.strict:
+            raise FakeTeradataError(f"[Error 5495] Stored Procedure {name} does not exist.")
+        scripted = scripted or ScriptedProcedure(self.default_latency)
+        with self._lock:
+            self.calls.append(name)
+            for work_item in self.work_items.values():
+                if work_item.ended_at is None:
+                    work_item.calls.append(name)
+        connection.wait(scripted.latency)
+        if scripted.error:
+            raise FakeTeradataError(scripted.error)
+        return scripted.columns, list(scripted.rows)
+
+    # # PVS_TEST_INFO_V shows RUNNING until END plus validation_polls status reads, then the verdict
+    def _status(self, user, work_item_id):
+        columns = ["USER_NAME", "WORK_ITEM", "TEST_STATUS"]
+        with self._lock:
+            work_item = self.work_items.get((user, work_item_id))
+            if work_item is None:
+                return columns, []
+            work_item.status_read_at.append(time.monotonic())
+            work_item.status_reads += work_item.ended_at is not None
+            finished = work_item.ended_at is not None and work_item.status_reads > self.validation_polls
+        status = ("FAILED" if "FAIL" in self.verdict.upper() else "PASSED") if finished else "RUNNING"
+        return columns, [(user, work_item_id, status)]
+
+    @staticmethod
+    def _work_item_key(arguments):
+        match = WORK_ITEM_PATTERN.search(arguments)
+        return (match.group(1), match.group(2)) if match else ("", "")
+
+
+class FakeTeradataError(Exception):
+    pass
+
+
+class FakeConnection:
+    def __init__(self, host, connect_kwargs):
+        self.host = host
+        self.connect_kwargs = connect_kwargs
+        self.closed = False
+        self._cancelled = threading.Event()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    # # Sleeps for seconds of simulated work, a cancel() from another thread ends it with Teradata's abort error
+    def wait(self, seconds):
+        if seconds > 0 and self._cancelled.wait(seconds) or self._cancelled.is_set():
+            self._cancelled.clear()
+            raise FakeTeradataError("[Error 3110] The transaction was aborted by the user.")
+
+    def cancel(self):
+        with self.host._lock:
+            self.host.cancels += 1
+        self._cancelled.set()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._result_sets = []
+        self._rows = []
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def execute(self, request):
+        self.connection._cancelled.clear()
+        self._result_sets = self.connection.host._execute(self.connection, request)
+        self.nextset()
+
+    def nextset(self):
+        if not self._result_sets:
+            self.description, self._rows = None, []
+            return None
+        columns, self._rows = self._result_sets.pop(0)
+        self.description = [(column, str, None, None, None, None, True) for column in columns] if columns else None
+        return True
+
+    def fetchmany(self, size=1):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._result_sets, self._rows = [], []
@@ -6,29 +6,481 @@
 
 
 import os
+import argparse
+import fnmatch
 from datetime import datetime
-import pandas as pd
 import teradatasql
 import logging
 import sys
 import glob
 import json
 import re
+import hashlib
+import heapq
+import queue
+import sqlite3
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dataops_common import manifest
+from dataops_common.profiling import Profiler
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rows pulled from the cursor per round trip and rows of a result written to the log
+FETCH_BATCH_SIZE = 100
+LOGGED_ROW_LIMIT = 5
+
+
+class QueryResult:
+    """Rows of one request, read straight from a teradatasql cursor.
+
+    Columns can be indexed like the DataFrame dicts used before, so result['RESPONSE'][0]
+    is the RESPONSE value of the first row.
+    """
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __getitem__(self, column):
+        if column not in self.columns:
+            raise KeyError(column)
+        position = self.columns.index(column)
+        return [row[position] for row in self.rows]
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __len__(self):
+        return len(self.rows)
+
+    def keys(self):
+        return list(self.columns)
+
+    def to_dict(self):
+        return {column: dict(enumerate(self[column])) for column in self.columns}
+
+    def summary(self, row_limit=LOGGED_ROW_LIMIT):
+        shown = [dict(zip(self.columns, row)) for row in self.rows[:row_limit]]
+        if len(self.rows) > row_limit:
+            return f"{shown} ... {len(self.rows) - row_limit} more of {len(self.rows)} rows"
+        return str(shown)
+
+    def __repr__(self):
+        return f"QueryResult({self.summary()})"
+
+
+def _fetch_result(cursor, max_rows=None):
+    if cursor.description is None:
+        return QueryResult([], [])
+    columns = [column[0] for column in cursor.description]
+    rows = []
+    while max_rows is None or len(rows) < max_rows:
+        batch_size = FETCH_BATCH_SIZE if max_rows is None else min(FETCH_BATCH_SIZE, max_rows - len(rows))
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        rows.extend(tuple(row) for row in batch)
+    return QueryResult(columns, rows)
+
 
 # # Executes SQL query given against td_conn passed into function
-def execute_tdv_query(td_conn, query):
-    query_result = pd.read_sql(query, td_conn)
-    logger.info({'query': query, 'result': query_result})
+def execute_tdv_query(td_conn, query, max_rows=None):
+    with td_conn.cursor() as cursor:
+        cursor.execute(query)
+        query_result = _fetch_result(cursor, max_rows)
+    logger.info({'query': query, 'result': query_result.summary()})
+    return query_result
+
+
+# # Sends several statements as one multi-statement request, returns one result per statement in order
+def execute_tdv_batch(td_conn, queries, max_rows=None) -> List[QueryResult]:
+    with td_conn.cursor() as cursor:
+        cursor.execute(";".join(queries))
+        results = [_fetch_result(cursor, max_rows)]
+        while len(results) < len(queries) and cursor.nextset():
+            results.append(_fetch_result(cursor, max_rows))
+    results.extend(QueryResult([], []) for _ in range(len(queries) - len(results)))
+    logger.info({'query': queries, 'result': [query_result.summary() for query_result in results]})
+    return results
+
+
+# # Returns the result of a query as a pandas DataFrame, pandas is only imported for callers that need one
+def read_tdv_dataframe(td_conn, query):
+    import pandas as pd
+    return pd.read_sql(query, td_conn)
+
+
+# Put on the idle queue when a logon fails, so a caller waiting for a session retries the freed slot itself
+_LOGON_FAILED = object()
+
+
+class TeradataConnectionPool:
+    """Bounded pool of Teradata sessions.
+
+    Connections are opened lazily up to size and kept for the whole run, so each one does its
+    LDAP logon exactly once. A slot is reserved under the lock and the logon runs outside it, so
+    sessions opened at the same time log on in parallel. Every connection gets a stable id, its
+    position in the order logons finished.
+    """
+
+    def __init__(self, size, **connect_kwargs):
+        self.size = max(1, size)
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._opening = 0
+
+    def acquire(self):
+        while True:
+            try:
+                td_conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    reserved = len(self._connections) + self._opening < self.size
+                    self._opening += reserved
+                td_conn = self._logon() if reserved else self._idle.get()
+            if td_conn is not _LOGON_FAILED:
+                return td_conn
+
+    # # Opens the session of a slot reserved under the lock, the slot is freed again when the logon fails
+    def _logon(self):
+        try:
+            td_conn = teradatasql.connect(**self.connect_kwargs)
+        except BaseException:
+            with self._lock:
+                self._opening -= 1
+            self._idle.put(_LOGON_FAILED)
+            raise
+        with self._lock:
+            self._opening -= 1
+            self._connections.append(td_conn)
+        return td_conn
+
+    # # Logs on one session in a background thread, so the LDAP logon overlaps whatever runs before the first query
+    def prefill(self):
+        def logon():
+            with self._lock:
+                if self._connections or self._opening:
+                    return
+                self._opening += 1
+            try:
+                td_conn = self._logon()
+            except Exception as e:
+                logger.info(f"Early Teradata logon failed, retrying on first use: {e}")
+                return
+            self.release(td_conn)
+
+        thread = threading.Thread(target=logon, name="pvs-logon", daemon=True)
+        thread.start()
+        return thread
+
+    # # Opens sessions up to count at the same time, open sessions and logons in flight count towards it
+    def fill(self, count):
+        count = max(1, min(count, self.size))
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="pvs-logon") as executor:
+            requests = [executor.submit(self.acquire) for _ in range(count)]
+        for request in requests:
+            if request.exception() is None:
+                self.release(request.result())
+        for request in requests:
+            if request.exception() is not None:
+                raise request.exception()
+
+    def release(self, td_conn):
+        self._idle.put(td_conn)
+
+    def connection_id(self, td_conn):
+        return next(position for position, pooled in enumerate(self._connections) if pooled is td_conn)
+
+    @contextmanager
+    def connection(self):
+        td_conn = self.acquire()
+        try:
+            yield td_conn
+        finally:
+            self.release(td_conn)
+
+    def close(self):
+        for td_conn in self._connections:
+            try:
+                td_conn.close()
+            except Exception as e:
+                logger.info(f"Failed to close Teradata connection: {e}")
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@dataclass
+class ProcedureOutcome:
+    procedure: str
+    succeeded: bool
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    duration: float = 0.0
+    batch_size: int = 1
+    queue_time: float = 0.0
+    rows: int = 0
+    connection_id: Optional[int] = None
+    timed_out: bool = False
+    skipped: bool = False
+
+    @property
+    def status(self):
+        if self.succeeded:
+            return "passed"
+        return "TIMED OUT" if self.timed_out else "SKIPPED" if self.skipped else "FAILED"
+
+
+class RunLimits:
+    """Per-procedure timeout, overall deadline and timeout policy shared by every worker of a run.
+
+    A request running past its limit is cancelled on its connection. With abort_on_timeout the
+    first timeout stops every procedure that has not started yet.
+    """
+
+    def __init__(self, procedure_timeout=None, deadline=None, abort_on_timeout=False):
+        self.procedure_timeout = procedure_timeout or None
+        self.expires = time.monotonic() + deadline if deadline else None
+        self.abort_on_timeout = abort_on_timeout
+        self.aborted = threading.Event()
+
+    # # Seconds a request of statements CALLs may run, None without any limit
+    def timeout(self, statements=1):
+        limits = []
+        if self.procedure_timeout:
+            limits.append(self.procedure_timeout * statements)
+        if self.expires is not None:
+            limits.append(self.expires - time.monotonic())
+        return min(limits) if limits else None
+
+    def skip_reason(self):
+        if self.aborted.is_set():
+            return "skipped, the run was aborted after a timeout"
+        if self.expires is not None and time.monotonic() >= self.expires:
+            return "skipped, the PVS deadline has passed"
+        return None
+
+    def record_timeout(self, procedure):
+        if self.abort_on_timeout and not self.aborted.is_set():
+            logger.info(f"Aborting the remaining Stored Procedures after {procedure} timed out")
+            self.aborted.set()
+
+
+# # Cancels the request running on td_conn once timeout seconds pass, the yielded event tells whether it did
+@contextmanager
+def _cancel_after(td_conn, timeout):
+    fired = threading.Event()
+    if timeout is None:
+        yield fired
+        return
+
+    def cancel():
+        fired.set()
+        try:
+            td_conn.cancel()
+        except Exception as e:
+            logger.info(f"Failed to cancel Teradata request: {e}")
+
+    timer = threading.Timer(max(timeout, 0), cancel)
+    timer.daemon = True
+    timer.start()
     try:
-        return query_result.to_dict()
-    except Exception as e:
-        logger.info(str(e))
-        return {}
+        yield fired
+    finally:
+        timer.cancel()
+
+
+def _row_count(result):
+    return len(result) if isinstance(result, QueryResult) else 0
+
+
+# # Runs a single stored procedure on a pooled connection, a failure is recorded instead of raised
+def _run_procedure(pool, procedure, submitted=None, limits=None):
+    submitted = time.perf_counter() if submitted is None else submitted
+    limits = limits or RunLimits()
+    with pool.connection() as td_conn:
+        started = time.perf_counter()
+        timing = {"queue_time": started - submitted, "connection_id": pool.connection_id(td_conn)}
+        skipped = limits.skip_reason()
+        if skipped:
+            logger.info(f"Stored Procedure {procedure} {skipped}")
+            return ProcedureOutcome(procedure, False, error=skipped, skipped=True, **timing)
+        logger.info(f"Executing Stored Procedure: {procedure}")
+        timeout = limits.timeout()
+        with _cancel_after(td_conn, timeout) as cancelled:
+            try:
+                result = execute_tdv_query(td_conn=td_conn, query="CALL " + procedure)
+                return ProcedureOutcome(procedure, True, result=result, duration=time.perf_counter() - started,
+                                        rows=_row_count(result), **timing)
+            except Exception as e:
+                error = f"timed out after {timeout:.0f}s and was cancelled" if cancelled.is_set() else str(e)
+                logger.info(f"Stored Procedure {procedure} failed: {error}")
+        if cancelled.is_set():
+            limits.record_timeout(procedure)
+        return ProcedureOutcome(procedure, False, error=error, duration=time.perf_counter() - started,
+                                timed_out=cancelled.is_set(), **timing)
+
+
+# # Runs several stored procedures as one multi-statement request, each duration is its share of the request
+def _run_batch(pool, batch, batching_rejected, submitted=None, limits=None):
+    submitted = time.perf_counter() if submitted is None else submitted
+    limits = limits or RunLimits()
+    if len(batch) == 1 or batching_rejected.is_set() or limits.skip_reason():
+        return [_run_procedure(pool, procedure, submitted, limits) for procedure in batch]
+    with pool.connection() as td_conn:
+        logger.info(f"Executing Stored Procedures as one request: {batch}")
+        started = time.perf_counter()
+        timing = {"queue_time": started - submitted, "connection_id": pool.connection_id(td_conn)}
+        with _cancel_after(td_conn, limits.timeout(len(batch))) as cancelled:
+            try:
+                results = execute_tdv_batch(td_conn=td_conn, queries=["CALL " + procedure for procedure in batch])
+            except Exception as e:
+                reason = "timed out and was cancelled" if cancelled.is_set() else f"failed: {e}"
+                logger.info(f"Batch of {len(batch)} Stored Procedures {reason}, running them one by one")
+                results = None
+        duration = (time.perf_counter() - started) / len(batch)
+    if results is not None:
+        return [ProcedureOutcome(procedure, True, result=result, duration=duration, batch_size=len(batch),
+                                 rows=_row_count(result), **timing)
+                for procedure, result in zip(batch, results)]
+
+    # The failed request rolled back as a whole, so every procedure of it runs again on its own to find the culprit
+    outcomes = [_run_procedure(pool, procedure, submitted, limits) for procedure in batch]
+    if all(outcome.succeeded for outcome in outcomes):
+        logger.info("Every Stored Procedure of the failed batch passed on its own, no longer batching CALLs")
+        batching_rejected.set()
+    return outcomes
+
+
+# # Runs independent stored procedures on up to concurrency pooled connections, outcomes keep the input order
+def run_procedures_concurrently(pool, procedures, concurrency=1, batch_size=1, limits=None,
+                                batching_rejected=None) -> List[ProcedureOutcome]:
+    batch_size = max(1, batch_size)
+    batches = [procedures[start:start + batch_size] for start in range(0, len(procedures), batch_size)]
+    batching_rejected = batching_rejected or threading.Event()
+    submitted = time.perf_counter()
+
+    def run(batch):
+        return _run_batch(pool, batch, batching_rejected, submitted, limits)
+
+    if concurrency <= 1 or len(batches) <= 1:
+        return [outcome for batch in batches for outcome in run(batch)]
+    # Teradata refuses a CALL in a multi-statement request, so the first batch probes alone and a refusal costs one request
+    probed = run(batches[0]) if len(batches[0]) > 1 and not batching_rejected.is_set() else []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return probed + [outcome for outcomes in executor.map(run, batches[1 if probed else 0:]) for outcome in outcomes]
+
+
+def _prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Profile of the run, PVS_PROFILE_PATH turns it on and RunReport phases are recorded in it too
+PROFILER = Profiler()
+
+
+class RunReport:
+    """Timings of one PVS run.
+
+    Phases (discovery, extraction, logon, start, procedures, end) add up across calls. Every
+    procedure keeps its queue time, execution latency, rows returned and connection id. The report
+    is written as JSON, as a markdown table for the GitHub step summary and as Prometheus text.
+    """
+
+    def __init__(self, **details):
+        self.details = details
+        self.phases = {}
+        self.outcomes = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        PROFILER.add_phase(name, seconds)
+
+    def to_dict(self):
+        return {
+            **self.details,
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "procedures": [{
+                "procedure": outcome.procedure,
+                "succeeded": outcome.succeeded,
+                "timed_out": outcome.timed_out,
+                "skipped": outcome.skipped,
+                "error": outcome.error,
+                "queue_seconds": round(outcome.queue_time, 6),
+                "latency_seconds": round(outcome.duration, 6),
+                "rows": outcome.rows,
+                "connection_id": outcome.connection_id,
+                "batch_size": outcome.batch_size,
+            } for outcome in self.outcomes],
+        }
+
+    def markdown(self):
+        lines = [f"### PVS run {self.details.get('work_item', '')}: {self.details.get('verdict') or 'NO VERDICT'}", "",
+                 "| Phase | Seconds |", "|---|---:|"]
+        lines += [f"| {name} | {seconds:.2f} |" for name, seconds in self.phases.items()]
+        lines += ["", "| Stored Procedure | Result | Queue (s) | Latency (s) | Rows | Connection |",
+                  "|---|---|---:|---:|---:|---:|"]
+        for outcome in sorted(self.outcomes, key=lambda outcome: outcome.duration, reverse=True):
+            lines.append(f"| `{outcome.procedure}` | {outcome.status} | {outcome.queue_time:.2f} | {outcome.duration:.2f} "
+                         f"| {outcome.rows} | {outcome.connection_id} |")
+        return "\n".join(lines) + "\n"
+
+    def prometheus_text(self):
+        lines = ["# HELP pvs_phase_seconds Seconds spent in each phase of the PVS run",
+                 "# TYPE pvs_phase_seconds gauge"]
+        lines += [f'pvs_phase_seconds{{phase="{_prometheus_label(name)}"}} {seconds:.6f}'
+                  for name, seconds in self.phases.items()]
+        metrics = [("pvs_procedure_queue_seconds", "Seconds a stored procedure waited for a connection", "queue_time"),
+                   ("pvs_procedure_latency_seconds", "Seconds a stored procedure CALL took", "duration"),
+                   ("pvs_procedure_rows", "Rows returned by a stored procedure CALL", "rows"),
+                   ("pvs_procedure_succeeded", "1 if the stored procedure CALL succeeded", "succeeded"),
+                   ("pvs_procedure_timed_out", "1 if the stored procedure CALL was cancelled at its timeout", "timed_out")]
+        for metric, help_text, field in metrics:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            lines += [f'{metric}{{procedure="{_prometheus_label(outcome.procedure)}"}} {float(getattr(outcome, field)):.6f}'
+                      for outcome in self.outcomes]
+        return "\n".join(lines) + "\n"
+
+    # # Writes every output with a path set, the step summary is appended to as GitHub expects
+    def write(self, report_path=None, step_summary_path=None, metrics_path=None):
+        if report_path:
+            with open(report_path, "w") as report_file:
+                json.dump(self.to_dict(), report_file, indent=2, default=str)
+        if step_summary_path:
+            with open(step_summary_path, "a") as summary_file:
+                summary_file.write(self.markdown())
+        if metrics_path:
+            with open(metrics_path, "w") as metrics_file:
+                metrics_file.write(self.prometheus_text())
 
 
 # # Returns results of the PVS TEST when passing in results from PVS TEST TABLE sql query
@@ -39,87 +491,819 @@ def pass_or_fail(result_dict):
         logger.info("FAILURE")
         exit(1)
 
-# Fetch files from the tables folder
-def fetch_all_sql_files(base_folder):
-    tables_path = os.path.join(base_folder, 'tables')
-    sql_files = []
 
-    if not os.path.exists(tables_path):
-        logger.info(f"No tables directory in {base_folder}")
-        return []
+# Seconds before the first PVS_TEST_INFO_V poll, growth factor between polls and longest wait between two polls
+POLL_INITIAL_DELAY = 2.0
+POLL_BACKOFF = 2.0
+POLL_MAX_DELAY = 60.0
+# TEST_STATUS values that end a validation, anything else is still pending
+FAILED_STATUSES = frozenset({"FAILED", "ERROR"})
+PASSED_STATUSES = frozenset({"PASSED", "SUCCESS", "COMPLETED"})
+
+
+@dataclass
+class PvsVerdict:
+    """Outcome of a PVS test read from every row of PVS_TEST_INFO_V.
+
+    status is FAILED when any row failed, PASSED when every row passed and PENDING when the
+    validation had not finished by the deadline or the view had no rows for the work item yet.
+    """
+    status: str
+    rows: List[Dict[str, Any]]
+    polls: int = 0
+    waited: float = 0.0
+
+    @property
+    def passed(self):
+        return self.status == "PASSED"
+
+
+def _row_status(row):
+    status = str(row.get("TEST_STATUS") or "").strip().upper()
+    if status in FAILED_STATUSES:
+        return "FAILED"
+    if status in PASSED_STATUSES:
+        return "PASSED"
+    return "PENDING"
+
+
+# # Folds the status of every result row into one verdict, no rows means the test is not visible yet
+def verdict_from_rows(rows, polls=0, waited=0.0) -> PvsVerdict:
+    statuses = {_row_status(row) for row in rows}
+    if "FAILED" in statuses:
+        status = "FAILED"
+    elif statuses == {"PASSED"}:
+        status = "PASSED"
+    else:
+        status = "PENDING"
+    return PvsVerdict(status, rows, polls, waited)
+
+
+# # Polls PVS_TEST_INFO_V with exponential backoff, a connection is only borrowed from the pool for each query
+# # Rows already there before START (stale_rows) belong to an earlier run of the work item and are left out, unless
+# # nothing else is there once END returned, END then wrote the same row again
+def poll_pvs_status(pool, status_query, deadline, initial_delay=POLL_INITIAL_DELAY, backoff=POLL_BACKOFF,
+                    max_delay=POLL_MAX_DELAY, sleep=None, stale_rows=(), end_returned=None) -> PvsVerdict:
+    sleep = sleep or time.sleep
+    stale_rows = {tuple(row) for row in stale_rows}
+    started, delay, polls, last_status = time.monotonic(), initial_delay, 0, None
+    while True:
+        with pool.connection() as td_conn:
+            result = execute_tdv_query(td_conn=td_conn, query=status_query)
+        polls += 1
+        current = [tuple(row) for row in result.rows]
+        fresh = [row for row in current if row not in stale_rows]
+        if not fresh and (end_returned is None or end_returned()):
+            fresh = current
+        rows = [dict(zip(result.columns, row)) for row in fresh]
+        verdict = verdict_from_rows(rows, polls, time.monotonic() - started)
+        if verdict.status != last_status:
+            logger.info(f"PVS status after {verdict.waited:.0f}s (poll {polls}): {verdict.status} {rows}")
+            last_status = verdict.status
+        remaining = deadline - (time.monotonic() - started)
+        if verdict.status != "PENDING" or remaining <= 0:
+            return verdict
+        sleep(min(delay, remaining))
+        delay = min(delay * backoff, max_delay)
+
+
+# # Sends END_PVS_TEST on a pooled session, returns its result and the seconds it took
+def _end_pvs_test(pool, end_test_procedure):
+    started = time.perf_counter()
+    with pool.connection() as td_conn:
+        pvs_result = execute_tdv_query(td_conn=td_conn, query=end_test_procedure)
+    return pvs_result, time.perf_counter() - started
+
+# SQL directories of a folder whose data-ops-config has no path-to-sql, DIRECTORY_LIST replaces them
+DEFAULT_SQL_DIRECTORIES = ("tables",)
+# Directories never searched for SQL files, PVS_SQL_EXCLUDE adds comma separated globs
+DEFAULT_SQL_EXCLUDE_GLOBS = (".git", ".venv", "venv", "node_modules", "__pycache__", ".tmp-dynamic-uses")
+
+
+@dataclass
+class SqlLayout:
+    """Where the SQL files of a folder are.
+
+    A folder's SQL directories come from path-to-sql in the data-ops-config of its pyproject.toml,
+    a path or a list of them, else from directories. They are searched recursively, skipping every
+    directory whose name or path below the SQL directory matches one of exclude_globs.
+    """
+    directories: Tuple[str, ...] = DEFAULT_SQL_DIRECTORIES
+    exclude_globs: Tuple[str, ...] = DEFAULT_SQL_EXCLUDE_GLOBS
+
+    # # DIRECTORY_LIST is a JSON list or space separated, PVS_SQL_EXCLUDE comma separated
+    @classmethod
+    def from_env(cls):
+        directory_list = (os.environ.get("DIRECTORY_LIST") or "").strip()
+        try:
+            directories = json.loads(directory_list) if directory_list.startswith("[") else directory_list.split()
+        except ValueError as e:
+            logger.info(f"Ignoring DIRECTORY_LIST {directory_list}: {e}")
+            directories = []
+        extra_globs = [pattern.strip() for pattern in (os.environ.get("PVS_SQL_EXCLUDE") or "").split(",")
+                       if pattern.strip()]
+        return cls(tuple(directory for directory in directories if directory.strip()) or DEFAULT_SQL_DIRECTORIES,
+                   DEFAULT_SQL_EXCLUDE_GLOBS + tuple(extra_globs))
+
+    def directories_of(self, folder, config=None):
+        path_to_sql = (_read_data_ops_config(folder) if config is None else config).get("path-to-sql")
+        if not path_to_sql:
+            return list(self.directories)
+        return [path_to_sql] if isinstance(path_to_sql, str) else list(path_to_sql)
+
+    def is_excluded(self, relative_dir):
+        name = os.path.basename(relative_dir)
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_dir, pattern)
+                   for pattern in self.exclude_globs)
+
+
+def _read_data_ops_config(folder):
+    pyproject_path = os.path.join(folder, "pyproject.toml")
+    if tomllib is None or not os.path.isfile(pyproject_path):
+        return {}
+    try:
+        with open(pyproject_path, "rb") as pyproject:
+            return tomllib.load(pyproject).get("data-ops-config") or {}
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        logger.info(f"Ignoring unreadable {pyproject_path}: {e}")
+        return {}
+
+
+class WorkspaceManifest(manifest.WorkspaceManifest):
+    """Folders and SQL files discovered once by findSqlFolderAction, read one folder record at a time."""
 
-    for filename in os.listdir(tables_path):
-        if filename.endswith(".sql"):
-            sql_files.append(os.path.join(tables_path, filename))
+    # # Yields (folder, [(sql file, None)]) with the SQL files fetch_all_sql_files would list, without touching the disk.
+    # # The manifest has no hashes, a file is hashed when the state store needs its key
+    def iter_sql_files(self, layout=None):
+        layout = layout or SqlLayout()
+        for record in self.iter_folders():
+            folder = self.folder_path(record)
+            sql_dirs = [os.path.normpath(sql_dir).replace(os.sep, "/")
+                        for sql_dir in layout.directories_of(folder, record.get("config") or {})]
+            yield folder, [(os.path.join(folder, *sql_file["path"].split("/")), None)
+                           for sql_file in record["sql_files"]
+                           if sql_file["path"].lower().endswith(".sql")
+                           and _is_below_sql_directory(sql_file["path"], sql_dirs, layout)]
 
-    return sql_files
 
-# Extracting the stored procedure name
-def extract_proc_names_from_file(filepath):
-    extracted_procs = []
+def _is_below_sql_directory(relative_path, sql_dirs, layout):
+    for sql_dir in sql_dirs:
+        if sql_dir == ".":
+            parts = relative_path.split("/")[:-1]
+        elif relative_path.startswith(sql_dir + "/"):
+            parts = relative_path[len(sql_dir) + 1:].split("/")[:-1]
+        else:
+            continue
+        if not any(layout.is_excluded("/".join(parts[:depth])) for depth in range(1, len(parts) + 1)):
+            return True
+    return False
 
-    with open(filepath, 'r') as f:
-        file_content = f.read()  # Read the entire file at once
-    
-    # Regex to find CREATE PROCEDURE/FUNCTION containing ${dbEnv}
-    pattern = r'(?i)\b(create|replace|update)\s+(procedure\s+)?(\S+\$\{dbEnv\}\.\S+)'
-    matches = re.findall(pattern, file_content)
 
-    for match in matches:
-        proc_name = match[2]  # Group capturing schema.${dbEnv}.object
-        extracted_procs.append(proc_name)
-    
+# Fetch the SQL files below every SQL directory of a folder, sorted so every run scans them in the same order
+def fetch_all_sql_files(base_folder, layout=None):
+    layout = layout or SqlLayout()
+    sql_files = set()
+    for sql_dir in layout.directories_of(base_folder):
+        sql_path = os.path.normpath(os.path.join(base_folder, sql_dir))
+        if not os.path.isdir(sql_path):
+            logger.info(f"No {sql_dir} directory in {base_folder}")
+            continue
+        sql_files.update(_walk_sql_files(sql_path, layout))
+    return sorted(sql_files)
+
+
+# # Every .sql file below top, excluded and symlinked directories are not entered
+def _walk_sql_files(top, layout):
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(top, relative_dir)) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if not layout.is_excluded(relative_path.replace(os.sep, "/")):
+                            pending.append(relative_path)
+                    elif entry.name.lower().endswith(".sql") and entry.is_file():
+                        yield entry.path
+        except OSError as e:
+            logger.info(f"Cannot list {os.path.join(top, relative_dir)}: {e}")
+
+# SQL is read in chunks, a token cut by the end of a chunk is carried over to the next one
+SQL_CHUNK_SIZE = 1 << 16
+DB_ENV_MARKER = "${dbEnv}."
+# A name, optionally dotted and quoted, e.g. MYDB${dbEnv}.MY_PROC or "MYDB${dbEnv}"."MY PROC"
+SQL_WORD_PATTERN = re.compile(r'(?:\w|\$\{\w+\}|\$|"(?:[^"]|"")*")+(?:\.(?:\w|\$\{\w+\}|\$|"(?:[^"]|"")*")+)*')
+SQL_WHITESPACE_PATTERN = re.compile(r'\s*')
+SQL_NAME_CHARS_PATTERN = re.compile(r'\w*')
+# Stand-in yielded for a string literal, its contents never reach the parser
+SQL_LITERAL = "''"
+PARAMETER_DIRECTIONS = ("IN", "OUT", "INOUT")
+
+
+@dataclass
+class ProcedureReferences:
+    """Objects a stored procedure body creates or changes, every ${dbEnv} object it mentions and its definition hash."""
+    produces: Set[str]
+    references: Set[str]
+    definition_hash: str = ""
+
+
+@dataclass
+class ProcedureDefinition:
+    """A CREATE/REPLACE PROCEDURE|FUNCTION statement on a ${dbEnv} qualified name."""
+    name: str
+    kind: str
+    parameters: List[Tuple[str, str]]
+    produces: Set[str]
+    references: Set[str]
+    definition_hash: str = ""
+
+    # CALLed without arguments, the name keeps the quoting it was written with
+    def call_target(self):
+        return f"{self.name}()"
+
+
+# # Key an object or stored procedure the same way whether it comes from SQL or from the procs list
+def _object_key(name):
+    match = SQL_WORD_PATTERN.match(name)
+    name = match.group() if match else name
+    return name.replace('"', '').replace("${dbEnv}.", ".").lower()
+
+
+# # The name PVS CALLs, ${dbEnv} is dropped from the database also when the database is quoted
+def _call_name(name):
+    return name.replace("${dbEnv}.", ".").replace('${dbEnv}".', '".')
+
+
+# # A word ending at end may go on in the next chunk when the buffer cuts a name, a quoted name or a ${...}
+def _word_may_continue(buffer, end):
+    following = buffer[end:end + 1]
+    if following == "{":
+        return SQL_NAME_CHARS_PATTERN.match(buffer, end + 1).end() == len(buffer)
+    if following == ".":
+        end += 1
+        following = buffer[end:end + 1]
+    # A closed quoted name would have been matched, so a quote here is still open
+    return end == len(buffer) or following == '"'
+
+
+# # Yields the words and punctuation of a SQL file read chunk by chunk, comments are dropped and literals replaced
+def _iter_sql_tokens(sql_file, chunk_size=SQL_CHUNK_SIZE):
+    buffer, position, at_end, need_more, closing = "", 0, False, True, None
+    while True:
+        if need_more and not at_end:
+            chunk = sql_file.read(chunk_size)
+            buffer, position, at_end, need_more = buffer[position:] + chunk, 0, not chunk, False
+            continue
+        if closing == "'":
+            end = buffer.find("'", position)
+            if end < 0 or (end + 1 == len(buffer) and not at_end):
+                if at_end:
+                    return
+                position, need_more = (len(buffer) if end < 0 else end), True
+            elif buffer.startswith("''", end):
+                position = end + 2
+            else:
+                position, closing = end + 1, None
+                yield SQL_LITERAL
+            continue
+        if closing is not None:
+            end = buffer.find(closing, position)
+            if end < 0:
+                if at_end:
+                    return
+                position, need_more = max(position, len(buffer) - len(closing) + 1), True
+            else:
+                position, closing = end + len(closing), None
+            continue
+        position = SQL_WHITESPACE_PATTERN.match(buffer, position).end()
+        if position >= len(buffer):
+            if at_end:
+                return
+            need_more = True
+        elif not at_end and position + 1 == len(buffer):
+            need_more = True  # Could be the first half of -- or /*
+        elif buffer.startswith("--", position):
+            position, closing = position + 2, "\n"
+        elif buffer.startswith("/*", position):
+            position, closing = position + 2, "*/"
+        elif buffer[position] == "'":
+            position, closing = position + 1, "'"
+        else:
+            match = SQL_WORD_PATTERN.match(buffer, position)
+            end = match.end() if match else position
+            if not at_end and _word_may_continue(buffer, end):
+                need_more = True
+                continue
+            token = buffer[position:end] or buffer[position]
+            position += len(token)
+            yield token
+
+
+# # Finds every CREATE/REPLACE PROCEDURE|FUNCTION on a ${dbEnv} name, with its parameters and the objects its body uses
+def scan_sql_definitions(sql_file, chunk_size=SQL_CHUNK_SIZE) -> List[ProcedureDefinition]:
+    definitions, current, state, recent = [], None, None, []
+    parameter, depth, kind, digest = [], 0, None, None
+    for token in _iter_sql_tokens(sql_file, chunk_size):
+        upper, plain = token.upper(), token.replace('"', '')
+        # The hash covers tokens only, so comment and whitespace edits do not count as a changed definition
+        if digest is not None:
+            digest.update(token.encode() + b"\n")
+        if state == "name":
+            state = None
+            if DB_ENV_MARKER in plain:
+                if current is not None:
+                    current.definition_hash = digest.hexdigest()
+                current = ProcedureDefinition(token, kind, [], {_object_key(token)}, set())
+                digest = hashlib.sha256(token.encode() + b"\n")
+                definitions.append(current)
+                state = "open"
+                continue
+        elif state == "open":
+            state = None
+            if token == "(":
+                state, depth, parameter = "parameters", 1, []
+                continue
+        elif state == "parameters":
+            depth += (token == "(") - (token == ")")
+            if depth == 1 and token == "," or depth == 0:
+                words = [word for word in parameter if SQL_WORD_PATTERN.fullmatch(word)]
+                if words and words[0].upper() in PARAMETER_DIRECTIONS and len(words) > 1:
+                    current.parameters.append((words[0].upper(), words[1]))
+                elif words:
+                    current.parameters.append(("IN", words[0]))
+                parameter = []
+                if depth == 0:
+                    state = None
+            else:
+                parameter.append(token)
+            continue
+
+        if upper in ("PROCEDURE", "FUNCTION") and recent[-1:] in (["CREATE"], ["REPLACE"]):
+            state, kind = "name", upper
+        elif current is not None and DB_ENV_MARKER in plain:
+            object_key = _object_key(token)
+            current.references.add(object_key)
+            last, before = recent[-1:], recent[-2:-1]
+            if (last in (["INSERT"], ["INS"], ["UPDATE"], ["UPD"], ["DELETE"], ["DEL"])
+                    or last == ["INTO"] and before in (["INSERT"], ["INS"], ["MERGE"])
+                    or last == ["FROM"] and before in (["DELETE"], ["DEL"])
+                    or last in (["TABLE"], ["VIEW"]) and ("CREATE" in recent or "REPLACE" in recent)):
+                current.produces.add(object_key)
+        recent = [] if token == ";" else (recent + [upper])[-4:]
+    if current is not None:
+        current.definition_hash = digest.hexdigest()
+    return definitions
+
+
+class PvsStateStore:
+    """SQLite file kept between runs, restored by the action from the cache.
+
+    It maps the content hash of every scanned SQL file to the definitions found in it, and every
+    procedure to the definition hash, result and duration of its last run. Durations are also kept
+    per procedure and definition hash as a smoothed mean, which the scheduler plans with. The
+    store is shared by the threads scanning files, every method holds its lock.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            self._db = self._open()
+        except sqlite3.DatabaseError as e:
+            logger.info(f"Discarding unreadable PVS state {path}: {e}")
+            os.remove(path)
+            self._db = self._open()
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (1, self.VERSION):
+            db.executescript("""
+                DROP TABLE IF EXISTS sql_files;
+                DROP TABLE IF EXISTS procedures;
+                DROP TABLE IF EXISTS durations;
+                CREATE TABLE sql_files (content_hash TEXT PRIMARY KEY, definitions TEXT NOT NULL);
+                CREATE TABLE procedures (procedure TEXT PRIMARY KEY, definition_hash TEXT NOT NULL,
+                                         succeeded INTEGER NOT NULL, duration REAL NOT NULL, recorded_at TEXT NOT NULL);
+            """)
+        # Version 1 stores only lack the duration history
+        if version != self.VERSION:
+            db.executescript(f"""
+                CREATE TABLE durations (procedure TEXT NOT NULL, definition_hash TEXT NOT NULL, runs INTEGER NOT NULL,
+                                        mean REAL NOT NULL, recorded_at TEXT NOT NULL,
+                                        PRIMARY KEY (procedure, definition_hash));
+                PRAGMA user_version = {self.VERSION};
+            """)
+        return db
+
+    def cached_definitions(self, content_hash) -> Optional[List[ProcedureDefinition]]:
+        with self._lock:
+            row = self._db.execute("SELECT definitions FROM sql_files WHERE content_hash = ?", (content_hash,)).fetchone()
+        if row is None:
+            return None
+        return [ProcedureDefinition(entry["name"], entry["kind"], [tuple(parameter) for parameter in entry["parameters"]],
+                                    set(entry["produces"]), set(entry["references"]), entry["definition_hash"])
+                for entry in json.loads(row[0])]
+
+    def save_definitions(self, content_hash, definitions):
+        entries = [{"name": definition.name, "kind": definition.kind, "parameters": definition.parameters,
+                    "produces": sorted(definition.produces), "references": sorted(definition.references),
+                    "definition_hash": definition.definition_hash} for definition in definitions]
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO sql_files VALUES (?, ?)", (content_hash, json.dumps(entries)))
+
+    # # Returns (definition_hash, succeeded, duration) of the last run of a procedure, None if it never ran
+    def last_outcome(self, procedure_key):
+        with self._lock:
+            row = self._db.execute("SELECT definition_hash, succeeded, duration FROM procedures WHERE procedure = ?",
+                                   (procedure_key,)).fetchone()
+        return None if row is None else (row[0], bool(row[1]), row[2])
+
+    def record_outcome(self, procedure_key, definition_hash, succeeded, duration):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO procedures VALUES (?, ?, ?, ?, ?)",
+                             (procedure_key, definition_hash, int(succeeded), duration,
+                              time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())))
+
+    def record_duration(self, procedure_key, definition_hash, duration):
+        # Read and written under one lock hold, so no other thread's duration is lost in between
+        with self._lock, self._db:
+            row = self._db.execute("SELECT runs, mean FROM durations WHERE procedure = ? AND definition_hash = ?",
+                                   (procedure_key, definition_hash)).fetchone()
+            runs, mean = (1, duration) if row is None else (row[0] + 1, row[1] + DURATION_SMOOTHING * (duration - row[1]))
+            self._db.execute("INSERT OR REPLACE INTO durations VALUES (?, ?, ?, ?, ?)",
+                             (procedure_key, definition_hash, runs, mean, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())))
+
+    # # Returns the expected seconds of a procedure, from an earlier definition when this one never ran, None without history
+    def expected_duration(self, procedure_key, definition_hash) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute("""
+                SELECT mean FROM durations WHERE procedure = ?
+                ORDER BY definition_hash = ? DESC, recorded_at DESC LIMIT 1""", (procedure_key, definition_hash)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _file_content_hash(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(SQL_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Extracting the stored procedure name, as a CALL target with its argument list
+def extract_proc_names_from_file(filepath, dependencies=None, state_store=None, content_hash=None):
+    # A file whose content hash is already in the state store is not scanned again, a manifest hash is not recomputed
+    definitions = None
+    if state_store is not None:
+        content_hash = content_hash or _file_content_hash(filepath)
+        definitions = state_store.cached_definitions(content_hash)
+    if definitions is None:
+        with open(filepath, 'r') as f:
+            definitions = scan_sql_definitions(f)  # Streamed in chunks, comments and string literals are skipped
+        if state_store is not None:
+            state_store.save_definitions(content_hash, definitions)
+
+    # Only procedures are CALLed, functions are kept in the dependency map for the procedures using them
+    extracted_procs = [definition.call_target() for definition in definitions if definition.kind == "PROCEDURE"]
+
+    if dependencies is not None:
+        for definition in definitions:
+            dependencies[_object_key(definition.name)] = ProcedureReferences(definition.produces, definition.references,
+                                                                             definition.definition_hash)
 
     return extracted_procs
 
 
+# # Maps every procedure to the procedures it has to run after, CALLs and objects produced by another procedure
+def build_dependency_graph(procedures, dependencies) -> Dict[str, Set[str]]:
+    procedure_by_key = {_object_key(procedure): procedure for procedure in procedures}
+    producers = {}
+    for proc_key, references in dependencies.items():
+        if proc_key in procedure_by_key:
+            for object_key in references.produces:
+                producers.setdefault(object_key, set()).add(procedure_by_key[proc_key])
+    graph = {procedure: set() for procedure in procedures}
+    for procedure in procedures:
+        references = dependencies.get(_object_key(procedure))
+        if references is None:
+            continue
+        for object_key in references.references - references.produces:
+            graph[procedure] |= producers.get(object_key, set())
+        graph[procedure].discard(procedure)
+    return graph
 
 
-def main():
+# # Procedures changed or not passed since their last run, plus every procedure depending on one of them
+def select_changed_procedures(graph, dependencies, state_store) -> Set[str]:
+    selected = set()
+    for procedure in graph:
+        references = dependencies.get(_object_key(procedure))
+        last = state_store.last_outcome(_object_key(procedure))
+        if references is None or last is None or last[0] != references.definition_hash or not last[1]:
+            selected.add(procedure)
+    dependents = {}
+    for procedure, upstream in graph.items():
+        for dependency in upstream:
+            dependents.setdefault(dependency, set()).add(procedure)
+    pending = list(selected)
+    while pending:
+        for dependent in dependents.get(pending.pop(), ()):
+            if dependent not in selected:
+                selected.add(dependent)
+                pending.append(dependent)
+    return selected
+
+
+# # Tarjan's algorithm without recursion, a component is only emitted after every component it depends on
+def _strongly_connected_components(graph):
+    index, lowlink, on_stack, stack, components = {}, {}, set(), [], []
+    for root in sorted(graph):
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(sorted(graph[root])))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(sorted(graph[child]))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    return components
+
+
+# # Groups procedures into waves that only depend on earlier waves, returns the waves and any dependency cycles
+def plan_procedure_waves(graph) -> Tuple[List[List[str]], List[List[str]]]:
+    """Members of a cycle cannot be ordered, so they run together in one wave after everything they depend on."""
+    wave_of, waves, cycles = {}, [], []
+    for component in _strongly_connected_components(graph):
+        if len(component) > 1:
+            cycles.append(component)
+        members = set(component)
+        upstream = {dependency for member in component for dependency in graph[member]} - members
+        wave = max((wave_of[dependency] + 1 for dependency in upstream), default=0)
+        for member in component:
+            wave_of[member] = wave
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].extend(component)
+    return [sorted(wave) for wave in waves], cycles
+
+
+# Weight of the newest run in the smoothed duration of a procedure
+DURATION_SMOOTHING = 0.5
+
+
+@dataclass
+class SchedulePlan:
+    waves: List[List[str]]
+    estimates: Dict[str, float]
+    unknown: List[str]
+    default_estimate: float
+    makespan: float
+    wave_makespans: List[float]
+    timeline: Dict[str, Tuple[float, float]]
+
+    def expected(self, procedure):
+        return self.estimates.get(procedure, self.default_estimate)
+
+
+# # Durations of passed and timed out procedures feed the schedule of later runs, failures end early and would skew it
+def record_durations(state_store, outcomes, dependencies):
+    for outcome in outcomes:
+        if outcome.succeeded or outcome.timed_out:
+            references = dependencies.get(_object_key(outcome.procedure))
+            state_store.record_duration(_object_key(outcome.procedure), references.definition_hash if references else "",
+                                        outcome.duration)
+
+
+# # Expected seconds of every procedure with a recorded duration, and the procedures without one
+def estimate_durations(procedures, dependencies, state_store) -> Tuple[Dict[str, float], List[str]]:
+    estimates, unknown = {}, []
+    for procedure in procedures:
+        references = dependencies.get(_object_key(procedure))
+        expected = None if state_store is None else state_store.expected_duration(
+            _object_key(procedure), references.definition_hash if references else "")
+        if expected is None:
+            unknown.append(procedure)
+        else:
+            estimates[procedure] = expected
+    return estimates, unknown
 
-    # Capture environment relevant env vars
+
+def plan_schedule(waves, estimates, unknown, concurrency=1, batch_size=1) -> SchedulePlan:
+    """Orders every wave longest expected procedure first and predicts the run time on the pool.
+
+    Procedures without history are planned at the median of the known estimates. The prediction
+    replays run_procedures_concurrently: batches are taken in order by whichever session frees up
+    first, and a wave starts once the previous one has finished.
+    """
+    known = sorted(estimates.values())
+    default_estimate = known[len(known) // 2] if known else 0.0
+    ordered = [sorted(wave, key=lambda procedure: (-estimates.get(procedure, default_estimate), procedure))
+               for wave in waves]
+    batch_size, sessions = max(1, batch_size), max(1, concurrency)
+    makespan, wave_makespans, timeline = 0.0, [], {}
+    for wave in ordered:
+        free_at = [makespan] * sessions
+        for start in range(0, len(wave), batch_size):
+            started = heapq.heappop(free_at)
+            for procedure in wave[start:start + batch_size]:
+                finished = started + estimates.get(procedure, default_estimate)
+                timeline[procedure] = (started, finished)
+                started = finished
+            heapq.heappush(free_at, started)
+        wave_makespans.append(max(free_at) - makespan)
+        makespan = max(free_at)
+    return SchedulePlan(ordered, estimates, sorted(unknown), default_estimate, makespan, wave_makespans, timeline)
+
+
+
+
+# # Returns the (folder, SQL files or None) pairs to scan, from PVS_MANIFEST_PATH or else FOLDER_LIST, None when neither is usable
+def _folder_sources(layout=None):
     folder_list = os.environ.get("FOLDER_LIST")
     teradata_dir_list = os.environ.get("DIRECTORY_LIST")
     logger.info(f"teradata_folder_list: {teradata_dir_list}")
 
+    # A workspace manifest replaces FOLDER_LIST and the directory listing
+    manifest_path = os.environ.get("PVS_MANIFEST_PATH")
+    if manifest_path:
+        try:
+            manifest = WorkspaceManifest(manifest_path)
+            logger.info(f"Reading folders and SQL files from the workspace manifest {manifest_path}")
+            return manifest.iter_sql_files(layout)
+        except (OSError, ValueError) as e:
+            logger.info(f"Ignoring workspace manifest {manifest_path}: {e}")
+
     # Validate folder_list env variable
     if not folder_list:
         logger.info("FOLDER_LIST not found in env")
-        return
+        return None
     try:
         folder_list = json.loads(folder_list)
     except Exception as e:
         logger.info("Failed to parse FOLDER_LIST:", e)
-        return
+        return None
     folder_list = [folder for folder in folder_list if folder.strip()]
     logger.info(f"folder_list: {str(folder_list)}")
+    return ((folder, None) for folder in folder_list)
+
+
+# SQL files read at the same time by default, and files queued per reading thread
+SCAN_WORKERS = 4
+SCAN_QUEUE_PER_WORKER = 2
+
+
+def scan_sql_files(folder_sources, report, layout=None, state_store=None, workers=SCAN_WORKERS):
+    """Yields (sql file, CALL targets, dependencies) for every SQL file, in discovery order.
 
-    # TODO: Comment describing block
+    Folders are listed as the stream reaches them and their files are read, hashed and scanned in a
+    pool of workers threads, so later folders are listed while earlier files are still scanned. At most
+    SCAN_QUEUE_PER_WORKER files per thread are in flight, which bounds memory whatever the tree size.
+    Extraction time is the time spent waiting for scanned files.
+    """
+    def discovered():
+        for folder, sql_files in folder_sources:
+            logger.info(f"Searching in Folder: {folder}")
+            if sql_files is None:
+                with report.phase("discovery"):
+                    sql_files = [(sql_file, None) for sql_file in fetch_all_sql_files(folder, layout)]
+            logger.info(f"Found {len(sql_files)} SQL files in {folder}")
+            yield from sql_files
+
+    def scan(sql_file, content_hash):
+        file_dependencies = {}
+        procs = extract_proc_names_from_file(sql_file, dependencies=file_dependencies, state_store=state_store,
+                                             content_hash=content_hash)
+        return sql_file, procs, file_dependencies
+
+    if workers <= 1:
+        for sql_file, content_hash in discovered():
+            with report.phase("extraction"):
+                scanned = scan(sql_file, content_hash)
+            yield scanned
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for sql_file, content_hash in discovered():
+            in_flight.append(executor.submit(scan, sql_file, content_hash))
+            if len(in_flight) >= workers * SCAN_QUEUE_PER_WORKER:
+                with report.phase("extraction"):
+                    scanned = in_flight.popleft().result()
+                yield scanned
+        while in_flight:
+            with report.phase("extraction"):
+                scanned = in_flight.popleft().result()
+            yield scanned
+
+
+# # Scans the SQL files of every folder, returns the sorted CALL targets and the dependencies of every definition
+def collect_procedures(folder_sources, report, state_store=None, layout=None,
+                       workers=SCAN_WORKERS) -> Tuple[List[str], Dict[str, ProcedureReferences]]:
     final_proc_list = []
-    for folder in folder_list:
-        logger.info(f"Searching in Folder: {folder}")
-        sql_files = fetch_all_sql_files(folder)
-        logger.info(f"Found {len(sql_files)} SQL files in {folder}")
-        for sql_file in sql_files:
-            procs = extract_proc_names_from_file(sql_file)
-            if procs:
-                logger.info(f"Extracted from {sql_file}: {procs}")
-                final_proc_list.extend(procs)
+    dependencies = {}
+    for sql_file, procs, file_dependencies in scan_sql_files(folder_sources, report, layout, state_store, workers):
+        # Merged in discovery order, so a procedure defined twice keeps its last definition like a sequential scan
+        dependencies.update(file_dependencies)
+        if procs:
+            logger.info(f"Extracted from {sql_file}: {procs}")
+            final_proc_list.extend(procs)
     # final_proc_list = list(set(final_proc_list))
     proc_set = set()
     logger.info("\n==== FINAL LIST OF PROCEDURES/FUNCTIONS FOUND ====")
     for proc in final_proc_list:
         # Insert env variable into sp with correct syntax
-        string_proc = str(proc).replace("${dbEnv}.", ".")
-        string_proc = string_proc+"()"
+        string_proc = _call_name(str(proc))
+        if "(" not in string_proc:
+            string_proc = string_proc+"()"
         # Convert list into set - Eliminating duplicates
         proc_set.add(string_proc)
 
-    # Convert set of stored procs back into list
-    procs_clean = list(proc_set)
+    # Convert set of stored procs back into list, sorted so every run logs and schedules the same way
+    procs_clean = sorted(proc_set)
     logger.info("PROCS CLEAN: ")
     for x in procs_clean:
         logger.info(x)
+    return procs_clean, dependencies
+
+
+# # Splits the procedures into dependency waves, in changed mode only the changed ones and their dependents
+def plan_waves(procs_clean, dependencies, report, run_mode="full", state_store=None) -> List[List[str]]:
+    # Order stored procedures by the CALLs and objects they share, independent ones share a wave
+    with report.phase("planning"):
+        graph = build_dependency_graph(procs_clean, dependencies)
+        waves, cycles = plan_procedure_waves(graph)
+    for cycle in cycles:
+        logger.info(f"Dependency cycle between stored procedures, running them in the same wave: {cycle}")
+
+    if run_mode == "changed" and state_store is None:
+        logger.info("PVS_RUN_MODE=changed needs PVS_STATE_PATH, running every stored procedure")
+    elif run_mode == "changed":
+        selected = select_changed_procedures(graph, dependencies, state_store)
+        for procedure in procs_clean:
+            if procedure not in selected:
+                last = state_store.last_outcome(_object_key(procedure))
+                logger.info(f"Skipping unchanged Stored Procedure {procedure}, passed last time in {last[2]:.1f}s")
+        waves = [wave for wave in ([procedure for procedure in wave if procedure in selected] for wave in waves) if wave]
+    return waves
+
+
+def main():
+    # PVS_PROFILE_PATH writes phase timings, cProfile, peak memory and import times of the run there as JSON
+    with PROFILER.profiling(os.environ.get("PVS_PROFILE_PATH"), "pvs_testing", os.path.dirname(os.path.abspath(__file__))):
+        _run_pvs_test()
+
+
+def _run_pvs_test():
+
+    # Capture environment relevant env vars, path-to-sql of every folder or DIRECTORY_LIST say where its SQL files are
+    layout = SqlLayout.from_env()
+    folder_sources = _folder_sources(layout)
+    if folder_sources is None:
+        return
+    scan_workers = int(os.environ.get("PVS_SCAN_WORKERS") or SCAN_WORKERS)
+
+    # Optional state kept between runs, PVS_RUN_MODE=changed only runs procedures changed since their last pass
+    state_path = os.environ.get("PVS_STATE_PATH")
+    run_mode = os.environ.get("PVS_RUN_MODE") or "full"
+    state_store = PvsStateStore(state_path) if state_path else None
+    logger.info(f"Run mode: {run_mode}, state: {state_path}")
+
+    # Timings of the run, written as JSON, as the step summary and as Prometheus text
+    report = RunReport(run_mode=run_mode)
 
     # Initialize variables with environment variable values for connecting to database
     teradata_username = os.environ.get("TDV_USERNAME")
@@ -133,41 +1317,204 @@ def main():
     logger.info(f"WorkitemID: {work_item_id}")
 
     # Define queries to be used for PVS Testing loop
-    # pvs_table_result_query = f"select TEST_STATUS from PVS_TEST.PVS_TEST_INFO_V where USER_NAME = '{teradata_username}' and WORK_ITEM = '{work_item_id}'"
+    pvs_table_result_query = f"select * from PVS_TEST.PVS_TEST_INFO_V where USER_NAME = '{teradata_username}' and WORK_ITEM = '{work_item_id}'"
     start_test_procedure = f"CALL PVS_TEST.START_PVS_TEST('{teradata_username}','{work_item_id}',PROC_MSG)"
     end_test_procedure = f"CALL PVS_TEST.END_PVS_TEST('{teradata_username}','{work_item_id}',PROC_MSG)"
 
-    # PVS testing loop
-    with teradatasql.connect(
-                host=teradata_host_server,
-                user=teradata_username,
-                password=teradata_password,
-                LOGMECH="LDAP",
-                encryptdata=True
-        ) as td_conn:
-    
-        # Start PVS Test
-        logger.info(f"Executing Start PVS Test")
-        execute_tdv_query(td_conn=td_conn, query=start_test_procedure)
-
-        # Run stored procedure(s)
-        for sp in procs_clean:
-            logger.info(f"Executing Stored Procedure: {sp}")
-            execute_tdv_query(td_conn=td_conn, query="CALL " + sp)
-
-        # End PVS Test
-        logger.info(f"Executing End PVS Test")
-        pvs_result = execute_tdv_query(td_conn=td_conn, query=end_test_procedure)
+    # Number of stored procedures run at the same time, each on its own pooled session
+    concurrency = int(os.environ.get("PVS_CONCURRENCY") or 1)
+    logger.info(f"Concurrency: {concurrency}")
+
+    # Number of CALLs sent together as one multi-statement request, 1 sends every CALL on its own
+    batch_size = int(os.environ.get("PVS_BATCH_SIZE") or 1)
+    logger.info(f"Batch size: {batch_size}")
+    report.details.update(work_item=work_item_id, concurrency=concurrency, batch_size=batch_size, verdict=None)
+
+    # Seconds a single CALL may run and seconds from START until no further CALL starts, in-flight ones are cancelled
+    procedure_timeout = float(os.environ.get("PVS_PROCEDURE_TIMEOUT") or 0)
+    deadline = float(os.environ.get("PVS_DEADLINE") or 0)
+    timeout_policy = os.environ.get("PVS_TIMEOUT_POLICY") or "continue"
+    logger.info(f"Procedure timeout: {procedure_timeout or None}, deadline: {deadline or None}, on timeout: {timeout_policy}")
+
+    # end takes the verdict from END_PVS_TEST, poll reads PVS_TEST_INFO_V until the validation finishes or times out
+    verdict_mode = os.environ.get("PVS_VERDICT_MODE") or "end"
+    poll_deadline = float(os.environ.get("PVS_POLL_DEADLINE") or 1800)
+    logger.info(f"Verdict mode: {verdict_mode}")
+
+    # PVS testing loop, the report is written on failures too. Poll mode reads the status on a session of its own
+    # while END_PVS_TEST still holds one
+    pool = TeradataConnectionPool(
+        concurrency + (verdict_mode == "poll"),
+        host=teradata_host_server,
+        user=teradata_username,
+        password=teradata_password,
+        LOGMECH="LDAP",
+        encryptdata=True
+    )
+    # The first logon runs while the SQL files are scanned, START_PVS_TEST finds its session open. CALLs wait for
+    # the whole scan, their dependency waves need every definition
+    pool.prefill()
+    end_request = None
+    try:
+        procs_clean, dependencies = collect_procedures(folder_sources, report, state_store, layout, scan_workers)
+        waves = plan_waves(procs_clean, dependencies, report, run_mode, state_store)
+
+        # Longest expected procedures start first in every wave
+        schedule = plan_schedule(waves, *estimate_durations(procs_clean, dependencies, state_store), concurrency,
+                                 batch_size)
+        waves = schedule.waves
+        logger.info(f"Expected run time {schedule.makespan:.1f}s over {len(waves)} waves, "
+                    f"{len(schedule.unknown)} stored procedures without history")
+        if deadline and schedule.makespan > deadline:
+            logger.info(f"Expected run time exceeds PVS_DEADLINE of {deadline:.0f}s, raise PVS_CONCURRENCY or the deadline")
+        report.details.update(predicted_seconds=round(schedule.makespan, 3),
+                              procedures_without_history=len(schedule.unknown))
+
+        # Every session the run uses logs on here at the same time, START and the procedures then hold no logon time
+        with report.phase("logon"):
+            pool.fill(min(concurrency, len(procs_clean)) + (verdict_mode == "poll"))
+
+        # Start PVS Test, a barrier before any stored procedure runs. Poll mode first notes the rows an earlier run
+        # of the work item left, so they cannot decide this run's verdict
+        logger.info("Executing Start PVS Test")
+        stale_rows = []
+        with report.phase("start"), pool.connection() as td_conn:
+            if verdict_mode == "poll":
+                stale_rows = execute_tdv_query(td_conn=td_conn, query=pvs_table_result_query).rows
+            execute_tdv_query(td_conn=td_conn, query=start_test_procedure)
+        limits = RunLimits(procedure_timeout, deadline, abort_on_timeout=timeout_policy == "abort")
+        # Shared by the waves, once the host refuses batched CALLs no later wave sends them
+        batching_rejected = threading.Event()
+
+        # Run stored procedure(s) wave by wave, a wave starts once everything it depends on has finished
+        outcomes = report.outcomes
+        try:
+            with report.phase("procedures"):
+                for number, wave in enumerate(waves, start=1):
+                    logger.info(f"Running wave {number} of {len(waves)}: {wave}")
+                    outcomes.extend(run_procedures_concurrently(pool, wave, concurrency, batch_size, limits,
+                                                                batching_rejected))
+            if state_store is not None:
+                record_durations(state_store, outcomes, dependencies)
+
+        # End PVS Test once every stored procedure has finished, timed out or was skipped, so the work item is closed
+        finally:
+            logger.info("Executing End PVS Test")
+            if verdict_mode == "poll":
+                # END can block while PVS validates, it is sent without waiting and the status is polled meanwhile
+                end_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pvs-end")
+                end_request = end_executor.submit(_end_pvs_test, pool, end_test_procedure)
+                end_executor.shutdown(wait=False)
+            else:
+                with report.phase("end"), pool.connection() as td_conn:
+                    pvs_result = execute_tdv_query(td_conn=td_conn, query=end_test_procedure)
+
+        if verdict_mode == "poll":
+            with report.phase("verdict"):
+                verdict = poll_pvs_status(pool, pvs_table_result_query, poll_deadline, stale_rows=stale_rows,
+                                          end_returned=end_request.done)
+            # The work item is only closed once END returned, its errors fail the run as in end mode
+            pvs_result, end_seconds = end_request.result()
+            report.add_phase("end", end_seconds)
 
         # Pull test result from End Test return
         logger.info(f"PVS Test Result: {pvs_result} and data-type: {str(type(pvs_result))}")
-        pass_or_fail(pvs_result)
+        if verdict_mode == "poll":
+            report.details.update(verdict=verdict.status, verdict_rows=verdict.rows)
+            if not verdict.passed:
+                logger.info(f"FAILURE, PVS status {verdict.status} after {verdict.polls} polls: {verdict.rows}")
+                exit(1)
+        else:
+            report.details["verdict"] = pvs_result['RESPONSE'][0]
+            pass_or_fail(pvs_result)
+
+        # Remember what ran against which definition, only once the PVS test itself passed
+        if state_store is not None:
+            for outcome in outcomes:
+                references = dependencies.get(_object_key(outcome.procedure))
+                state_store.record_outcome(_object_key(outcome.procedure), references.definition_hash if references else "",
+                                           outcome.succeeded, outcome.duration)
+
+        # Report every failed stored procedure, not just the first one
+        failed = [outcome for outcome in outcomes if not outcome.succeeded]
+        for outcome in failed:
+            logger.info(f"{outcome.status} Stored Procedure {outcome.procedure}: {outcome.error}")
+        if failed:
+            exit(1)
+    finally:
+        # END keeps its session until it returns, also when the run failed
+        if end_request is not None:
+            wait([end_request])
+        pool.close()
+        if state_store is not None:
+            state_store.close()
+        report.write(os.environ.get("PVS_REPORT_PATH"), os.environ.get("GITHUB_STEP_SUMMARY"),
+                     os.environ.get("PVS_METRICS_PATH"))
+
+
+def format_plan(schedule, concurrency, batch_size) -> str:
+    lines = [f"PVS plan: {sum(len(wave) for wave in schedule.waves)} stored procedures in {len(schedule.waves)} waves "
+             f"on {concurrency} sessions, {batch_size} CALLs per request", ""]
+    for number, (wave, wave_makespan) in enumerate(zip(schedule.waves, schedule.wave_makespans), start=1):
+        lines.append(f"Wave {number}, expected {wave_makespan:.1f}s")
+        for procedure in wave:
+            started, finished = schedule.timeline[procedure]
+            expected = "no history" if procedure in schedule.unknown else f"{schedule.expected(procedure):.1f}s"
+            lines.append(f"  {started:9.1f}s - {finished:9.1f}s  {expected:>12}  {procedure}")
+    lines += ["", f"Expected makespan: {schedule.makespan:.1f}s"]
+    if schedule.unknown:
+        lines.append(f"No history for {len(schedule.unknown)} stored procedures, planned at "
+                     f"{schedule.default_estimate:.1f}s each:")
+        lines += [f"  {procedure}" for procedure in schedule.unknown]
+    return "\n".join(lines)
+
+
+def plan_main():
+    """Prints the order, expected makespan and procedures without history of a PVS run, without connecting."""
+    parser = argparse.ArgumentParser(description="Plan a PVS run from FOLDER_LIST or PVS_MANIFEST_PATH and PVS_STATE_PATH")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("PVS_CONCURRENCY") or 1))
+    parser.add_argument("--batch_size", type=int, default=int(os.environ.get("PVS_BATCH_SIZE") or 1))
+    parser.add_argument("--max_seconds", type=float, default=float(os.environ.get("PVS_DEADLINE") or 0),
+                        help="exit with 1 when the expected makespan is longer, defaults to PVS_DEADLINE")
+    parser.add_argument("--output", help="also write the plan as JSON to this file")
+    parser.add_argument("--profile", default=os.environ.get("PVS_PROFILE_PATH"),
+                        help="write phase timings, cProfile, peak memory and import times of the planning to this JSON file")
+    args = parser.parse_args()
+    with PROFILER.profiling(args.profile, "pvs_testing", os.path.dirname(os.path.abspath(__file__))):
+        _print_plan(args)
+
+
+def _print_plan(args):
+    layout = SqlLayout.from_env()
+    folder_sources = _folder_sources(layout)
+    if folder_sources is None:
+        return
+    state_path = os.environ.get("PVS_STATE_PATH")
+    run_mode = os.environ.get("PVS_RUN_MODE") or "full"
+    state_store = PvsStateStore(state_path) if state_path else None
+    report = RunReport(run_mode=run_mode)
+    try:
+        procs_clean, dependencies = collect_procedures(folder_sources, report, state_store, layout,
+                                                       int(os.environ.get("PVS_SCAN_WORKERS") or SCAN_WORKERS))
+        waves = plan_waves(procs_clean, dependencies, report, run_mode, state_store)
+        schedule = plan_schedule(waves, *estimate_durations(procs_clean, dependencies, state_store),
+                                 args.concurrency, args.batch_size)
+    finally:
+        if state_store is not None:
+            state_store.close()
 
-        #
-        # # Get results
-        # logger.info(f"Result of PVS Test")
-        # pvs_result = execute_tdv_query(td_conn=td_conn, query=pvs_table_result_query)
-        # pass_or_fail(pvs_result)
+    print(format_plan(schedule, args.concurrency, args.batch_size))
+    if args.output:
+        with open(args.output, "w") as plan_file:
+            json.dump({"concurrency": args.concurrency, "batch_size": args.batch_size, "makespan": schedule.makespan,
+                       "waves": [[{"procedure": procedure, "expected": schedule.expected(procedure),
+                                   "start": schedule.timeline[procedure][0], "finish": schedule.timeline[procedure][1],
+                                   "history": procedure not in schedule.unknown} for procedure in wave]
+                                 for wave in schedule.waves],
+                       "without_history": schedule.unknown}, plan_file, indent=2)
+    if args.max_seconds and schedule.makespan > args.max_seconds:
+        print(f"Expected makespan {schedule.makespan:.1f}s exceeds {args.max_seconds:.0f}s")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
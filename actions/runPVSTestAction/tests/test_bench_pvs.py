@@ -0,0 +1,236 @@
+import json
+import os
+import sys
+
+import pytest
+from unittest.mock import patch
+
+from benchmarks.bench_pvs import compare_results, generate_pvs_workspace, run_benchmarks
+from benchmarks.fake_teradatasql import FakeTeradata, FakeTeradataError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pvs_testing')))
+import pvs_testing as ms
+
+
+def test_fake_teradata_scripts_procedures_and_closes_work_items():
+    fake = FakeTeradata(multi_statement=True)
+    fake.script("DB.SLOW", rows=[("done",)])
+    fake.script("DB.BROKEN", error="[Error 3807] Object 'DB.T' does not exist.")
+    td_conn = fake.connect(host="h")
+
+    assert ms.execute_tdv_query(td_conn, "CALL PVS_TEST.START_PVS_TEST('u','CHG1_CTASK2',PROC_MSG)")["PROC_MSG"]
+    assert ms.execute_tdv_query(td_conn, "CALL DB.SLOW(PROC_MSG)")["PROC_MSG"] == ["done"]
+    with pytest.raises(FakeTeradataError, match="3807"):
+        ms.execute_tdv_query(td_conn, "CALL DB.BROKEN()")
+    results = ms.execute_tdv_batch(td_conn, ["CALL DB.SLOW(PROC_MSG)", "CALL DB.OTHER()"])
+    verdict = ms.execute_tdv_query(td_conn, "CALL PVS_TEST.END_PVS_TEST('u','CHG1_CTASK2',PROC_MSG)")
+
+    assert [len(result) for result in results] == [1, 0]
+    assert verdict["RESPONSE"] == ["PVS TEST PASSED"]
+    assert fake.work_items[("u", "CHG1_CTASK2")].calls == ["DB.SLOW", "DB.BROKEN", "DB.SLOW", "DB.OTHER"]
+    with pytest.raises(FakeTeradataError, match="never started"):
+        ms.execute_tdv_query(td_conn, "CALL PVS_TEST.END_PVS_TEST('u','other',PROC_MSG)")
+
+
+def test_fake_teradata_cancel_aborts_the_running_request():
+    fake = FakeTeradata()
+    fake.script("DB.HANGS", latency=5)
+    td_conn = fake.connect()
+
+    with ms._cancel_after(td_conn, 0.05) as cancelled:
+        with pytest.raises(FakeTeradataError, match="aborted by the user"):
+            ms.execute_tdv_query(td_conn, "CALL DB.HANGS()")
+    assert cancelled.is_set()
+    assert fake.cancels == 1
+
+
+def test_main_end_to_end_against_fake_host(tmp_path, monkeypatch):
+    workspace = generate_pvs_workspace(str(tmp_path), 12, folders=3, dependency_ratio=0.5)
+    fake = FakeTeradata(strict=True)
+    for name in workspace["procedures"]:
+        fake.script(name)
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_CONCURRENCY": "3", "PVS_BATCH_SIZE": "4",
+                        "PVS_REPORT_PATH": str(tmp_path / "report.json")}.items():
+        monkeypatch.setenv(name, value)
+
+    with fake.patched(ms):
+        ms.main()
+
+    assert sorted(fake.calls) == workspace["procedures"]
+    # Only the first batch was sent, the refusal turned batching off for every later wave
+    assert sum(len(statements) > 1 for statements in fake.requests) == 1
+    assert fake.work_items[("u", "CHG1_CTASK2")].ended_at is not None
+    assert fake.logons <= 3
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["verdict"] == "PVS TEST PASSED"
+    assert all(entry["succeeded"] for entry in report["procedures"])
+
+
+def test_run_benchmarks_measures_every_scenario():
+    results = run_benchmarks([10], round_trip=0, latency=0)
+
+    measurements = results["scenarios"][0]["measurements"]
+    assert set(measurements) == {"sequential", "pooled", "changed_only_rerun"}
+    assert measurements["sequential"]["procedures_run"] == 10
+    assert measurements["changed_only_rerun"]["procedures_run"] == 0
+    assert json.loads(json.dumps(results)) == results
+
+
+def test_compare_results_flags_slower_measurements():
+    baseline = {"scenarios": [{"size": 10, "measurements": {"pooled": {"wall_seconds": 1.0}}}]}
+    current = {"scenarios": [{"size": 10, "measurements": {"pooled": {"wall_seconds": 1.5}}}]}
+
+    assert compare_results(baseline, current, 1.2) == ["pooled at 10 procedures is 1.50x slower"]
+
+
+@pytest.mark.parametrize("verdict, exits", [("PVS TEST PASSED", False), ("PVS TEST FAILED", True)])
+def test_main_polls_pvs_status_against_fake_host(tmp_path, monkeypatch, verdict, exits):
+    workspace = generate_pvs_workspace(str(tmp_path), 4, folders=2)
+    fake = FakeTeradata(verdict=verdict, validation_polls=2)
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_VERDICT_MODE": "poll",
+                        "PVS_REPORT_PATH": str(tmp_path / "report.json")}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(ms.time, "sleep", lambda seconds: None)
+
+    with fake.patched(ms):
+        if exits:
+            with pytest.raises(SystemExit):
+                ms.main()
+        else:
+            ms.main()
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["verdict"] == ("FAILED" if exits else "PASSED")
+    assert report["verdict_rows"] == [{"USER_NAME": "u", "WORK_ITEM": "CHG1_CTASK2", "TEST_STATUS": report["verdict"]}]
+    assert fake.work_items[("u", "CHG1_CTASK2")].status_reads == 3
+
+
+def test_main_polls_while_end_pvs_test_is_still_running(tmp_path, monkeypatch):
+    workspace = generate_pvs_workspace(str(tmp_path), 2, folders=1)
+    fake = FakeTeradata(validation_polls=1, end_latency=0.5)
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_VERDICT_MODE": "poll",
+                        "PVS_REPORT_PATH": str(tmp_path / "report.json")}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(ms.time, "sleep", lambda seconds: None)
+
+    with fake.patched(ms):
+        ms.main()
+
+    work_item = fake.work_items[("u", "CHG1_CTASK2")]
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["verdict"] == "PASSED"
+    assert work_item.status_read_at[0] < work_item.end_returned_at
+    assert report["phases"]["verdict"] < report["phases"]["end"]
+    assert fake.logons == 2
+
+
+def test_main_reports_logon_outside_start_and_procedures(tmp_path, monkeypatch):
+    workspace = generate_pvs_workspace(str(tmp_path), 4, folders=1)
+    fake = FakeTeradata(logon_latency=0.3)
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_CONCURRENCY": "3",
+                        "PVS_REPORT_PATH": str(tmp_path / "report.json")}.items():
+        monkeypatch.setenv(name, value)
+
+    with fake.patched(ms):
+        ms.main()
+
+    phases = json.loads((tmp_path / "report.json").read_text())["phases"]
+    # The three sessions log on together before START, neither START nor the CALLs wait for a logon
+    assert fake.logons == 3
+    assert phases["logon"] < 0.9
+    assert phases["start"] < 0.3 and phases["procedures"] < 0.3
+
+
+def test_main_reads_folders_from_the_workspace_manifest(tmp_path, monkeypatch):
+    workspace = generate_pvs_workspace(str(tmp_path), 6, folders=2)
+    folder = workspace["folders"][0]
+    sql_files = sorted(os.listdir(os.path.join(folder, "tables")))
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest_path.write_text("\n".join(json.dumps(line) for line in [
+        {"manifest_version": 2, "root": str(tmp_path)},
+        {"relative_path": os.path.basename(folder), "type": "stored_proc", "config": {},
+         "sql_files": [{"path": f"tables/{name}"} for name in sql_files]}]) + "\n")
+    fake = FakeTeradata()
+    for name, value in {"PVS_MANIFEST_PATH": str(manifest_path), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_STATE_PATH": str(tmp_path / "state.sqlite"),
+                        "PVS_REPORT_PATH": str(tmp_path / "report.json")}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("FOLDER_LIST", raising=False)
+    monkeypatch.delenv("GITHUB_WORKSPACE", raising=False)
+
+    with fake.patched(ms), patch.object(ms, "fetch_all_sql_files") as mock_fetch:
+        ms.main()
+
+    mock_fetch.assert_not_called()
+    assert sorted(fake.calls) == ["PVS_BENCH.LOAD_00000", "PVS_BENCH.LOAD_00001", "PVS_BENCH.LOAD_00004",
+                                  "PVS_BENCH.LOAD_00005"]
+
+
+def test_main_runs_longest_recorded_procedures_first(tmp_path, monkeypatch):
+    workspace = generate_pvs_workspace(str(tmp_path), 4, folders=1, dependency_ratio=0)
+    fake = FakeTeradata()
+    fake.script("PVS_BENCH.LOAD_00002", latency=0.05)
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_STATE_PATH": str(tmp_path / "state.sqlite"),
+                        "PVS_REPORT_PATH": str(tmp_path / "report.json")}.items():
+        monkeypatch.setenv(name, value)
+
+    with fake.patched(ms):
+        ms.main()
+        first_run = list(fake.calls)
+        ms.main()
+
+    assert first_run == workspace["procedures"]
+    assert fake.calls[4] == "PVS_BENCH.LOAD_00002"
+    assert sorted(fake.calls[4:]) == workspace["procedures"]
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["procedures_without_history"] == 0
+    assert report["predicted_seconds"] >= 0.05
+
+
+def test_plan_main_prints_the_schedule_without_connecting(tmp_path, monkeypatch, capsys):
+    workspace = generate_pvs_workspace(str(tmp_path), 3, folders=1, dependency_ratio=0)
+    state = ms.PvsStateStore(str(tmp_path / "state.sqlite"))
+    state.record_duration("pvs_bench.load_00000", "", 1.0)
+    state.record_duration("pvs_bench.load_00001", "", 120.0)
+    state.close()
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "PVS_STATE_PATH": str(tmp_path / "state.sqlite"),
+                        "PVS_CONCURRENCY": "2"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(sys, "argv", ["pvs_plan", "--max_seconds", "60", "--output", str(tmp_path / "plan.json")])
+
+    with patch.object(ms, "teradatasql") as mock_teradatasql, pytest.raises(SystemExit):
+        ms.plan_main()
+
+    mock_teradatasql.connect.assert_not_called()
+    out = capsys.readouterr().out
+    assert "Expected makespan: 121.0s" in out
+    assert "No history for 1 stored procedures" in out
+    plan = json.loads((tmp_path / "plan.json").read_text())
+    assert [entry["procedure"] for entry in plan["waves"][0]] == ["PVS_BENCH.LOAD_00001()",
+                                                                  "PVS_BENCH.LOAD_00002()",
+                                                                  "PVS_BENCH.LOAD_00000()"]
+    assert plan["without_history"] == ["PVS_BENCH.LOAD_00002()"]
+
+
+def test_main_writes_a_profile_when_asked(tmp_path, monkeypatch):
+    workspace = generate_pvs_workspace(str(tmp_path), 4, folders=2)
+    fake = FakeTeradata()
+    for name, value in {"FOLDER_LIST": json.dumps(workspace["folders"]), "TDV_USERNAME": "u", "ChangeTicket_Num": "1",
+                        "CTASK_NUM": "2", "PVS_PROFILE_PATH": str(tmp_path / "pvs_profile.json")}.items():
+        monkeypatch.setenv(name, value)
+
+    with fake.patched(ms):
+        ms.main()
+
+    profile = json.loads((tmp_path / "pvs_profile.json").read_text())
+    assert {"discovery", "extraction", "planning", "start", "procedures", "end", "logon"} <= set(profile["phases"])
+    assert profile["peak_traced_memory_bytes"] > 0
+    assert any("run_procedures_concurrently" in entry["function"] for entry in profile["functions"])
+    assert profile["imports"]["total_seconds"] > 0
+    assert (tmp_path / "pvs_profile.json.pstats").exists()
+    assert ms.PROFILER.path is None
@@ -1,9 +1,13 @@
 import os
 import sys
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 import logging
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+from unittest.mock import ANY, patch, MagicMock
 
 # Point Python to the actual implementation module (not this test file)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'pvs_testing')))
@@ -16,15 +20,27 @@ def test_no_tables_directory(tmp_path, caplog):
     assert result == []
     assert any("No tables directory" in msg for msg in caplog.messages)
 
-@patch("pandas.read_sql")
-def test_execute_tdv_query_to_dict_failure(mock_read_sql):
-    mock_df = MagicMock()
-    mock_df.to_dict.side_effect = Exception("to_dict failed")
-    mock_read_sql.return_value = mock_df
-
+def _mock_conn(description=None, rows=()):
     td_conn = MagicMock()
-    result = ms.execute_tdv_query(td_conn, "SELECT *")
-    assert result == {}
+    cursor = td_conn.cursor.return_value.__enter__.return_value
+    cursor.description = description
+    remaining = list(rows)
+
+    def fetchmany(size):
+        batch = remaining[:size]
+        del remaining[:size]
+        return batch
+
+    cursor.fetchmany.side_effect = fetchmany
+    return td_conn, cursor
+
+
+def test_execute_tdv_query_without_result_set():
+    td_conn, cursor = _mock_conn()
+    result = ms.execute_tdv_query(td_conn, "CALL db.proc()")
+    cursor.execute.assert_called_once_with("CALL db.proc()")
+    assert len(result) == 0
+    assert result.to_dict() == {}
 
 
 def test_folder_list_env_not_set(monkeypatch, caplog):
@@ -77,23 +93,43 @@ def test_pass_or_fail_fail_exit():
         ms.pass_or_fail(result_dict)
 
 
-@patch("pandas.read_sql")
-def test_execute_tdv_query_success(mock_read_sql):
-    mock_df = MagicMock()
-    mock_df.to_dict.return_value = {"key": [1]}
-    mock_read_sql.return_value = mock_df
-    td_conn = MagicMock()
+def test_execute_tdv_query_success():
+    td_conn, _ = _mock_conn(description=[("key",), ("RESPONSE",)], rows=[(1, "PASSED")])
     result = ms.execute_tdv_query(td_conn, "SELECT *")
-    assert result == {"key": [1]}
+    assert result.to_dict() == {"key": {0: 1}, "RESPONSE": {0: "PASSED"}}
+    assert result["RESPONSE"][0] == "PASSED"
 
 
-@patch("pandas.read_sql", side_effect=Exception("DB error"))
-def test_execute_tdv_query_failure(mock_read_sql):
-    td_conn = MagicMock()
+def test_execute_tdv_query_streams_and_caps_rows(caplog):
+    caplog.set_level(logging.INFO)
+    td_conn, cursor = _mock_conn(description=[("N",)], rows=[(n,) for n in range(250)])
+    result = ms.execute_tdv_query(td_conn, "SELECT N", max_rows=120)
+    assert result["N"] == list(range(120))
+    assert cursor.fetchmany.call_count == 2
+    assert any("115 more of 120 rows" in msg for msg in caplog.messages)
+
+
+def test_execute_tdv_query_failure():
+    td_conn, cursor = _mock_conn()
+    cursor.execute.side_effect = Exception("DB error")
     with pytest.raises(Exception, match="DB error"):
         ms.execute_tdv_query(td_conn, "SELECT *")
 
 
+def test_pass_or_fail_with_query_result_fail_exit():
+    with pytest.raises(SystemExit):
+        ms.pass_or_fail(ms.QueryResult(["RESPONSE"], [("PVS TEST FAILED",)]))
+
+
+def test_read_tdv_dataframe_uses_pandas():
+    # pandas is the optional dataframe extra, a plain poetry install does not have it
+    pandas = pytest.importorskip("pandas")
+    td_conn = MagicMock()
+    with patch.object(pandas, "read_sql") as mock_read_sql:
+        assert ms.read_tdv_dataframe(td_conn, "SELECT *") is mock_read_sql.return_value
+    mock_read_sql.assert_called_once_with("SELECT *", td_conn)
+
+
 @patch("pvs_testing.teradatasql.connect")
 @patch("pvs_testing.execute_tdv_query")
 @patch("pvs_testing.extract_proc_names_from_file", return_value=["mydb.${dbEnv}.sample_proc"])
@@ -114,3 +150,743 @@ def test_main_path(mock_env_get, mock_fetch, mock_extract, mock_exec_query, mock
     mock_connect.return_value.__enter__.return_value = mock_conn
 
     ms.main()
+
+
+@patch("pvs_testing.teradatasql.connect")
+def test_connection_pool_logs_on_once_per_connection(mock_connect):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    pool = ms.TeradataConnectionPool(2, host="h", user="u", password="p", LOGMECH="LDAP")
+
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+    for _ in range(5):
+        with pool.connection():
+            pass
+    pool.close()
+
+    assert mock_connect.call_count == 2
+    mock_connect.assert_called_with(host="h", user="u", password="p", LOGMECH="LDAP")
+    first.close.assert_called_once()
+
+
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.teradatasql.connect")
+def test_run_procedures_concurrently_collects_every_outcome(mock_connect, mock_exec_query):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+
+    def execute(td_conn, query):
+        if "bad" in query:
+            raise Exception("procedure failed")
+        return ms.QueryResult([], [])
+
+    mock_exec_query.side_effect = execute
+    with ms.TeradataConnectionPool(3) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, ["db.ok_1()", "db.bad()", "db.ok_2()", "db.ok_3()"], 3)
+
+    assert [outcome.procedure for outcome in outcomes] == ["db.ok_1()", "db.bad()", "db.ok_2()", "db.ok_3()"]
+    assert [outcome.succeeded for outcome in outcomes] == [True, False, True, True]
+    assert outcomes[1].error == "procedure failed"
+    assert mock_connect.call_count <= 3
+
+
+@patch("pvs_testing.teradatasql.connect")
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.extract_proc_names_from_file", return_value=["mydb${dbEnv}.good", "mydb${dbEnv}.bad"])
+@patch("pvs_testing.fetch_all_sql_files", return_value=["/fake/path/file.sql"])
+def test_main_runs_end_and_fails_when_a_procedure_fails(mock_fetch, mock_extract, mock_exec_query, mock_connect,
+                                                        monkeypatch):
+    monkeypatch.setenv("FOLDER_LIST", '["/fake/path"]')
+    monkeypatch.setenv("PVS_CONCURRENCY", "2")
+    queries = []
+
+    def execute(td_conn, query):
+        queries.append(query)
+        if "bad" in query:
+            raise Exception("procedure failed")
+        return {"RESPONSE": ["PASSED"]}
+
+    mock_exec_query.side_effect = execute
+    with pytest.raises(SystemExit):
+        ms.main()
+
+    assert "START_PVS_TEST" in queries[0]
+    assert "END_PVS_TEST" in queries[-1]
+    assert sorted(queries[1:-1]) == ["CALL mydb.bad()", "CALL mydb.good()"]
+
+
+def test_extract_proc_names_from_file_collects_dependencies(tmp_path):
+    sql_file = tmp_path / "procs.sql"
+    sql_file.write_text("""
+        REPLACE PROCEDURE STG${dbEnv}.LOAD_CLAIMS()
+        BEGIN
+            INSERT INTO STG${dbEnv}.CLAIMS SELECT * FROM RAW${dbEnv}.CLAIMS_IN;
+        END;
+        REPLACE PROCEDURE RPT${dbEnv}.BUILD_REPORT()
+        BEGIN
+            CALL STG${dbEnv}.LOAD_CLAIMS();
+            INSERT INTO RPT${dbEnv}.REPORT SELECT * FROM STG${dbEnv}.CLAIMS;
+        END;
+    """)
+    dependencies = {}
+    procs = ms.extract_proc_names_from_file(str(sql_file), dependencies=dependencies)
+
+    assert procs == ["STG${dbEnv}.LOAD_CLAIMS()", "RPT${dbEnv}.BUILD_REPORT()"]
+    assert dependencies["stg.load_claims"].produces == {"stg.load_claims", "stg.claims"}
+    assert dependencies["stg.load_claims"].references == {"stg.claims", "raw.claims_in"}
+    assert dependencies["rpt.build_report"].references == {"stg.load_claims", "rpt.report", "stg.claims"}
+
+
+def test_plan_procedure_waves_orders_by_calls_and_produced_objects():
+    dependencies = {
+        "stg.load_claims": ms.ProcedureReferences({"stg.load_claims", "stg.claims"}, {"stg.claims", "raw.claims_in"}),
+        "stg.load_members": ms.ProcedureReferences({"stg.load_members", "stg.members"}, {"stg.members"}),
+        "rpt.build_report": ms.ProcedureReferences({"rpt.build_report"}, {"stg.claims", "stg.members"}),
+        "rpt.publish": ms.ProcedureReferences({"rpt.publish"}, {"rpt.build_report"}),
+    }
+    procedures = ["RPT.publish()", "RPT.build_report()", "STG.load_members()", "STG.load_claims()", "OTHER.alone()"]
+    graph = ms.build_dependency_graph(procedures, dependencies)
+    waves, cycles = ms.plan_procedure_waves(graph)
+
+    assert graph["RPT.build_report()"] == {"STG.load_claims()", "STG.load_members()"}
+    assert waves == [["OTHER.alone()", "STG.load_claims()", "STG.load_members()"],
+                     ["RPT.build_report()"],
+                     ["RPT.publish()"]]
+    assert cycles == []
+
+
+def test_plan_procedure_waves_reports_cycles_without_deadlock():
+    graph = {"a()": {"b()"}, "b()": {"a()"}, "c()": {"a()"}, "d()": set()}
+    waves, cycles = ms.plan_procedure_waves(graph)
+
+    assert cycles == [["a()", "b()"]]
+    assert waves == [["a()", "b()", "d()"], ["c()"]]
+
+
+@patch("pvs_testing.teradatasql.connect")
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.fetch_all_sql_files")
+def test_main_runs_dependent_procedures_in_later_waves(mock_fetch, mock_exec_query, mock_connect, tmp_path,
+                                                       monkeypatch, caplog):
+    caplog.set_level(logging.INFO)
+    sql_file = tmp_path / "procs.sql"
+    sql_file.write_text("""
+        REPLACE PROCEDURE RPT${dbEnv}.BUILD_REPORT() BEGIN CALL STG${dbEnv}.LOAD_CLAIMS(); END;
+        REPLACE PROCEDURE STG${dbEnv}.LOAD_CLAIMS() BEGIN INSERT INTO STG${dbEnv}.CLAIMS VALUES (1); END;
+    """)
+    mock_fetch.return_value = [str(sql_file)]
+    monkeypatch.setenv("FOLDER_LIST", f'["{tmp_path}"]')
+    monkeypatch.setenv("PVS_CONCURRENCY", "4")
+    queries = []
+
+    def execute(td_conn, query):
+        queries.append(query)
+        return {"RESPONSE": ["PASSED"]}
+
+    mock_exec_query.side_effect = execute
+    ms.main()
+
+    assert queries[1:-1] == ["CALL STG.LOAD_CLAIMS()", "CALL RPT.BUILD_REPORT()"]
+    assert any("Running wave 2 of 2" in msg for msg in caplog.messages)
+
+
+SCANNER_SQL = """
+-- REPLACE PROCEDURE OLD${dbEnv}.COMMENTED_OUT()
+/* CREATE PROCEDURE OLD${dbEnv}.IN_BLOCK_COMMENT()
+   REPLACE PROCEDURE OLD${dbEnv}.STILL_IN_COMMENT() */
+REPLACE PROCEDURE "STG${dbEnv}"."LOAD_CLAIMS" (
+    IN RUN_DATE DATE,
+    INOUT BATCH_ID INTEGER,
+    OUT PROC_MSG VARCHAR(100) -- trailing comment, CREATE PROCEDURE X${dbEnv}.NOPE()
+)
+BEGIN
+    SET PROC_MSG = 'REPLACE PROCEDURE OLD${dbEnv}.IN_A_STRING() isn''t real';
+    UPDATE STG${dbEnv}.CLAIMS SET LOADED = 1;
+END;
+REPLACE FUNCTION STG${dbEnv}.TO_KEY (ID INTEGER) RETURNS INTEGER RETURN ID;
+"""
+
+
+def test_scan_sql_definitions_skips_comments_and_literals(tmp_path):
+    sql_file = tmp_path / "scanner.sql"
+    sql_file.write_text(SCANNER_SQL)
+    with open(sql_file) as f:
+        definitions = ms.scan_sql_definitions(f)
+
+    assert [(definition.kind, definition.name) for definition in definitions] == [
+        ("PROCEDURE", '"STG${dbEnv}"."LOAD_CLAIMS"'), ("FUNCTION", "STG${dbEnv}.TO_KEY")]
+    assert definitions[0].parameters == [("IN", "RUN_DATE"), ("INOUT", "BATCH_ID"), ("OUT", "PROC_MSG")]
+    assert definitions[0].produces == {"stg.load_claims", "stg.claims"}
+    # Functions are not CALL targets, they only go into the dependency map
+    dependencies = {}
+    assert ms.extract_proc_names_from_file(str(sql_file), dependencies) == ['"STG${dbEnv}"."LOAD_CLAIMS"()']
+    assert "STG${dbEnv}.TO_KEY()" not in ms.extract_proc_names_from_file(str(sql_file))
+    assert set(dependencies) == {"stg.load_claims", "stg.to_key"}
+
+
+def test_scan_sql_definitions_keeps_quoted_names_with_spaces(tmp_path):
+    sql_file = tmp_path / "quoted.sql"
+    sql_file.write_text('REPLACE PROCEDURE "STG${dbEnv}"."LOAD ""DAILY"" CLAIMS" ()\nBEGIN END;\n')
+    procs = ms.extract_proc_names_from_file(str(sql_file))
+
+    assert procs == ['"STG${dbEnv}"."LOAD ""DAILY"" CLAIMS"()']
+    assert ms._call_name(procs[0]) == '"STG"."LOAD ""DAILY"" CLAIMS"()'
+    assert ms._object_key(procs[0]) == 'stg.load daily claims'
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64, 300])
+def test_scan_sql_definitions_carries_long_tokens_across_chunks(tmp_path, chunk_size):
+    long_name = "LOAD_" + "X" * 700
+    sql_file = tmp_path / "long.sql"
+    sql_file.write_text(f'REPLACE PROCEDURE STG${{dbEnv}}.{long_name} ()\nBEGIN\n'
+                        f'    INSERT INTO "STG${{dbEnv}}"."{long_name} COPY" SELECT 1;\nEND;\n'
+                        f'REPLACE PROCEDURE "STG${{dbEnv}}"."{long_name} 2" ()\nBEGIN END;\n')
+    with open(sql_file) as f:
+        definitions = ms.scan_sql_definitions(f, chunk_size=chunk_size)
+
+    assert [definition.name for definition in definitions] == [f"STG${{dbEnv}}.{long_name}",
+                                                               f'"STG${{dbEnv}}"."{long_name} 2"']
+    assert definitions[0].produces == {f"stg.{long_name.lower()}", f"stg.{long_name.lower()} copy"}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_scan_sql_definitions_is_independent_of_chunk_size(tmp_path, chunk_size):
+    sql_file = tmp_path / "scanner.sql"
+    sql_file.write_text(SCANNER_SQL * 20)
+    with open(sql_file) as f:
+        expected = ms.scan_sql_definitions(f)
+    with open(sql_file) as f:
+        assert ms.scan_sql_definitions(f, chunk_size=chunk_size) == expected
+    assert len(expected) == 40
+
+
+def test_state_store_skips_scanning_unchanged_files(tmp_path):
+    sql_file = tmp_path / "scanner.sql"
+    sql_file.write_text(SCANNER_SQL)
+    store = ms.PvsStateStore(str(tmp_path / "state" / "pvs.sqlite"))
+    first = {}
+    procs = ms.extract_proc_names_from_file(str(sql_file), dependencies=first, state_store=store)
+
+    with patch("pvs_testing.scan_sql_definitions") as mock_scan:
+        cached = {}
+        assert ms.extract_proc_names_from_file(str(sql_file), dependencies=cached, state_store=store) == procs
+        mock_scan.assert_not_called()
+    assert cached == first
+    assert first["stg.load_claims"].definition_hash
+
+    sql_file.write_text(SCANNER_SQL.replace("-- trailing comment", "-- reworded comment"))
+    edited = {}
+    ms.extract_proc_names_from_file(str(sql_file), dependencies=edited, state_store=store)
+    assert edited["stg.load_claims"].definition_hash == first["stg.load_claims"].definition_hash
+
+
+def test_state_store_uses_the_manifest_hash_without_reading_the_file(tmp_path):
+    sql_file = tmp_path / "scanner.sql"
+    sql_file.write_text(SCANNER_SQL)
+    store = ms.PvsStateStore(str(tmp_path / "pvs.sqlite"))
+    content_hash = ms._file_content_hash(str(sql_file))
+    procs = ms.extract_proc_names_from_file(str(sql_file), state_store=store, content_hash=content_hash)
+    sql_file.unlink()
+
+    assert ms.extract_proc_names_from_file(str(sql_file), state_store=store, content_hash=content_hash) == procs
+
+
+def test_workspace_manifest_lists_sql_files_below_path_to_sql(tmp_path, monkeypatch):
+    monkeypatch.delenv("GITHUB_WORKSPACE", raising=False)
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest_path.write_text("\n".join(json.dumps(line) for line in [
+        {"manifest_version": 2, "root": "/workspace"},
+        {"relative_path": "db/claims", "type": "stored_proc", "config": {}, "sql_files": [
+            {"path": "procedures/other.sql"}, {"path": "tables/load.sql"},
+            {"path": "tables/nested/deep.sql"}, {"path": "tables/archive/old.sql"}]},
+        {"relative_path": "db/members", "type": "stored_proc", "config": {"path-to-sql": ["procedures", "views/"]},
+         "sql_files": [{"path": "procedures/load.sql"}, {"path": "tables/skipped.sql"}, {"path": "views/v.sql"}]},
+        {"relative_path": "db/empty", "type": "tdv_ddl", "config": {}, "sql_files": []}]) + "\n")
+
+    manifest = ms.WorkspaceManifest(str(manifest_path))
+    layout = ms.SqlLayout(exclude_globs=ms.DEFAULT_SQL_EXCLUDE_GLOBS + ("archive",))
+
+    claims, members = os.path.join("/workspace", "db/claims"), os.path.join("/workspace", "db/members")
+    assert list(manifest.iter_sql_files(layout)) == [
+        (claims, [(os.path.join(claims, "tables", "load.sql"), None),
+                  (os.path.join(claims, "tables", "nested", "deep.sql"), None)]),
+        (members, [(os.path.join(members, "procedures", "load.sql"), None),
+                   (os.path.join(members, "views", "v.sql"), None)]),
+        (os.path.join("/workspace", "db/empty"), [])]
+    manifest_path.write_text('{"manifest_version": 1}\n')
+    with pytest.raises(ValueError, match="version 2"):
+        ms.WorkspaceManifest(str(manifest_path))
+
+
+def test_state_store_smooths_durations_per_definition(tmp_path):
+    store = ms.PvsStateStore(str(tmp_path / "pvs.sqlite"))
+    assert store.expected_duration("db.proc", "v1") is None
+
+    store.record_duration("db.proc", "v1", 10.0)
+    store.record_duration("db.proc", "v1", 20.0)
+    assert store.expected_duration("db.proc", "v1") == 15.0
+    assert store.expected_duration("db.proc", "v2") == 15.0
+    store.record_duration("db.proc", "v2", 4.0)
+    assert store.expected_duration("db.proc", "v1") == 15.0
+    assert store.expected_duration("db.proc", "v2") == 4.0
+
+
+def test_state_store_counts_durations_recorded_from_many_threads(tmp_path):
+    store = ms.PvsStateStore(str(tmp_path / "pvs.sqlite"))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: store.record_duration("db.proc", "v1", 1.0), range(200)))
+
+    assert store._db.execute("SELECT runs FROM durations").fetchone() == (200,)
+    store.close()
+
+
+def test_state_store_keeps_version_1_contents(tmp_path):
+    import sqlite3
+    state_path = str(tmp_path / "pvs.sqlite")
+    db = sqlite3.connect(state_path)
+    db.executescript("""
+        CREATE TABLE sql_files (content_hash TEXT PRIMARY KEY, definitions TEXT NOT NULL);
+        CREATE TABLE procedures (procedure TEXT PRIMARY KEY, definition_hash TEXT NOT NULL,
+                                 succeeded INTEGER NOT NULL, duration REAL NOT NULL, recorded_at TEXT NOT NULL);
+        INSERT INTO procedures VALUES ('db.proc', 'abc', 1, 2.5, '2024-01-01T00:00:00Z');
+        PRAGMA user_version = 1;
+    """)
+    db.close()
+
+    store = ms.PvsStateStore(state_path)
+    store.record_duration("db.proc", "abc", 2.5)
+    assert store.last_outcome("db.proc") == ("abc", True, 2.5)
+    assert store.expected_duration("db.proc", "abc") == 2.5
+
+
+def test_plan_schedule_starts_longest_procedures_first():
+    estimates = {"A()": 1.0, "B()": 1.0, "C()": 20.0, "D()": 20.0, "F()": 3.0}
+    schedule = ms.plan_schedule([["A()", "B()", "C()", "D()", "E()"], ["F()"]], estimates, ["E()"], concurrency=2)
+
+    assert schedule.waves == [["C()", "D()", "E()", "A()", "B()"], ["F()"]]
+    assert schedule.default_estimate == 3.0
+    assert schedule.wave_makespans == [23.0, 3.0]
+    assert schedule.makespan == 26.0
+    assert schedule.timeline["E()"] == (20.0, 23.0)
+    assert schedule.timeline["F()"] == (23.0, 26.0)
+    assert schedule.unknown == ["E()"]
+
+
+def test_plan_schedule_sums_batches_and_handles_no_history():
+    schedule = ms.plan_schedule([["A()", "B()", "C()"]], {}, ["A()", "B()", "C()"], concurrency=4, batch_size=2)
+
+    assert schedule.waves == [["A()", "B()", "C()"]]
+    assert schedule.makespan == 0.0
+
+    schedule = ms.plan_schedule([["A()", "B()", "C()"]], {"A()": 1.0, "B()": 2.0, "C()": 4.0}, [], concurrency=4,
+                                batch_size=2)
+    assert schedule.timeline == {"C()": (0.0, 4.0), "B()": (4.0, 6.0), "A()": (0.0, 1.0)}
+    assert schedule.makespan == 6.0
+
+
+def test_state_store_recreates_unreadable_file(tmp_path):
+    state_path = tmp_path / "pvs.sqlite"
+    state_path.write_text("not a database " * 100)
+    store = ms.PvsStateStore(str(state_path))
+    store.record_outcome("db.proc", "abc", True, 1.5)
+    assert store.last_outcome("db.proc") == ("abc", True, 1.5)
+    assert store.last_outcome("db.other") is None
+
+
+@patch("pvs_testing.teradatasql.connect")
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.fetch_all_sql_files")
+def test_main_changed_mode_only_runs_changed_procedures_and_dependents(mock_fetch, mock_exec_query, mock_connect,
+                                                                      tmp_path, monkeypatch):
+    sql_file = tmp_path / "procs.sql"
+    sql = """
+        REPLACE PROCEDURE RPT${dbEnv}.BUILD_REPORT() BEGIN CALL STG${dbEnv}.LOAD_CLAIMS(); END;
+        REPLACE PROCEDURE STG${dbEnv}.LOAD_CLAIMS() BEGIN INSERT INTO STG${dbEnv}.CLAIMS VALUES (1); END;
+        REPLACE PROCEDURE OTHER${dbEnv}.ALONE() BEGIN INSERT INTO OTHER${dbEnv}.T VALUES (1); END;
+    """
+    sql_file.write_text(sql)
+    mock_fetch.return_value = [str(sql_file)]
+    monkeypatch.setenv("FOLDER_LIST", f'["{tmp_path}"]')
+    monkeypatch.setenv("PVS_STATE_PATH", str(tmp_path / "pvs.sqlite"))
+    monkeypatch.setenv("PVS_RUN_MODE", "changed")
+    queries = []
+
+    def execute(td_conn, query):
+        queries.append(query)
+        return {"RESPONSE": ["PASSED"]}
+
+    mock_exec_query.side_effect = execute
+    with patch.object(ms.PvsStateStore, "close", autospec=True, side_effect=ms.PvsStateStore.close) as mock_close:
+        ms.main()
+    assert len(queries) == 5
+    mock_close.assert_called_once()
+
+    queries.clear()
+    ms.main()
+    assert queries[1:-1] == []
+
+    queries.clear()
+    sql_file.write_text(sql.replace("CLAIMS VALUES (1)", "CLAIMS VALUES (2)"))
+    ms.main()
+    assert queries[1:-1] == ["CALL STG.LOAD_CLAIMS()", "CALL RPT.BUILD_REPORT()"]
+
+    queries.clear()
+    monkeypatch.setenv("PVS_RUN_MODE", "full")
+    ms.main()
+    assert len(queries) == 5
+
+
+def test_execute_tdv_batch_maps_result_sets_to_statements():
+    td_conn, cursor = _mock_conn(description=[("PROC_MSG",)], rows=[("first",)])
+    cursor.nextset.side_effect = [True, False]
+    results = ms.execute_tdv_batch(td_conn, ["CALL db.a(MSG)", "CALL db.b()", "CALL db.c()"])
+
+    cursor.execute.assert_called_once_with("CALL db.a(MSG);CALL db.b();CALL db.c()")
+    assert [len(result) for result in results] == [1, 0, 0]
+    assert results[0]["PROC_MSG"] == ["first"]
+
+
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.execute_tdv_batch")
+@patch("pvs_testing.teradatasql.connect")
+def test_run_procedures_in_batches(mock_connect, mock_exec_batch, mock_exec_query):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    mock_exec_batch.side_effect = lambda td_conn, queries: [ms.QueryResult(["Q"], [(query,)]) for query in queries]
+    with ms.TeradataConnectionPool(2) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, [f"db.p{n}()" for n in range(5)], 2, batch_size=2)
+
+    assert [outcome.procedure for outcome in outcomes] == [f"db.p{n}()" for n in range(5)]
+    assert all(outcome.succeeded for outcome in outcomes)
+    assert outcomes[3].result["Q"] == ["CALL db.p3()"]
+    assert [outcome.batch_size for outcome in outcomes] == [2, 2, 2, 2, 1]
+    assert mock_exec_batch.call_count == 2
+    mock_exec_query.assert_called_once_with(td_conn=ANY, query="CALL db.p4()")
+
+
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.execute_tdv_batch", side_effect=Exception("batch failed"))
+@patch("pvs_testing.teradatasql.connect")
+def test_failed_batch_falls_back_to_single_calls(mock_connect, mock_exec_batch, mock_exec_query):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+
+    def execute(td_conn, query):
+        if "bad" in query:
+            raise Exception("procedure failed")
+        return ms.QueryResult([], [])
+
+    mock_exec_query.side_effect = execute
+    with ms.TeradataConnectionPool(1) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, ["db.a()", "db.bad()", "db.c()", "db.d()"], 1, batch_size=2)
+
+    assert [outcome.succeeded for outcome in outcomes] == [True, False, True, True]
+    assert outcomes[1].error == "procedure failed"
+    assert mock_exec_batch.call_count == 2
+
+
+@patch("pvs_testing.execute_tdv_query", return_value=ms.QueryResult([], []))
+@patch("pvs_testing.execute_tdv_batch", side_effect=Exception("CALL must be the only statement in a request"))
+@patch("pvs_testing.teradatasql.connect")
+def test_rejected_batching_is_not_retried(mock_connect, mock_exec_batch, mock_exec_query):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    with ms.TeradataConnectionPool(1) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, [f"db.p{n}()" for n in range(6)], 1, batch_size=2)
+
+    assert all(outcome.succeeded for outcome in outcomes)
+    assert mock_exec_batch.call_count == 1
+    assert mock_exec_query.call_count == 6
+
+
+@patch("pvs_testing.teradatasql.connect")
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.extract_proc_names_from_file", return_value=["mydb${dbEnv}.good", "mydb${dbEnv}.bad"])
+@patch("pvs_testing.fetch_all_sql_files", return_value=["/fake/path/file.sql"])
+def test_main_writes_run_report_on_failure(mock_fetch, mock_extract, mock_exec_query, mock_connect, tmp_path,
+                                           monkeypatch):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    for name, file_name in [("PVS_REPORT_PATH", "report.json"), ("GITHUB_STEP_SUMMARY", "summary.md"),
+                            ("PVS_METRICS_PATH", "metrics.prom")]:
+        monkeypatch.setenv(name, str(tmp_path / file_name))
+    monkeypatch.setenv("FOLDER_LIST", '["/fake/path"]')
+    monkeypatch.setenv("ChangeTicket_Num", "1234")
+    monkeypatch.setenv("CTASK_NUM", "5678")
+
+    def execute(td_conn, query):
+        if "bad" in query:
+            raise Exception("procedure failed")
+        if "good" in query:
+            return ms.QueryResult(["PROC_MSG"], [("done",)])
+        return ms.QueryResult(["RESPONSE"], [("PASSED",)])
+
+    mock_exec_query.side_effect = execute
+    with pytest.raises(SystemExit):
+        ms.main()
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["work_item"] == "CHG1234_CTASK5678"
+    assert report["verdict"] == "PASSED"
+    assert {"discovery", "extraction", "planning", "start", "procedures", "end", "logon"} <= set(report["phases"])
+    procedures = {entry["procedure"]: entry for entry in report["procedures"]}
+    assert procedures["mydb.good()"]["rows"] == 1
+    assert procedures["mydb.good()"]["connection_id"] == 0
+    assert procedures["mydb.bad()"]["error"] == "procedure failed"
+
+    summary = (tmp_path / "summary.md").read_text()
+    assert "| `mydb.bad()` | FAILED |" in summary
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'pvs_procedure_succeeded{procedure="mydb.bad()"} 0.000000' in metrics
+    assert 'pvs_phase_seconds{phase="start"}' in metrics
+
+
+def test_run_report_escapes_prometheus_labels():
+    report = ms.RunReport()
+    report.outcomes.append(ms.ProcedureOutcome('db.p(\'a"b\')', True, duration=1.5, rows=3))
+    assert 'pvs_procedure_rows{procedure="db.p(\'a\\"b\')"} 3.000000' in report.prometheus_text()
+
+
+def _hanging_connection(**kwargs):
+    td_conn = MagicMock()
+    cancelled = threading.Event()
+    td_conn.cancel.side_effect = cancelled.set
+    td_conn.cancelled = cancelled
+    return td_conn
+
+
+def _execute_until_cancelled(td_conn, query):
+    if "slow" in query:
+        if not td_conn.cancelled.wait(5):
+            raise AssertionError("request was never cancelled")
+        raise Exception("request aborted by user")
+    return ms.QueryResult([], [])
+
+
+@patch("pvs_testing.execute_tdv_query", side_effect=_execute_until_cancelled)
+@patch("pvs_testing.teradatasql.connect", side_effect=_hanging_connection)
+def test_procedure_timeout_cancels_request_and_continues(mock_connect, mock_exec_query):
+    limits = ms.RunLimits(procedure_timeout=0.05)
+    with ms.TeradataConnectionPool(1) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, ["db.slow()", "db.fast()"], 1, limits=limits)
+
+    assert [outcome.status for outcome in outcomes] == ["TIMED OUT", "passed"]
+    assert "cancelled" in outcomes[0].error
+    assert mock_connect.call_count == 1
+
+
+@patch("pvs_testing.execute_tdv_query", side_effect=_execute_until_cancelled)
+@patch("pvs_testing.teradatasql.connect", side_effect=_hanging_connection)
+def test_abort_policy_skips_procedures_after_a_timeout(mock_connect, mock_exec_query):
+    limits = ms.RunLimits(procedure_timeout=0.05, abort_on_timeout=True)
+    with ms.TeradataConnectionPool(1) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, ["db.slow()", "db.fast()", "db.other()"], 1, limits=limits)
+
+    assert [outcome.status for outcome in outcomes] == ["TIMED OUT", "SKIPPED", "SKIPPED"]
+    assert mock_exec_query.call_count == 1
+
+
+@patch("pvs_testing.execute_tdv_query", side_effect=_execute_until_cancelled)
+@patch("pvs_testing.teradatasql.connect", side_effect=_hanging_connection)
+def test_deadline_cancels_in_flight_request_and_skips_the_rest(mock_connect, mock_exec_query):
+    limits = ms.RunLimits(deadline=0.05)
+    with ms.TeradataConnectionPool(1) as pool:
+        outcomes = ms.run_procedures_concurrently(pool, ["db.slow()", "db.fast()"], 1, limits=limits)
+
+    assert [outcome.status for outcome in outcomes] == ["TIMED OUT", "SKIPPED"]
+
+
+@patch("pvs_testing.run_procedures_concurrently", side_effect=RuntimeError("worker crashed"))
+@patch("pvs_testing.teradatasql.connect")
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.extract_proc_names_from_file", return_value=["mydb${dbEnv}.good"])
+@patch("pvs_testing.fetch_all_sql_files", return_value=["/fake/path/file.sql"])
+def test_main_always_ends_the_pvs_test(mock_fetch, mock_extract, mock_exec_query, mock_connect, mock_run,
+                                       monkeypatch):
+    monkeypatch.setenv("FOLDER_LIST", '["/fake/path"]')
+    queries = []
+    mock_exec_query.side_effect = lambda td_conn, query: queries.append(query) or {"RESPONSE": ["PASSED"]}
+    with pytest.raises(RuntimeError, match="worker crashed"):
+        ms.main()
+
+    assert "START_PVS_TEST" in queries[0]
+    assert "END_PVS_TEST" in queries[-1]
+
+
+def test_verdict_from_rows_covers_every_row():
+    assert ms.verdict_from_rows([{"TEST_STATUS": "PASSED"}, {"TEST_STATUS": "Completed"}]).status == "PASSED"
+    assert ms.verdict_from_rows([{"TEST_STATUS": "PASSED"}, {"TEST_STATUS": "ERROR"}]).status == "FAILED"
+    assert ms.verdict_from_rows([{"TEST_STATUS": "PASSED"}, {"TEST_STATUS": "RUNNING"}]).status == "PENDING"
+    # Statuses are matched exactly, not by the words they contain
+    assert ms.verdict_from_rows([{"TEST_STATUS": "INCOMPLETE"}]).status == "PENDING"
+    assert ms.verdict_from_rows([{"TEST_STATUS": "ERROR_CHECK_RUNNING"}]).status == "PENDING"
+    assert ms.verdict_from_rows([]).status == "PENDING"
+
+
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.teradatasql.connect")
+def test_poll_pvs_status_backs_off_until_a_verdict(mock_connect, mock_exec_query):
+    statuses = iter(["RUNNING", "RUNNING", "RUNNING", "PASSED"])
+    mock_exec_query.side_effect = lambda td_conn, query: ms.QueryResult(["TEST_STATUS"], [(next(statuses),)])
+    sleeps = []
+    with ms.TeradataConnectionPool(1) as pool:
+        verdict = ms.poll_pvs_status(pool, "select", deadline=60, initial_delay=1, backoff=2, max_delay=3,
+                                     sleep=sleeps.append)
+
+    assert verdict.passed
+    assert verdict.polls == 4
+    assert verdict.rows == [{"TEST_STATUS": "PASSED"}]
+    assert sleeps == [1, 2, 3]
+
+
+@patch("pvs_testing.execute_tdv_query")
+@patch("pvs_testing.teradatasql.connect")
+def test_poll_pvs_status_ignores_rows_of_an_earlier_run(mock_connect, mock_exec_query):
+    polls = iter([[("OLD", "PASSED")], [("OLD", "PASSED")], [("OLD", "PASSED"), ("NEW", "FAILED")]])
+    mock_exec_query.side_effect = lambda td_conn, query: ms.QueryResult(["RUN", "TEST_STATUS"], next(polls))
+    with ms.TeradataConnectionPool(1) as pool:
+        verdict = ms.poll_pvs_status(pool, "select", deadline=60, sleep=lambda seconds: None,
+                                     stale_rows=[("OLD", "PASSED")], end_returned=lambda: False)
+
+    assert verdict.status == "FAILED"
+    assert verdict.polls == 3
+    assert verdict.rows == [{"RUN": "NEW", "TEST_STATUS": "FAILED"}]
+
+
+@patch("pvs_testing.execute_tdv_query", return_value=ms.QueryResult(["TEST_STATUS"], [("PASSED",)]))
+@patch("pvs_testing.teradatasql.connect")
+def test_poll_pvs_status_takes_an_unchanged_row_once_end_returned(mock_connect, mock_exec_query):
+    ended = iter([False, False, True])
+    with ms.TeradataConnectionPool(1) as pool:
+        verdict = ms.poll_pvs_status(pool, "select", deadline=60, sleep=lambda seconds: None,
+                                     stale_rows=[("PASSED",)], end_returned=lambda: next(ended))
+
+    assert verdict.passed
+    assert verdict.polls == 3
+
+
+@patch("pvs_testing.execute_tdv_query", return_value=ms.QueryResult(["TEST_STATUS"], [("RUNNING",)]))
+@patch("pvs_testing.teradatasql.connect")
+def test_poll_pvs_status_stops_at_the_deadline(mock_connect, mock_exec_query):
+    with ms.TeradataConnectionPool(1) as pool:
+        verdict = ms.poll_pvs_status(pool, "select", deadline=0.05, initial_delay=0.01, max_delay=0.01)
+
+    assert verdict.status == "PENDING"
+    assert not verdict.passed
+    assert verdict.polls >= 2
+
+
+def test_fetch_all_sql_files_walks_path_to_sql_recursively(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    (tmp_path / "pyproject.toml").write_text('[data-ops-config]\ntype = "stored_proc"\npath-to-sql = ["procedures", "missing"]\n')
+    for relative_path in ["procedures/a.sql", "procedures/nested/deep/b.SQL", "procedures/__pycache__/c.sql",
+                          "procedures/archive/d.sql", "procedures/notes.txt", "tables/ignored.sql"]:
+        (tmp_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / relative_path).write_text("")
+    layout = ms.SqlLayout(exclude_globs=ms.DEFAULT_SQL_EXCLUDE_GLOBS + ("archive",))
+
+    assert ms.fetch_all_sql_files(str(tmp_path), layout) == [str(tmp_path / "procedures" / "a.sql"),
+                                                             str(tmp_path / "procedures" / "nested" / "deep" / "b.SQL")]
+    assert any("No missing directory" in msg for msg in caplog.messages)
+    (tmp_path / "pyproject.toml").unlink()
+    assert ms.fetch_all_sql_files(str(tmp_path), ms.SqlLayout(("tables", "procedures/nested"))) == [
+        str(tmp_path / "procedures" / "nested" / "deep" / "b.SQL"), str(tmp_path / "tables" / "ignored.sql")]
+
+
+@pytest.mark.parametrize("directory_list, expected", [
+    ('["tables", "procedures"]', ("tables", "procedures")), ("tables procedures", ("tables", "procedures")),
+    ("", ("tables",)), ("[not json", ("tables",))])
+def test_sql_layout_from_env(monkeypatch, directory_list, expected):
+    monkeypatch.setenv("DIRECTORY_LIST", directory_list)
+    monkeypatch.setenv("PVS_SQL_EXCLUDE", "archive, tmp_*")
+
+    layout = ms.SqlLayout.from_env()
+
+    assert layout.directories == expected
+    assert layout.is_excluded("archive") and layout.is_excluded("nested/tmp_1") and not layout.is_excluded("tables")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_scan_sql_files_streams_results_before_later_folders_are_listed(tmp_path, workers):
+    listed = []
+    for folder in ["first", "second"]:
+        (tmp_path / folder / "tables").mkdir(parents=True)
+        for number in range(5):
+            (tmp_path / folder / "tables" / f"p{number}.sql").write_text(
+                f"REPLACE PROCEDURE DB${{dbEnv}}.{folder.upper()}_{number}() BEGIN END;")
+
+    def folder_sources():
+        for folder in ["first", "second"]:
+            listed.append(folder)
+            yield str(tmp_path / folder), None
+
+    stream = ms.scan_sql_files(folder_sources(), ms.RunReport(), workers=workers)
+    sql_file, procs, dependencies = next(stream)
+
+    assert listed == ["first"]
+    assert sql_file == str(tmp_path / "first" / "tables" / "p0.sql")
+    assert procs == ["DB${dbEnv}.FIRST_0()"] and list(dependencies) == ["db.first_0"]
+    assert [procs for _, procs, _ in stream][-1] == ["DB${dbEnv}.SECOND_4()"]
+
+
+@patch("pvs_testing.teradatasql.connect")
+def test_connection_pool_prefill_logs_on_in_the_background(mock_connect):
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    pool = ms.TeradataConnectionPool(2, host="h")
+
+    pool.prefill().join()
+    pool.prefill().join()
+    with pool.connection() as td_conn:
+        assert td_conn is pool._connections[0]
+
+    assert mock_connect.call_count == 1
+    mock_connect.side_effect = Exception("LDAP down")
+    failing = ms.TeradataConnectionPool(1)
+    failing.prefill().join()
+    assert failing._connections == []
+    mock_connect.side_effect = lambda **kwargs: MagicMock()
+    with failing.connection() as td_conn:
+        assert td_conn is failing._connections[0]
+
+
+@patch("pvs_testing.teradatasql.connect")
+def test_connection_pool_logs_on_in_parallel(mock_connect):
+    logons_running = threading.Barrier(3, timeout=5)
+
+    def connect(**kwargs):
+        # Passes only once all three logons run at the same time
+        logons_running.wait()
+        return MagicMock()
+
+    mock_connect.side_effect = connect
+    pool = ms.TeradataConnectionPool(3)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        sessions = list(executor.map(lambda _: pool.acquire(), range(3)))
+
+    assert len({id(td_conn) for td_conn in sessions}) == 3
+    assert len(pool._connections) == 3
+
+
+@patch("pvs_testing.teradatasql.connect")
+def test_connection_pool_waiter_takes_over_a_failed_logon(mock_connect):
+    first_logon = threading.Event()
+    attempts = []
+
+    def connect(**kwargs):
+        attempts.append(threading.current_thread().name)
+        if len(attempts) == 1:
+            first_logon.wait(5)
+            raise Exception("LDAP down")
+        return MagicMock()
+
+    mock_connect.side_effect = connect
+    pool = ms.TeradataConnectionPool(1)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        failing = executor.submit(pool.acquire)
+        while not attempts:
+            time.sleep(0.001)
+        waiting = threading.Thread(target=lambda: attempts.append(pool.acquire()))
+        waiting.start()
+        first_logon.set()
+        with pytest.raises(Exception, match="LDAP down"):
+            failing.result()
+        waiting.join(5)
+
+    assert not waiting.is_alive()
+    assert pool._connections == [attempts[-1]]